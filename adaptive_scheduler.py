@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Lịch chạy chu kỳ phát hiện thích ứng theo tải
+
+Khi yên tĩnh, chu kỳ dài (max_interval) để tiết kiệm CPU. Chu kỳ bị rút ngắn
+ngay khi:
+- có IP / dải đạt near_ratio ngưỡng chặn (càng gần ngưỡng càng ngắn), hoặc
+- tổng SYN / kết nối toàn máy vượt rise_factor lần mức nền (EWMA)
+rồi giãn dần (nhân backoff) sau calm_cycles chu kỳ yên tĩnh liên tiếp.
+
+Kèm số liệu: thời gian xử lý mỗi chu kỳ và thời gian phát hiện (từ lúc IP
+đạt near_ratio ngưỡng đến lúc bị chặn).
+"""
+
+from collections import deque
+
+
+def scale_levels(levels, weight, carry):
+    """Quy số đo dạng mức (số socket tại một thời điểm) về đơn vị một chu kỳ chuẩn
+
+    Cửa sổ trượt cộng dồn mẫu của mỗi chu kỳ; nếu lấy mẫu dày hơn thì mỗi mẫu
+    chỉ được tính với trọng số weight = thời gian giữa hai mẫu / chu kỳ chuẩn,
+    để ngưỡng giữ nguyên ý nghĩa. Phần lẻ được giữ trong carry cho mẫu sau.
+    """
+    if weight == 1:
+        carry.clear()
+        return levels
+    scaled = {}
+    remainder = {}
+    for key, count in levels.items():
+        value = count * weight + carry.get(key, 0.0)
+        whole = int(value)
+        if whole:
+            scaled[key] = whole
+        remainder[key] = value - whole
+    carry.clear()
+    carry.update(remainder)
+    return scaled
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class AdaptiveScheduler:
+    def __init__(self, min_interval, max_interval, near_ratio=0.5, rise_factor=2.0,
+                 backoff=1.5, calm_cycles=3, alpha=0.1, history=256):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.near_ratio = near_ratio
+        self.rise_factor = rise_factor
+        self.backoff = backoff
+        self.calm_cycles = calm_cycles
+        self.alpha = alpha
+
+        self.interval = max_interval
+        self.hot = False
+        self.baseline = {}  # tên số đo -> mức nền EWMA
+        self._calm = 0
+        self.cycle_times = deque(maxlen=history)
+        self.detect_times = deque(maxlen=history)
+        self.cycles = 0
+        self.detections = 0
+
+    def configure(self, min_interval, max_interval, near_ratio, rise_factor, backoff):
+        """Đổi tham số khi nạp lại cấu hình, giữ mức nền và số liệu"""
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.near_ratio = near_ratio
+        self.rise_factor = rise_factor
+        self.backoff = backoff
+        self.interval = min(max(self.interval, min_interval), max_interval)
+
+    def _rising(self, totals, floors):
+        """Tổng toàn máy tăng vọt so với mức nền, đồng thời cập nhật mức nền"""
+        rising = False
+        for name, value in totals.items():
+            base = self.baseline.get(name)
+            if base is None:
+                self.baseline[name] = float(value)
+                continue
+            surge = value > self.rise_factor * base and value >= floors.get(name, 0)
+            rising = rising or surge
+            # Khi đang tăng vọt, mức nền chỉ bám theo rất chậm để tấn công kéo dài
+            # không trở thành "bình thường" ngay
+            alpha = self.alpha / 10 if surge else self.alpha
+            self.baseline[name] = base + alpha * (value - base)
+        return rising
+
+    def update(self, peak_ratio, totals, floors=None):
+        """Tính chu kỳ kế tiếp
+
+        peak_ratio: tỉ lệ (số đếm / ngưỡng) lớn nhất trong các IP chưa bị chặn
+        totals: {tên: tổng toàn máy của chu kỳ, cùng đơn vị giữa các chu kỳ}
+        floors: {tên: tổng tối thiểu để coi là tăng vọt}
+        """
+        rising = self._rising(totals, floors or {})
+        near = peak_ratio >= self.near_ratio
+        self.hot = rising or near
+
+        if self.hot:
+            self._calm = 0
+            if rising or peak_ratio >= 1:
+                target = self.min_interval
+            else:
+                # Nội suy: near_ratio -> max_interval, 1.0 -> min_interval
+                span = max(1 - self.near_ratio, 1e-9)
+                closeness = (peak_ratio - self.near_ratio) / span
+                target = self.max_interval - closeness * (self.max_interval - self.min_interval)
+            self.interval = max(self.min_interval, min(self.interval, target))
+        else:
+            self._calm += 1
+            if self._calm >= self.calm_cycles:
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+    def record_cycle(self, duration):
+        self.cycles += 1
+        self.cycle_times.append(duration)
+
+    def record_detection(self, delay):
+        self.detections += 1
+        self.detect_times.append(delay)
+
+    def stats(self):
+        cycles = list(self.cycle_times)
+        detects = list(self.detect_times)
+        return {
+            'interval': self.interval,
+            'hot': self.hot,
+            'cycles': self.cycles,
+            'cycle_avg': sum(cycles) / len(cycles) if cycles else 0.0,
+            'cycle_p95': _percentile(cycles, 0.95),
+            'cycle_max': max(cycles) if cycles else 0.0,
+            'detections': self.detections,
+            'detect_avg': sum(detects) / len(detects) if detects else 0.0,
+            'detect_p95': _percentile(detects, 0.95),
+        }
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Kho alert chỉ ghi nối (append-only) dùng chung cho daemon, GUI và web
+
+File alert là NDJSON: mỗi dòng một object JSON. Daemon ghi qua AlertWriter:
+alert được đưa vào hàng đợi và một thread nền ghi theo lô (write-behind),
+mỗi lô là một lần write() nối vào cuối file nên người đọc không bao giờ thấy
+dữ liệu ghi dở (dòng chưa có '\\n' ở cuối bị bỏ qua).
+
+File được xoay vòng khi vượt max_bytes hoặc khi alert đầu tiên cũ hơn
+max_age: file hiện tại thành <path>.1, <path>.1 thành <path>.2, ...
+
+Bên cạnh mỗi file có chỉ mục <path>.idx: mỗi lô thêm một dòng
+"<timestamp alert đầu lô> <offset>". AlertReader dùng chỉ mục này để đọc
+"các alert từ thời điểm T" hoặc "N alert mới nhất" mà không parse toàn bộ
+lịch sử. Khi mở file, AlertWriter cắt dòng ghi dở còn sót (vd máy tắt giữa
+chừng) và dựng lại chỉ mục nếu thiếu hoặc trỏ ra ngoài file.
+"""
+
+import json
+import os
+import threading
+import time
+import logging
+from bisect import bisect_right
+from collections import deque
+
+from metrics import Counter, Histogram
+
+ALERT_FILE = '/var/log/firewall_alerts.json'
+
+WRITE_SECONDS = Histogram('firewall_alert_write_seconds',
+                          'Thời gian ghi một lô alert (kể cả fsync)')
+WRITTEN = Counter('firewall_alerts_written', 'Số alert đã ghi xuống file')
+WRITE_ERRORS = Counter('firewall_alert_write_errors', 'Số lô alert ghi lỗi')
+
+# Chính sách fsync:
+# - 'always': ghi và fsync ngay trong write(), không dùng write-behind
+# - 'batch': fsync sau mỗi lô của thread nền
+# - 'never': để hệ điều hành tự đẩy xuống đĩa
+FSYNC_POLICIES = ('always', 'batch', 'never')
+
+INDEX_SUFFIX = '.idx'
+# Số alert giữa hai dòng chỉ mục khi dựng lại chỉ mục
+INDEX_STRIDE = 256
+
+
+def _segment_path(path, number):
+    return path if number == 0 else f"{path}.{number}"
+
+
+def _index_path(segment):
+    return segment + INDEX_SUFFIX
+
+
+def _alert_time(alert):
+    try:
+        return float(alert.get('timestamp') or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+
+
+def _parse_lines(data):
+    """Parse các dòng NDJSON hoàn chỉnh, bỏ dòng hỏng và dòng ghi dở cuối cùng"""
+    alerts = []
+    end = data.rfind(b'\n')
+    if end < 0:
+        return alerts
+    for line in data[:end].split(b'\n'):
+        if not line.strip():
+            continue
+        try:
+            alert = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(alert, dict):
+            alerts.append(alert)
+    return alerts
+
+
+def _load_legacy(path):
+    """File định dạng cũ: một mảng JSON duy nhất"""
+    try:
+        with open(path, 'r') as f:
+            alerts = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if isinstance(alerts, dict):
+        return [alerts]
+    return [a for a in alerts if isinstance(a, dict)] if isinstance(alerts, list) else []
+
+
+def _is_legacy(path):
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(64).lstrip()
+    except OSError:
+        return False
+    return head.startswith(b'[')
+
+
+def _load_index(segment):
+    """Đọc chỉ mục của một file -> (danh sách timestamp, danh sách offset)"""
+    times, offsets = [], []
+    try:
+        with open(_index_path(segment), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return times, offsets
+    for line in data.split(b'\n'):
+        parts = line.split()
+        if len(parts) != 2:
+            continue
+        try:
+            ts, offset = float(parts[0]), int(parts[1])
+        except ValueError:
+            continue
+        times.append(ts)
+        offsets.append(offset)
+    return times, offsets
+
+
+def _rebuild_index(segment, data):
+    """Ghi lại chỉ mục của segment từ nội dung file, mỗi INDEX_STRIDE alert một dòng"""
+    lines = []
+    offset = 0
+    count = 0
+    for line in data.split(b'\n')[:-1]:
+        start, offset = offset, offset + len(line) + 1
+        if count % INDEX_STRIDE == 0:
+            # Dòng chỉ mục phải trỏ tới một alert đọc được
+            try:
+                alert = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(alert, dict):
+                continue
+            lines.append(f"{_alert_time(alert)} {start}\n")
+        count += 1
+    tmp = _index_path(segment) + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(''.join(lines).encode())
+    os.replace(tmp, _index_path(segment))
+    return len(lines)
+
+
+class AlertWriter:
+    """Ghi alert theo lô vào file NDJSON, có xoay vòng và chỉ mục thời gian"""
+
+    def __init__(self, path=ALERT_FILE, max_bytes=10 * 1024 * 1024, max_age=86400,
+                 backups=5, fsync='batch', flush_interval=1.0, batch_size=256):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync phải là một trong {FSYNC_POLICIES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self.written = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._index = None
+        self._size = 0
+        self._first_ts = None
+
+    # ---------- API ----------
+    def append(self, alert):
+        """Thêm một alert; với fsync='always' alert đã nằm trên đĩa khi hàm trả về"""
+        if self.fsync == 'always':
+            with self._io_lock:
+                self._write_batch([alert])
+            return
+        with self._lock:
+            self._queue.append(alert)
+            queued = len(self._queue)
+        if self._thread is None:
+            self.start()
+        if queued >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='alert-writer', daemon=True)
+        self._thread.start()
+
+    def flush(self):
+        """Ghi ngay mọi alert đang chờ"""
+        with self._lock:
+            batch, self._queue = list(self._queue), deque()
+        if batch:
+            with self._io_lock:
+                self._write_batch(batch)
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        with self._io_lock:
+            self._close_files()
+
+    # ---------- thread nền ----------
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Lỗi ghi alert: {e}")
+
+    # ---------- ghi file ----------
+    def _open(self):
+        if self._file is not None:
+            return
+        if _is_legacy(self.path):
+            self._migrate_legacy()
+        else:
+            self._repair()
+        self._file = open(self.path, 'ab')
+        self._index = open(_index_path(self.path), 'ab')
+        self._size = self._file.seek(0, os.SEEK_END)
+        times, _ = _load_index(self.path)
+        self._first_ts = times[0] if times else None
+
+    def _migrate_legacy(self):
+        """Đổi file mảng JSON cũ sang NDJSON (chỉ chạy một lần)"""
+        alerts = _load_legacy(self.path)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(json.dumps(a, ensure_ascii=False).encode() + b'\n' for a in alerts))
+        with open(_index_path(tmp), 'wb') as f:
+            if alerts:
+                f.write(f"{_alert_time(alerts[0])} 0\n".encode())
+        os.replace(_index_path(tmp), _index_path(self.path))
+        os.replace(tmp, self.path)
+        logging.info(f"Đã chuyển {len(alerts)} alert sang định dạng NDJSON")
+
+    def _repair(self):
+        """Cắt dòng ghi dở ở cuối file, dựng lại chỉ mục nếu thiếu hoặc không khớp file"""
+        try:
+            f = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    f.seek(0)
+                    end = f.read().rfind(b'\n') + 1
+                    f.truncate(end)
+                    logging.warning(f"Bỏ {size - end} byte ghi dở ở cuối {self.path}")
+                    size = end
+            _, offsets = _load_index(self.path)
+            if (offsets[-1] < size) if offsets else size == 0:
+                return
+            f.seek(0)
+            entries = _rebuild_index(self.path, f.read(size))
+        logging.warning(f"Đã dựng lại chỉ mục {_index_path(self.path)} ({entries} dòng)")
+
+    def _close_files(self):
+        for f in (self._file, self._index):
+            if f is not None:
+                f.close()
+        self._file = self._index = None
+
+    def _should_rotate(self, now):
+        if self._size == 0:
+            return False
+        if self.max_bytes and self._size >= self.max_bytes:
+            return True
+        return bool(self.max_age) and self._first_ts is not None and now - self._first_ts >= self.max_age
+
+    def _rotate(self):
+        self._close_files()
+        for number in range(self.backups, 0, -1):
+            src = _segment_path(self.path, number - 1)
+            dst = _segment_path(self.path, number)
+            for a, b in ((src, dst), (_index_path(src), _index_path(dst))):
+                if os.path.exists(a):
+                    os.replace(a, b)
+        if self.backups == 0:
+            for segment in (self.path, _index_path(self.path)):
+                if os.path.exists(segment):
+                    os.remove(segment)
+        self._open()
+
+    def _write_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception:
+            WRITE_ERRORS.inc()
+            raise
+        WRITE_SECONDS.observe(time.perf_counter() - started)
+        WRITTEN.inc(len(batch))
+
+    def _write(self, batch):
+        first_ts = _alert_time(batch[0])
+        self._open()
+        if self._should_rotate(first_ts):
+            self._rotate()
+        data = b''.join(json.dumps(a, ensure_ascii=False).encode() + b'\n' for a in batch)
+        # Chỉ mục trỏ tới đầu lô; được ghi sau dữ liệu để không trỏ ra ngoài file
+        self._file.write(data)
+        self._file.flush()
+        self._index.write(f"{first_ts} {self._size}\n".encode())
+        self._index.flush()
+        if self.fsync != 'never':
+            os.fsync(self._file.fileno())
+            os.fsync(self._index.fileno())
+        if self._first_ts is None:
+            self._first_ts = first_ts
+        self._size += len(data)
+        self.written += len(batch)
+
+
+class AlertReader:
+    """Đọc alert từ file hiện tại và các file đã xoay vòng"""
+
+    def __init__(self, path=ALERT_FILE, backups=5):
+        self.path = path
+        self.backups = backups
+        self._follow_inode = None
+        self._follow_offset = 0
+
+    def _segments(self):
+        """Các file còn tồn tại, cũ nhất trước"""
+        segments = [_segment_path(self.path, n) for n in range(self.backups, -1, -1)]
+        return [s for s in segments if os.path.exists(s)]
+
+    def _read_from(self, segment, offset):
+        try:
+            with open(segment, 'rb') as f:
+                f.seek(offset)
+                return _parse_lines(f.read())
+        except OSError:
+            return []
+
+    def since(self, ts, limit=None):
+        """Các alert có timestamp >= ts, cũ trước mới sau"""
+        segments = self._segments()
+        indexes = [_load_index(s) for s in segments]
+
+        # Bỏ qua mọi file cũ hơn file mới nhất bắt đầu trước ts
+        start = 0
+        for i, (times, _) in enumerate(indexes):
+            if times and times[0] <= ts:
+                start = i
+
+        result = []
+        for segment, (times, offsets) in zip(segments[start:], indexes[start:]):
+            if _is_legacy(segment):
+                alerts = _load_legacy(segment)
+            else:
+                i = bisect_right(times, ts) - 1
+                alerts = self._read_from(segment, offsets[i] if i >= 0 else 0)
+            result.extend(a for a in alerts if _alert_time(a) >= ts)
+        if limit is not None:
+            result = result[-limit:]
+        return result
+
+    def _tail(self, segment, count):
+        """Ít nhất count alert cuối của một file (hoặc cả file nếu ít hơn)"""
+        _, offsets = _load_index(segment)
+        if not offsets or offsets[0] != 0:
+            offsets = [0] + offsets
+        try:
+            with open(segment, 'rb') as f:
+                # Lùi theo chỉ mục, mỗi lần gấp đôi số lô, đến khi đủ count alert
+                step = 1
+                while True:
+                    i = max(len(offsets) - step, 0)
+                    f.seek(offsets[i])
+                    alerts = _parse_lines(f.read())
+                    if len(alerts) >= count or i == 0:
+                        return alerts
+                    step *= 2
+        except OSError:
+            return []
+
+    def recent(self, limit=100):
+        """limit alert mới nhất, mới nhất trước"""
+        collected = []
+        for segment in reversed(self._segments()):
+            needed = limit - len(collected)
+            if needed <= 0:
+                break
+            if _is_legacy(segment):
+                alerts = _load_legacy(segment)
+            else:
+                alerts = self._tail(segment, needed)
+            collected = alerts[-needed:] + collected
+        collected.reverse()
+        return collected
+
+    def poll(self):
+        """Các alert mới kể từ lần poll trước (lần đầu trả về toàn bộ file hiện tại)"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        alerts = []
+        if st.st_ino != self._follow_inode or st.st_size < self._follow_offset:
+            # File đã xoay vòng: đọc nốt phần chưa đọc của file cũ (nay là <path>.1)
+            previous = _segment_path(self.path, 1)
+            try:
+                if self._follow_inode is not None and os.stat(previous).st_ino == self._follow_inode:
+                    alerts = self._read_from(previous, self._follow_offset)
+            except OSError:
+                pass
+            self._follow_inode = st.st_ino
+            self._follow_offset = 0
+            if _is_legacy(self.path):
+                self._follow_offset = st.st_size
+                return _load_legacy(self.path)
+        elif st.st_size == self._follow_offset or _is_legacy(self.path):
+            return alerts
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._follow_offset)
+                data = f.read()
+        except OSError:
+            return alerts
+        # Chỉ tiến offset tới hết dòng hoàn chỉnh cuối cùng
+        self._follow_offset += data.rfind(b'\n') + 1
+        return alerts + _parse_lines(data)
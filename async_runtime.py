@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Runtime asyncio cho DosDetector
+
+Các task nối với nhau bằng hàng đợi có giới hạn:
+- thu thập: đọc socket (ở thread) theo chu kỳ của lịch thích ứng, nạp lại
+  cấu hình khi file đổi
+- phát hiện: cập nhật cửa sổ, xét ngưỡng / mức nền và đưa quyết định vào batch
+- commit: áp dụng batch lên firewall (ở thread); quyết định sinh ra trong lúc
+  một lần commit còn chạy được gộp vào lần commit kế tiếp
+- alert: ghi alert theo lô (ở thread)
+- drop: đọc bộ đếm drop của firewall (ở thread) theo drop_poll_interval, gia
+  hạn lệnh chặn còn lưu lượng
+- kết nối chậm: lấy tcp_info của các cổng dịch vụ (ở thread) theo
+  slow_conn_interval, chặn IP giữ nhiều kết nối treo
+
+Mọi thay đổi trạng thái của detector diễn ra khi giữ state_lock; I/O firewall
+và ghi file nằm ngoài khoá, nên iptables chậm (vd chờ xtables lock) không làm
+trễ lần đo hay chu kỳ phát hiện kế tiếp.
+"""
+
+import asyncio
+import logging
+import time
+
+from metrics import Counter
+
+DROPPED_SAMPLES = Counter('auto_block_dropped_samples',
+                          'Số lần đo bị bỏ vì phát hiện không theo kịp thu thập')
+DROPPED_ALERTS = Counter('auto_block_dropped_alerts', 'Số alert bị bỏ vì hàng đợi alert đầy')
+SLOW_COMMITS = Counter('auto_block_slow_commits', 'Số lần commit firewall lâu hơn một chu kỳ')
+
+
+class AsyncRuntime:
+    """sample_queue: số lần đo chờ phát hiện tối đa; đầy thì bỏ lần đo cũ nhất
+    alert_queue: số alert chờ ghi tối đa; đầy thì alert mới bị bỏ và ghi log lỗi
+    """
+
+    def __init__(self, detector, sample_queue=2, alert_queue=10000):
+        self.detector = detector
+        self.sample_queue_size = sample_queue
+        self.alert_queue_size = alert_queue
+        self.interval = None
+        self.dropped_samples = 0
+        self.dropped_alerts = 0
+        self.slow_commits = 0
+
+    async def run(self):
+        self.samples = asyncio.Queue(self.sample_queue_size)
+        self.commits = asyncio.Queue(1)
+        self.alerts = asyncio.Queue(self.alert_queue_size)
+        self.state_lock = asyncio.Lock()
+        self.detector.alert_sink = self.enqueue_alert
+        logging.info("Bắt đầu giám sát tự động phát hiện DoS/DDoS (asyncio)...")
+        tasks = [asyncio.create_task(self._collect(), name='collect'),
+                 asyncio.create_task(self._detect(), name='detect'),
+                 asyncio.create_task(self._commit(), name='commit'),
+                 asyncio.create_task(self._write_alerts(), name='alerts'),
+                 asyncio.create_task(self._poll_drops(), name='drops'),
+                 asyncio.create_task(self._poll_slow(), name='slow')]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.detector.alert_sink = None
+            self._append_alerts(self._drain(self.alerts))
+
+    # ---------- thu thập ----------
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                stats = await asyncio.to_thread(self.detector.run_stage, 'collect',
+                                                self.detector.get_network_stats)
+                self._put_sample(stats)
+            except Exception as e:
+                logging.error(f"Lỗi thu thập số liệu: {e}")
+            interval = self.interval or self.detector.scheduler.interval
+            if await self._wait_config(max(interval - (loop.time() - started), 0)):
+                async with self.state_lock:
+                    if self.detector.reload_config():
+                        self.request_commit()
+
+    def _put_sample(self, stats):
+        if self.samples.full():
+            # Phát hiện không theo kịp: bỏ lần đo cũ nhất, giữ số liệu mới
+            self.samples.get_nowait()
+            self.dropped_samples += 1
+            DROPPED_SAMPLES.inc()
+            logging.warning(f"Phát hiện chậm hơn thu thập, bỏ một lần đo "
+                            f"({self.dropped_samples} lần)")
+        self.samples.put_nowait(stats)
+
+    async def _wait_config(self, timeout):
+        """Chờ tối đa timeout giây, True nếu file cấu hình đổi"""
+        watcher = self.detector.config_watcher
+        if watcher is None:
+            await asyncio.sleep(timeout)
+            return False
+        fd = watcher.fileno()
+        if fd is None:
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                await asyncio.sleep(min(watcher.poll_interval, remaining))
+                if watcher.changed():
+                    return True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        readable = asyncio.Event()
+        loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(readable.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return False
+                readable.clear()
+                # Sự kiện của file khác cùng thư mục thì chờ tiếp
+                if watcher.changed():
+                    return True
+        finally:
+            loop.remove_reader(fd)
+
+    # ---------- phát hiện ----------
+    async def _detect(self):
+        detector = self.detector
+        while True:
+            sample = await self.samples.get()
+            started = time.time()
+            state = None
+            try:
+                async with self.state_lock:
+                    await asyncio.to_thread(self._detect_step, *sample)
+                    self.interval = detector.next_interval()
+                    if detector.snapshot_due():
+                        state = await asyncio.to_thread(detector.snapshot_state)
+            except Exception as e:
+                logging.error(f"Lỗi trong chu kỳ phát hiện: {e}")
+            self.request_commit()
+            if state is not None:
+                # Nén và fsync snapshot ngoài event loop, trạng thái đã được sao chép
+                await asyncio.to_thread(detector.run_stage, 'snapshot', detector.write_state, state)
+            detector.finish_cycle(time.time() - started)
+
+    def _detect_step(self, syn_stats, conn_stats, new_stats):
+        detector = self.detector
+        detector.run_stage('update', detector.update_stats, syn_stats, conn_stats, new_stats)
+        detector.run_stage('clean', detector.clean_old_records)
+        detector.run_stage('expire', detector.expire_bans)
+        detector.run_stage('detect', detector.detect)
+
+    # ---------- commit firewall ----------
+    def request_commit(self):
+        try:
+            self.commits.put_nowait(None)
+        except asyncio.QueueFull:
+            pass  # đã có yêu cầu chờ, quyết định mới sẽ đi cùng lần commit đó
+
+    async def _commit(self):
+        detector = self.detector
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.commits.get()
+            async with self.state_lock:
+                batch = detector.take_batch()
+            if batch is None:
+                continue
+            started = loop.time()
+            results = await asyncio.to_thread(detector.run_stage, 'commit',
+                                              detector.batcher.commit, batch[2])
+            elapsed = loop.time() - started
+            async with self.state_lock:
+                try:
+                    detector.finish_batch(batch, results)
+                except Exception as e:
+                    logging.error(f"Lỗi xử lý kết quả commit firewall: {e}")
+                state = detector.bans.snapshot(detector.clock())
+            await asyncio.to_thread(detector.bans.write, state)
+            if elapsed > (self.interval or detector.scheduler.interval):
+                self.slow_commits += 1
+                SLOW_COMMITS.inc()
+                logging.warning(f"Commit firewall mất {elapsed:.1f}s ({len(batch[2])} entry), "
+                                f"các quyết định mới được gộp vào lần commit sau")
+
+    # ---------- bộ đếm drop ----------
+    async def _poll_drops(self):
+        detector = self.detector
+        while True:
+            delay = detector.next_drop_poll()
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+            counters = await asyncio.to_thread(detector.run_stage, 'drops', detector.harvest_drops)
+            if counters is None:
+                continue
+            async with self.state_lock:
+                try:
+                    report = detector.review_drops(counters)
+                except Exception as e:
+                    logging.error(f"Lỗi xử lý bộ đếm drop: {e}")
+                    continue
+                state = detector.bans.snapshot(detector.clock())
+            self.request_commit()
+            await asyncio.to_thread(detector.bans.write, state)
+            await asyncio.to_thread(detector.save_drop_stats, report)
+
+    async def _poll_slow(self):
+        detector = self.detector
+        while True:
+            delay = detector.next_slow_poll()
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+            sockets = await asyncio.to_thread(detector.run_stage, 'slow',
+                                              detector.harvest_slow_connections)
+            if sockets is None:
+                continue
+            async with self.state_lock:
+                try:
+                    detector.review_slow_connections(sockets)
+                except Exception as e:
+                    logging.error(f"Lỗi xử lý kết nối chậm: {e}")
+                    continue
+            self.request_commit()
+
+    # ---------- alert ----------
+    def enqueue_alert(self, alert):
+        try:
+            self.alerts.put_nowait(alert)
+        except asyncio.QueueFull:
+            self.dropped_alerts += 1
+            DROPPED_ALERTS.inc()
+            logging.error(f"Hàng đợi alert đầy, bỏ alert {alert.get('action')} {alert.get('ip')} "
+                          f"({self.dropped_alerts} alert)")
+
+    async def _write_alerts(self):
+        while True:
+            batch = [await self.alerts.get()]
+            batch.extend(self._drain(self.alerts))
+            await asyncio.to_thread(self._append_alerts, batch)
+
+    @staticmethod
+    def _drain(queue):
+        items = []
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        return items
+
+    def _append_alerts(self, batch):
+        for alert in batch:
+            self.detector.store_alert(alert)
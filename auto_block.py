@@ -1,197 +1,1188 @@
 #!/usr/bin/env python3
-import subprocess
+import asyncio
+import gc
+import re
+import signal
+import sys
 import time
 import logging
-from collections import defaultdict, deque
+from collections import defaultdict
 import threading
-import json
-import os
+
+from socket_collector import TcpInfoCollector, get_collector
+from heavy_hitters import HeavyHitterCounter, make_window_counter
+from shard_workers import ShardPool
+from async_runtime import AsyncRuntime
+from firewall_backend import get_blocklist, entry_missing, FirewallBatcher
+from syn_capture import SynCapture
+from prefix_aggregator import PrefixAggregator
+from ip_index import PrefixIndex, entry_to_cidrs
+from ip_core import parse_ip, format_ip, network_last
+from alert_store import AlertWriter
+from adaptive_scheduler import AdaptiveScheduler, scale_levels
+from baseline import AnomalyDetector, format_prefix
+from ban_manager import BAN_STATE_FILE, BanManager, format_duration
+from config_watcher import CONFIG_FILE, HOT_RELOAD_KEYS, ConfigWatcher, load_config_file
+from metrics import Counter, Gauge, Histogram, MetricsServer
+from profiling import CycleProfiler, StackSampler, dump_profile
+from state_snapshot import capture_snapshot, read_snapshot, write_snapshot
+from drop_counters import DROP_STATS_FILE, DropMonitor, write_drop_stats
+from slow_connections import SlowConnectionMonitor
 
 CONFIG = {
+    # Backend thu thập socket: 'proc' (/proc/net/tcp), 'netlink' (sock_diag)
+    # hoặc 'subprocess' (netstat + ss)
+    'collector': 'proc',
+    # Tham số thêm cho collector, vd {'fixture_path': '...'} với netlink
+    'collector_options': {},
+    # Nguồn số SYN: 'snapshot' (đếm socket SYN_RECV mỗi chu kỳ) hoặc
+    # 'capture' (đếm gói SYN liên tục qua AF_PACKET, thấy cả nguồn giả mạo)
+    'syn_source': 'snapshot',
+    # Interface để bắt gói (None = mọi interface), hoặc file pcap để thử nghiệm
+    'capture_interface': None,
+    'capture_pcap': None,
+    # Chu kỳ kiểm tra khi yên tĩnh (giây); cũng là chu kỳ chuẩn của ngưỡng
     'check_interval': 10,
+    # Lịch thích ứng: rút chu kỳ xuống min_check_interval khi có IP đạt
+    # near_threshold_ratio ngưỡng hoặc tổng SYN/kết nối vượt load_rise_factor
+    # lần mức nền, rồi giãn dần (nhân interval_backoff) khi hết tải
+    'adaptive_interval': True,
+    'min_check_interval': 0.5,
+    'near_threshold_ratio': 0.5,
+    'load_rise_factor': 2.0,
+    'interval_backoff': 1.5,
+    # Ghi số liệu chu kỳ / thời gian phát hiện vào log mỗi N giây
+    'metrics_log_interval': 60,
     'time_window': 60,
+    # Số bucket thời gian của cửa sổ trượt cho mỗi IP
+    'window_buckets': 12,
     'syn_threshold': 50,
     'conn_threshold': 100,
+    # Tín hiệu kết nối: 'new' (collector so bảng socket giữa các lần đọc theo 4-tuple;
+    # conn_threshold áp cho số kết nối MỚI mở trong cửa sổ, kết nối keep-alive chỉ
+    # được tính một lần) hoặc 'level' (cộng số kết nối đang mở mỗi lần đọc như cũ)
+    'conn_signal': 'new',
+    # Số kết nối đang mở đồng thời tối đa của một IP (chỉ với conn_signal='new'), 0 = tắt
+    'concurrent_threshold': 50,
+    # Kết nối chậm (slowloris / slow read): mỗi slow_conn_interval giây lấy tcp_info của
+    # các kết nối ESTABLISHED tới slow_conn_ports trong một lần dump netlink ([] = tắt;
+    # runtime 'sync' đọc tối đa một lần mỗi chu kỳ). Kết nối treo: có request / response
+    # dở dang (còn dữ liệu chờ peer, hoặc peer gửi nhỏ giọt) mà tốc độ giữa các lần đọc
+    # (byte nhận + byte gửi được ack) dưới slow_conn_max_rate byte/s liên tục ít nhất
+    # slow_conn_min_age giây; cửa sổ nhận của peer dưới slow_conn_min_window byte khi còn
+    # dữ liệu chờ luôn tính là chậm. Kết nối keep-alive rảnh không bị tính.
+    # IP giữ quá slow_conn_threshold kết nối treo bị chặn.
+    'slow_conn_ports': [80, 443],
+    'slow_conn_interval': 5,
+    'slow_conn_min_age': 30,
+    'slow_conn_max_rate': 50,
+    'slow_conn_min_window': 1024,
+    'slow_conn_threshold': 20,
+    # Ngưỡng theo dải mạng {độ dài prefix: ngưỡng} để phát hiện botnet phân tán,
+    # dict rỗng = tắt. Dải chỉ bị chặn khi có ít nhất prefix_min_sources nguồn.
+    'prefix_syn_thresholds': {24: 200, 16: 1000},
+    'prefix_conn_thresholds': {24: 500, 16: 2500},
+    'prefix_syn_thresholds_v6': {64: 200, 48: 1000},
+    'prefix_conn_thresholds_v6': {64: 500, 48: 2500},
+    'prefix_min_sources': 5,
+    # Cách đếm theo IP / dải: 'exact' (mỗi nguồn một cửa sổ trượt) hoặc 'heavy_hitter'
+    # (Count-Min sketch hh_memory_bytes mỗi bộ đếm; chỉ nguồn có ước lượng đạt
+    # hh_promote_ratio ngưỡng mới được đếm chính xác, tối đa hh_capacity nguồn).
+    # Dùng 'heavy_hitter' khi có thể bị flood từ hàng triệu IP giả mạo.
+    'counting_mode': 'exact',
+    'hh_memory_bytes': 4 * 1024 * 1024,
+    'hh_depth': 4,
+    'hh_capacity': 10000,
+    'hh_promote_ratio': 0.5,
+    # Số tiến trình worker giữ cửa sổ theo IP (chia theo IP nguồn, trao đổi số đếm
+    # qua shared memory); 0 = đếm ngay trong tiến trình daemon
+    'shard_workers': 0,
+    # Số bản ghi tối đa mỗi lượt gửi cho một worker (24 byte mỗi bản ghi)
+    'shard_buffer_records': 65536,
+    # Cách phát hiện: 'threshold' (ngưỡng cố định ở trên), 'anomaly' (mức nền EWMA
+    # riêng cho mỗi IP / dải, báo khi lệch quá anomaly_sigmas độ lệch chuẩn) hoặc 'both'
+    'detection_mode': 'threshold',
+    'anomaly_sigmas': 6.0,
+    # Chu kỳ bán rã (giây) của mức nền và số mẫu trước khi dùng mức nền riêng
+    'anomaly_halflife': 600,
+    'anomaly_warmup': 10,
+    # Tốc độ tối thiểu (mỗi check_interval) để bị báo bất thường
+    'anomaly_min_syn': 20,
+    'anomaly_min_conn': 50,
+    'anomaly_prefix_v4': 24,
+    'anomaly_prefix_v6': 64,
+    # Xoá mức nền của nguồn vắng mặt quá lâu (giây)
+    'anomaly_idle_ttl': 3600,
+    # Whitelist / blocklist nhận IP, CIDR ('10.0.0.0/8') hoặc dải ('10.0.0.1-10.0.0.50').
+    # Blocklist được chặn ngay khi daemon khởi động.
     'whitelist': ['127.0.0.1', '192.168.1.1'],
-    'log_file': '/var/log/firewall_auto_block.log'
+    'blocklist': [],
+    # Cách chặn: 'ipset' (một set + một rule iptables) hoặc 'iptables' (mỗi IP một rule)
+    'block_backend': 'ipset',
+    # Thời hạn chặn IP/dải bị phát hiện theo số lần vi phạm (giây): lần 1 5 phút,
+    # lần 2 1 giờ, từ lần 3 1 ngày; [] = chặn vĩnh viễn. Số lần vi phạm được
+    # nhớ ban_forget_after giây. Blocklist tĩnh luôn chặn vĩnh viễn.
+    'ban_durations': [300, 3600, 86400],
+    'ban_forget_after': 7 * 86400,
+    'ban_state_file': BAN_STATE_FILE,
+    # Snapshot để khởi động nóng: danh sách entry bị chặn và cửa sổ trượt (IP, dải),
+    # ghi mỗi state_snapshot_interval giây và khi dừng; khi khởi động nạp lại rồi
+    # đối chiếu với một lần dump firewall. None = tắt (cửa sổ bắt đầu rỗng).
+    'state_snapshot_file': '/var/lib/firewall_auto_block/state.snap',
+    'state_snapshot_interval': 60,
+    # Số gói / byte bị DROP của mọi entry đang chặn, đọc mỗi drop_poll_interval giây
+    # trong một lần gọi firewall (0 = tắt) và ghi ra drop_stats_file cho web_dashboard
+    # và GUI. Lệnh chặn có thời hạn sắp hết mà vẫn drop >= ban_extend_min_pps gói/s
+    # được gia hạn thêm ban_extend_step giây; hết lưu lượng thì hết hạn như thường
+    # (chậm nhất một bước gia hạn sau khi lưu lượng dừng). ban_extend_min_pps = 0 = không gia hạn.
+    'drop_poll_interval': 30,
+    'drop_stats_file': DROP_STATS_FILE,
+    'ban_extend_min_pps': 1.0,
+    'ban_extend_step': 300,
+    # File alert NDJSON chỉ ghi nối, xoay vòng theo kích thước / tuổi
+    'alert_file': '/var/log/firewall_alerts.json',
+    'alert_max_bytes': 10 * 1024 * 1024,
+    'alert_max_age': 86400,
+    'alert_backups': 5,
+    # 'always' (fsync từng alert), 'batch' (fsync mỗi lô) hoặc 'never'
+    'alert_fsync': 'batch',
+    'alert_flush_interval': 1.0,
+    'log_file': '/var/log/firewall_auto_block.log',
+    # 'asyncio' (thu thập, phát hiện, commit firewall và ghi alert là các task riêng,
+    # firewall chậm không làm trễ lần đo kế tiếp) hoặc 'sync' (vòng lặp một thread)
+    'runtime': 'asyncio',
+    # File cấu hình do AutoBlockTab ghi; đọc khi khởi động và tự nạp lại khi đổi
+    'config_file': CONFIG_FILE,
+    # Số liệu Prometheus / OpenMetrics tại http://metrics_host:metrics_port/metrics
+    # (0 = tắt) và/hoặc Unix socket metrics_socket; web_dashboard xuất lại ở /metrics
+    'metrics_host': '127.0.0.1',
+    'metrics_port': 9108,
+    'metrics_socket': None,
+    # Thời gian từng giai đoạn (và bước con: netstat, ss, parse, quét cửa sổ, firewall...)
+    # của profile_cycles chu kỳ gần nhất luôn được giữ trong bộ nhớ;
+    # `kill -USR1 <pid>` ghi ra profile_dump_file (JSON).
+    # profile_sampling=True: lấy mẫu stack mọi thread mỗi profile_sample_interval giây,
+    # giữ profile_window giây gần nhất, ghi kèm <profile_dump_file>.folded (flame graph).
+    # `kill -USR2 <pid>` lấy mẫu một lượt profile_window giây rồi tự ghi, kể cả khi tắt.
+    'profile_cycles': 1000,
+    'profile_dump_file': '/var/log/firewall_auto_block_profile.json',
+    'profile_sampling': False,
+    'profile_sample_interval': 0.01,
+    'profile_window': 60,
 }
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(CONFIG['log_file']),
-        logging.StreamHandler()
-    ]
-)
+STAGE_SECONDS = Histogram('auto_block_stage_seconds', 'Thời gian từng giai đoạn của chu kỳ phát hiện',
+                          ['stage'])
+CYCLE_SECONDS = Histogram('auto_block_cycle_seconds', 'Thời gian xử lý một chu kỳ phát hiện')
+LAST_CYCLE = Gauge('auto_block_last_cycle_timestamp_seconds', 'Thời điểm chu kỳ gần nhất kết thúc')
+CHECK_INTERVAL = Gauge('auto_block_check_interval_seconds', 'Chu kỳ kiểm tra hiện tại của lịch thích ứng')
+SOCKETS = Gauge('auto_block_sockets_per_cycle', 'Số socket đọc được ở lần thu thập gần nhất')
+SOCKETS_PARSED = Counter('auto_block_sockets_parsed', 'Tổng số socket đã đọc')
+TRACKED = Gauge('auto_block_tracked_keys', 'Số IP / dải đang được đếm trong cửa sổ',
+                ['kind', 'level'])
+WINDOW_MEMORY = Gauge('auto_block_window_memory_bytes', 'Bộ nhớ ước lượng của các cửa sổ trượt',
+                      ['level'])
+BLOCKED = Gauge('auto_block_blocked_entries', 'Số entry đang bị chặn', ['type'])
+TIMED_BANS = Gauge('auto_block_timed_bans', 'Số lệnh chặn có thời hạn đang hiệu lực')
+BLOCKS = Counter('auto_block_blocks', 'Số lệnh chặn đã áp dụng theo lý do', ['reason'])
+UNBLOCKS = Counter('auto_block_unblocks', 'Số lệnh gỡ chặn theo lý do', ['reason'])
+BLOCK_FAILURES = Counter('auto_block_block_failures', 'Số quyết định chặn firewall từ chối')
+UNBLOCK_FAILURES = Counter('auto_block_unblock_failures', 'Số lệnh gỡ chặn firewall thất bại, sẽ thử lại')
+TIME_TO_BLOCK = Histogram('auto_block_time_to_block_seconds',
+                          'Thời gian từ lúc IP đạt near_threshold_ratio ngưỡng đến lúc bị chặn',
+                          buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+ALERT_ERRORS = Counter('auto_block_alert_errors', 'Số alert không đưa được vào kho alert')
+DROPPED_PACKETS = Counter('auto_block_dropped_packets', 'Số gói firewall đã drop của các entry đang chặn')
+DROPPED_BYTES = Counter('auto_block_dropped_bytes', 'Số byte firewall đã drop của các entry đang chặn')
+DROPPING = Gauge('auto_block_dropping_entries',
+                 'Số entry đang chặn có tốc độ drop >= ban_extend_min_pps')
+NEW_CONNECTIONS = Counter('auto_block_new_connections', 'Số kết nối mới thấy giữa hai lần đọc bảng socket')
+STALLED_CONNECTIONS = Gauge('auto_block_stalled_connections',
+                            'Số kết nối treo tới slow_conn_ports ở lần đọc tcp_info gần nhất')
+BAN_EXTENSIONS = Counter('auto_block_ban_extensions', 'Số lần gia hạn chặn vì vẫn còn lưu lượng')
+
+
+def reason_label(reason):
+    """Phần cố định của lý do (bỏ số liệu sau ':' hoặc '(') làm nhãn metrics"""
+    return re.split(r'[:(]', reason, 1)[0].strip()
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(CONFIG['log_file']),
+            logging.StreamHandler()
+        ]
+    )
 
 class DosDetector:
-    def __init__(self):
-        self.syn_count = defaultdict(lambda: deque(maxlen=100))
-        self.conn_count = defaultdict(lambda: deque(maxlen=100))
+    """collector, blocklist, alerts (đối tượng có append/close) và clock (hàm trả về
+    thời điểm hiện tại) có thể thay bằng bản giả để chạy offline (xem replay.py).
+    watch_config=False: không theo dõi file cấu hình.
+    """
+    
+    def __init__(self, collector=None, blocklist=None, alerts=None, clock=None, watch_config=True):
+        self.clock = clock or time.time
+        # Chế độ shard: cửa sổ theo IP nằm ở các worker, không giữ ở đây
+        self.shards = None
+        self.syn_count = self.conn_count = None
+        if CONFIG['shard_workers'] > 0:
+            self.shards = ShardPool(CONFIG['shard_workers'], CONFIG, CONFIG['shard_buffer_records'])
+            self.shards.start()
+        else:
+            self.syn_count = self.make_counter(CONFIG['syn_threshold'])
+            self.conn_count = self.make_counter(CONFIG['conn_threshold'])
+        self.syn_prefixes = PrefixAggregator(CONFIG['time_window'], CONFIG['window_buckets'],
+                                             CONFIG['prefix_syn_thresholds'],
+                                             CONFIG['prefix_min_sources'],
+                                             CONFIG['prefix_syn_thresholds_v6'],
+                                             self.make_counter)
+        self.conn_prefixes = PrefixAggregator(CONFIG['time_window'], CONFIG['window_buckets'],
+                                              CONFIG['prefix_conn_thresholds'],
+                                              CONFIG['prefix_min_sources'],
+                                              CONFIG['prefix_conn_thresholds_v6'],
+                                              self.make_counter)
+        self.whitelist = PrefixIndex(CONFIG['whitelist'])
+        # Khoá ip_core của các host bị chặn và chuỗi CIDR của các dải bị chặn
         self.blocked_ips = set()
-        self.load_blocked_ips()
+        self.blocked_nets = set()
+        self.blocked_index = PrefixIndex()
+        self.collector = collector or get_collector(CONFIG['collector'],
+                                                    track_connections=CONFIG['conn_signal'] == 'new',
+                                                    **CONFIG['collector_options'])
+        self.blocklist = blocklist or get_blocklist(CONFIG['block_backend'])
+        self.batcher = FirewallBatcher(self.blocklist)
+        # entry -> (lý do, thời điểm gần ngưỡng, thời hạn chặn)
+        self.pending_blocks = {}
+        self.pending_unblocks = {}
+        # Entry đã lấy ra để commit nhưng firewall chưa trả kết quả
+        self.committing = set()
+        self.bans = BanManager(CONFIG['ban_durations'], CONFIG['ban_forget_after'],
+                               CONFIG['ban_state_file'], self.clock())
+        self.drops = DropMonitor()
+        self.last_drop_poll = None
+        self.slow_collector = None
+        if CONFIG['slow_conn_ports']:
+            self.slow_collector = TcpInfoCollector(CONFIG['slow_conn_ports'])
+        self.slow_conns = SlowConnectionMonitor()
+        self.last_slow_poll = None
+        self.scheduler = AdaptiveScheduler(CONFIG['min_check_interval'], CONFIG['check_interval'],
+                                           CONFIG['near_threshold_ratio'], CONFIG['load_rise_factor'],
+                                           CONFIG['interval_backoff'])
+        self.profiler = CycleProfiler(CONFIG['profile_cycles'])
+        # Chỉ tạo thread khi bật profile_sampling hoặc nhận SIGUSR2
+        self.sampler = StackSampler(CONFIG['profile_sample_interval'], CONFIG['profile_window'])
+        self.last_sample = None
+        self.syn_anomaly = self.make_anomaly_detector(CONFIG['anomaly_min_syn'])
+        self.conn_anomaly = self.make_anomaly_detector(CONFIG['anomaly_min_conn'])
+        self.cycle_rates = ({}, {})
+        # Số kết nối đang mở theo IP của lần đọc gần nhất (conn_signal='new')
+        self.cycle_concurrent = {}
+        self.cycle_elapsed = CONFIG['check_interval']
+        self.last_baseline_expire = self.clock()
+        self.syn_carry = {}
+        self.conn_carry = {}
+        self.cycle_totals = {}
+        # Thời điểm mỗi IP bắt đầu đạt near_threshold_ratio ngưỡng (đo thời gian phát hiện)
+        self.onsets = {}
+        self.peak_ratio = 0.0
+        self.last_metrics_log = self.clock()
+        self.alerts = alerts or AlertWriter(CONFIG['alert_file'], CONFIG['alert_max_bytes'],
+                                            CONFIG['alert_max_age'], CONFIG['alert_backups'],
+                                            CONFIG['alert_fsync'], CONFIG['alert_flush_interval'])
+        self.config_watcher = ConfigWatcher(CONFIG['config_file']) if watch_config else None
+        # Runtime asyncio thay bằng hàng đợi của nó để ghi alert không chặn vòng phát hiện
+        self.alert_sink = None
+        self.syn_capture = None
+        # Số SYN là số gói (sự kiện) thay vì số socket SYN_RECV tại một thời điểm
+        self.syn_events = False
+        if CONFIG['syn_source'] == 'capture':
+            self.start_syn_capture()
+        self.last_snapshot = self.clock()
+        started = time.perf_counter()
+        saved_blocked = self.restore_snapshot()
+        self.load_blocked_ips(saved_blocked)
+        if saved_blocked is not None:
+            logging.info(f"Khởi động nóng trong {(time.perf_counter() - started) * 1000:.0f}ms")
+        self.restore_bans()
+        self.apply_static_blocklist()
+        self.commit_blocks()
         
-    def load_blocked_ips(self):
+    def make_counter(self, threshold):
+        """Bộ đếm cửa sổ trượt cho một ngưỡng, theo CONFIG['counting_mode']"""
+        return make_window_counter(CONFIG, threshold)
+    
+    def retune_counters(self):
+        """Cập nhật mức nhận vào đếm chính xác sau khi đổi ngưỡng"""
+        ratio = CONFIG['hh_promote_ratio']
+        pairs = [(self.syn_count, CONFIG['syn_threshold']),
+                 (self.conn_count, CONFIG['conn_threshold'])]
+        for aggregator in (self.syn_prefixes, self.conn_prefixes):
+            pairs.extend((aggregator.levels[level], aggregator.thresholds[level])
+                         for level in aggregator.levels)
+        for counter, threshold in pairs:
+            if isinstance(counter, HeavyHitterCounter):
+                counter.promote_at = threshold * ratio
+    
+    def make_anomaly_detector(self, min_rate):
+        return AnomalyDetector(CONFIG['anomaly_halflife'], CONFIG['anomaly_sigmas'], min_rate,
+                               CONFIG['anomaly_warmup'], CONFIG['anomaly_prefix_v4'],
+                               CONFIG['anomaly_prefix_v6'], CONFIG['prefix_min_sources'])
+    
+    def load_blocked_ips(self, saved=None):
+        """Đánh dấu các entry đang có trong firewall (một lần dump)
+
+        saved: tập entry trong snapshot; dùng thay firewall nếu không đọc được
+        firewall, ngược lại chỉ ghi log chênh lệch. Entry mất khỏi firewall không
+        được chặn lại ở đây (có thể do quản trị viên gỡ), lệnh chặn còn hạn thì
+        restore_bans() chặn lại.
+        """
         try:
-            result = subprocess.run(
-                ['iptables', '-L', 'INPUT', '-n', '--line-numbers'],
-                capture_output=True, text=True
-            )
-            for line in result.stdout.split('\n'):
-                if 'DROP' in line and '0.0.0.0/0' not in line:
-                    parts = line.split()
-                    for part in parts:
-                        if self.is_valid_ip(part):
-                            self.blocked_ips.add(part)
+            entries = set(self.blocklist.list())
         except Exception as e:
             logging.error(f"Lỗi load blocked IPs: {e}")
+            if not saved:
+                return
+            logging.warning(f"Dùng {len(saved)} entry bị chặn trong snapshot")
+            entries = saved
+        else:
+            if saved is not None and saved != entries:
+                logging.info(f"Đối chiếu firewall với snapshot: {len(saved - entries)} entry "
+                             f"không còn trong firewall, {len(entries - saved)} entry mới")
+        self.mark_blocked_all(entries)
     
-    def is_valid_ip(self, ip):
-        parts = ip.split('.')
-        if len(parts) != 4:
-            return False
+    def window_counters(self):
+        """{tên: SlidingWindowCounter} các cửa sổ lưu vào snapshot
+
+        Với heavy hitter chỉ lưu phần đếm chính xác, sketch bắt đầu lại từ đầu.
+        Chế độ shard: cửa sổ theo IP nằm ở các worker nên không lưu.
+        """
+        counters = {}
+        if self.shards is None:
+            counters['ip/syn'] = self.syn_count
+            counters['ip/conn'] = self.conn_count
+        for label, aggregator in (('syn', self.syn_prefixes), ('conn', self.conn_prefixes)):
+            for (family, prefix_len), counter in aggregator.levels.items():
+                counters[f"prefix/{label}/v{family}/{prefix_len}"] = counter
+        return {name: counter.exact if isinstance(counter, HeavyHitterCounter) else counter
+                for name, counter in counters.items()}
+    
+    def restore_snapshot(self):
+        """Nạp cửa sổ trượt từ state_snapshot_file, trả về tập entry bị chặn đã lưu
+
+        None nếu tắt hoặc chưa có snapshot. Cửa sổ bị bỏ qua nếu snapshot cũ hơn
+        time_window hoặc time_window / window_buckets đã đổi.
+        """
+        path = CONFIG['state_snapshot_file']
+        if not path:
+            return None
+        # Nạp hàng trăm nghìn entry một lúc: tạm tắt GC để không quét lại cả heap nhiều lần
+        collecting = gc.isenabled()
+        gc.disable()
         try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError:
-            return False
+            return self._restore_snapshot(path)
+        finally:
+            if collecting:
+                gc.enable()
+    
+    def _restore_snapshot(self, path):
+        try:
+            header, saved = read_snapshot(path)
+            age = self.clock() - float(header['saved'])
+            blocked = set(header['blocked'])
+            window = (header['time_window'], header['window_buckets'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Snapshot hỏng / bị cắt: khởi động với cửa sổ rỗng như khi chưa có snapshot
+            logging.error(f"Lỗi đọc snapshot {path}: {e}")
+            return None
+        if window != (CONFIG['time_window'], CONFIG['window_buckets']):
+            logging.info("time_window / window_buckets đã đổi, bỏ qua cửa sổ trong snapshot")
+        elif header.get('conn_signal', 'level') != CONFIG['conn_signal']:
+            # Cửa sổ kết nối đếm mức thay vì kết nối mới (hoặc ngược lại)
+            logging.info("conn_signal đã đổi, bỏ qua cửa sổ trong snapshot")
+        elif age >= CONFIG['time_window']:
+            logging.info(f"Snapshot đã cũ {age:.0f}s, bỏ qua cửa sổ")
+        else:
+            counters = self.window_counters()
+            restored = 0
+            for name, arrays in saved.items():
+                counter = counters.get(name)
+                if counter is not None:
+                    counter.import_arrays(*arrays)
+                    restored += len(arrays[0])
+            logging.info(f"Đã nạp {restored} nguồn trong cửa sổ từ snapshot ({age:.0f}s trước)")
+        return blocked
+    
+    def snapshot_due(self):
+        return (bool(CONFIG['state_snapshot_file'])
+                and self.clock() - self.last_snapshot >= CONFIG['state_snapshot_interval'])
+    
+    def snapshot_state(self):
+        """Bản sao entry bị chặn và cửa sổ trượt để ghi snapshot, None nếu tắt
+        
+        Tách khỏi write_state() để nén / ghi đĩa ở thread khác trong khi trạng thái
+        tiếp tục thay đổi.
+        """
+        path = CONFIG['state_snapshot_file']
+        if not path:
+            return None
+        now = self.clock()
+        self.last_snapshot = now
+        blocked = [format_ip(key) for key in self.blocked_ips]
+        blocked.extend(self.blocked_nets)
+        return path, capture_snapshot(now, CONFIG['time_window'], CONFIG['window_buckets'],
+                                      blocked, self.window_counters(), CONFIG['conn_signal'])
+    
+    def write_state(self, state):
+        if state is None:
+            return
+        path, snapshot = state
+        try:
+            size = write_snapshot(path, snapshot)
+        except (OSError, ValueError) as e:
+            logging.error(f"Lỗi ghi snapshot {path}: {e}")
+            return
+        logging.debug(f"Đã ghi snapshot {size / 1024:.0f} KiB vào {path}")
+    
+    def save_snapshot(self):
+        """Ghi entry bị chặn và cửa sổ trượt ra state_snapshot_file"""
+        self.write_state(self.snapshot_state())
+    
+    def restore_bans(self):
+        """Nạp trạng thái chặn đã lưu, chặn lại các entry còn hạn mà firewall đã mất"""
+        now = self.clock()
+        self.bans.load(now)
+        for entry, (expires, count) in self.bans.bans.items():
+            if expires <= now or entry in self.blocked_nets:
+                continue
+            if '/' not in entry and parse_ip(entry) in self.blocked_ips:
+                continue
+            self.pending_blocks[entry] = (f"Khôi phục lệnh chặn (lần vi phạm {count})", None,
+                                          int(expires - now))
+            self.batcher.block(entry, timeout=int(expires - now))
+        if self.bans:
+            logging.info(f"Đã nạp {len(self.bans)} lệnh chặn có thời hạn")
+    
+    def mark_blocked(self, entry):
+        """Ghi nhận entry firewall (IP hoặc CIDR) là đã bị chặn"""
+        self.mark_blocked_all((entry,))
+    
+    def mark_blocked_all(self, entries):
+        """Như mark_blocked cho nhiều entry, chỉ dựng lại chỉ mục dải một lần"""
+        nets = False
+        for entry in entries:
+            if '/' in entry:
+                self.blocked_nets.add(entry)
+                nets = True
+                continue
+            key = parse_ip(entry)
+            if key is not None:
+                self.blocked_ips.add(key)
+        if nets:
+            self.blocked_index = PrefixIndex(self.blocked_nets)
+    
+    def unmark_blocked(self, entry):
+        if '/' in entry:
+            self.blocked_nets.discard(entry)
+            self.blocked_index = PrefixIndex(self.blocked_nets)
+            return
+        self.blocked_ips.discard(parse_ip(entry))
+    
+    def is_blocked(self, key):
+        """IP đã bị chặn riêng hoặc nằm trong một dải đã bị chặn"""
+        return key in self.blocked_ips or self.blocked_index.contains(key)
+    
+    def net_has_whitelisted(self, net, prefix_len):
+        return self.whitelist.overlaps(net, network_last(net, prefix_len))
+    
+    def apply_static_blocklist(self):
+        """Đưa các entry trong CONFIG['blocklist'] (CIDR, dải) chưa bị chặn vào batch"""
+        for entry in CONFIG['blocklist']:
+            try:
+                cidrs = entry_to_cidrs(entry)
+            except ValueError as e:
+                logging.error(f"Entry blocklist không hợp lệ {entry}: {e}")
+                continue
+            for cidr in cidrs:
+                if cidr not in self.blocked_nets:
+                    self.queue_block(cidr, f"Static blocklist: {entry}", permanent=True)
+    
+    def start_syn_capture(self):
+        capture = SynCapture(interface=CONFIG['capture_interface'],
+                             pcap_path=CONFIG['capture_pcap'])
+        try:
+            capture.start()
+        except OSError as e:
+            logging.error(f"Không mở được AF_PACKET, dùng số SYN_RECV: {e}")
+            return
+        self.syn_capture = capture
+        self.syn_events = True
     
     def get_network_stats(self):
+        """(syn_stats, conn_stats, new_stats) theo IP nguồn, đã bỏ whitelist
+        
+        conn_stats là số kết nối đang mở; new_stats là số kết nối mới từ lần đọc
+        trước, None nếu collector không so 4-tuple.
+        """
         syn_stats = defaultdict(int)
         conn_stats = defaultdict(int)
+        new_stats = None
         
         try:
-            result = subprocess.run(['netstat', '-tn'], capture_output=True, text=True)
-            for line in result.stdout.split('\n'):
-                if 'SYN_' in line:
-                    parts = line.split()
-                    if len(parts) >= 5:
-                        ip = parts[4].split(':')[0]
-                        if self.is_valid_ip(ip) and ip not in CONFIG['whitelist']:
-                            syn_stats[ip] += 1
+            raw_syn, raw_conn = self.collector.collect()
+            self.profiler.record_all('collect', getattr(self.collector, 'last_timings', {}))
+            if self.syn_capture is not None:
+                # Số gói SYN từ lần đọc trước thay cho số socket SYN_RECV
+                raw_syn = self.syn_capture.drain()
+            
+            for key, count in raw_syn.items():
+                if not self.whitelist.contains(key):
+                    syn_stats[key] += count
+            
+            for key, count in raw_conn.items():
+                if not self.whitelist.contains(key):
+                    conn_stats[key] += count
             
-            result = subprocess.run(['ss', '-tn'], capture_output=True, text=True)
-            for line in result.stdout.split('\n'):
-                if 'ESTAB' in line or 'SYN-' in line:
-                    parts = line.split()
-                    if len(parts) >= 5:
-                        ip = parts[4].split(':')[0]
-                        if self.is_valid_ip(ip) and ip not in CONFIG['whitelist']:
-                            conn_stats[ip] += 1
+            raw_new = getattr(self.collector, 'last_new_connections', None)
+            if raw_new is not None:
+                new_stats = defaultdict(int)
+                for key, count in raw_new.items():
+                    if not self.whitelist.contains(key):
+                        new_stats[key] += count
+                NEW_CONNECTIONS.inc(sum(new_stats.values()))
                             
         except Exception as e:
             logging.error(f"Lỗi get network stats: {e}")
             
-        return syn_stats, conn_stats
+        return syn_stats, conn_stats, new_stats
     
-    def update_stats(self, syn_stats, conn_stats):
-        current_time = time.time()
+    def update_stats(self, syn_stats, conn_stats, new_stats=None):
+        """Cộng số liệu một lần đọc vào các cửa sổ
         
-        for ip, count in syn_stats.items():
-            for _ in range(count):
-                self.syn_count[ip].append(current_time)
-                
-        for ip, count in conn_stats.items():
-            for _ in range(count):
-                self.conn_count[ip].append(current_time)
+        Có new_stats: cửa sổ kết nối đếm kết nối mới (sự kiện), còn conn_stats chỉ
+        dùng cho ngưỡng kết nối đồng thời. Không có: cộng mức conn_stats như cũ.
+        """
+        current_time = self.clock()
+        
+        # Lấy mẫu dày hơn chu kỳ chuẩn thì mỗi mẫu chỉ được tính một phần
+        elapsed = CONFIG['check_interval']
+        if self.last_sample is not None:
+            elapsed = current_time - self.last_sample
+        weight = min(elapsed / CONFIG['check_interval'], 1.0)
+        self.last_sample = current_time
+        
+        # Tốc độ mỗi nguồn theo đơn vị một chu kỳ chuẩn, cho mức nền bất thường
+        if self.syn_events:
+            # Số gói SYN là số sự kiện, không phải mức: quy về một chu kỳ chuẩn
+            syn_rates = {key: count / max(weight, 1e-6) for key, count in syn_stats.items()}
+        else:
+            syn_rates = syn_stats
+            syn_stats = scale_levels(syn_stats, weight, self.syn_carry)
+        if new_stats is not None:
+            self.cycle_concurrent = conn_stats
+            conn_rates = {key: count / max(weight, 1e-6) for key, count in new_stats.items()}
+            conn_stats = new_stats
+        else:
+            self.cycle_concurrent = {}
+            conn_rates = conn_stats
+            conn_stats = scale_levels(conn_stats, weight, self.conn_carry)
+        self.cycle_rates = (syn_rates, conn_rates)
+        self.cycle_elapsed = elapsed
+        self.cycle_totals = {'syn': sum(syn_rates.values()), 'conn': sum(conn_rates.values())}
+        
+        if self.shards is not None:
+            self.shards.update(syn_stats, conn_stats, current_time,
+                               (CONFIG['syn_threshold'], CONFIG['conn_threshold']),
+                               CONFIG['hh_promote_ratio'])
+        else:
+            self.syn_count.update(syn_stats, current_time)
+            self.conn_count.update(conn_stats, current_time)
+        
+        self.syn_prefixes.update(syn_stats, current_time)
+        self.conn_prefixes.update(conn_stats, current_time)
     
     def clean_old_records(self):
-        current_time = time.time()
-        cutoff = current_time - CONFIG['time_window']
-        
-        for ip in list(self.syn_count.keys()):
-            while (self.syn_count[ip] and self.syn_count[ip][0] < cutoff):
-                self.syn_count[ip].popleft()
-            if not self.syn_count[ip]:
-                del self.syn_count[ip]
-                
-        for ip in list(self.conn_count.keys()):
-            while (self.conn_count[ip] and self.conn_count[ip][0] < cutoff):
-                self.conn_count[ip].popleft()
-            if not self.conn_count[ip]:
-                del self.conn_count[ip]
+        current_time = self.clock()
+        if self.shards is None:
+            # Các worker shard tự xoá phần đã trượt khỏi cửa sổ sau mỗi lần cập nhật
+            self.syn_count.expire(current_time)
+            self.conn_count.expire(current_time)
+        self.syn_prefixes.expire(current_time)
+        self.conn_prefixes.expire(current_time)
+        if current_time - self.last_baseline_expire >= 60:
+            self.last_baseline_expire = current_time
+            self.syn_anomaly.expire(current_time, CONFIG['anomaly_idle_ttl'])
+            self.conn_anomaly.expire(current_time, CONFIG['anomaly_idle_ttl'])
+    
+    def track_onset(self, key, ratio, now, onsets):
+        """Ghi nhận IP gần ngưỡng cho lịch thích ứng và đo thời gian phát hiện"""
+        if ratio > self.peak_ratio:
+            self.peak_ratio = ratio
+        if ratio >= CONFIG['near_threshold_ratio'] and key not in onsets:
+            onsets[key] = self.onsets.get(key, now)
     
     def check_for_attacks(self):
-        current_time = time.time()
-        cutoff = current_time - CONFIG['time_window']
+        self.detect()
+        self.commit_blocks()
+    
+    def detect(self):
+        """Đưa các IP / dải cần chặn của chu kỳ vào batch, chưa commit"""
+        current_time = self.clock()
+        onsets = {}
+        self.peak_ratio = 0.0
+        mode = CONFIG['detection_mode']
         
-        for ip in list(self.syn_count.keys()):
-            syn_in_window = sum(1 for ts in self.syn_count[ip] if ts >= cutoff)
-            
-            if (syn_in_window > CONFIG['syn_threshold'] and ip not in self.blocked_ips):
-                self.block_ip(ip, f"SYN flood detected: {syn_in_window} SYN packets")
+        if mode in ('anomaly', 'both'):
+            with self.profiler.span('detect.anomaly'):
+                self.check_anomalies(current_time, onsets)
+        if mode in ('threshold', 'both'):
+            self.check_thresholds(current_time, onsets)
+        self.onsets = onsets
+    
+    def check_anomalies(self, current_time, onsets):
+        """So tốc độ của chu kỳ với mức nền EWMA của từng nguồn / dải"""
+        syn_rates, conn_rates = self.cycle_rates
+        for label, detector, rates in (('SYN', self.syn_anomaly, syn_rates),
+                                       ('Connection', self.conn_anomaly, conn_rates)):
+            sources, prefixes = detector.update(rates, current_time, self.cycle_elapsed)
+            for key, value, mean, sigma, z in sources:
+                if self.is_blocked(key):
+                    continue
+                self.track_onset(key, z / CONFIG['anomaly_sigmas'], current_time, onsets)
+                self.queue_block(key, f"{label} anomaly detected: {value:.0f}/chu kỳ, "
+                                      f"{z:.1f}σ trên mức nền {mean:.1f}±{sigma:.1f}",
+                                 onsets.get(key))
+            for net, value, mean, sigma, z in prefixes:
+                cidr = format_prefix(net)
+                if cidr in self.blocked_nets or self.net_has_whitelisted(*net):
+                    continue
+                self.queue_block(cidr, f"Distributed {label} anomaly detected: {value:.0f}/chu kỳ "
+                                       f"in {cidr}, {z:.1f}σ trên mức nền {mean:.1f}±{sigma:.1f}")
+    
+    def window_items(self, current_time):
+        """(key, tổng) SYN và kết nối trong cửa sổ
         
-        for ip in list(self.conn_count.keys()):
-            conn_in_window = sum(1 for ts in self.conn_count[ip] if ts >= cutoff)
-            
-            if (conn_in_window > CONFIG['conn_threshold'] and ip not in self.blocked_ips):
-                self.block_ip(ip, f"Connection flood detected: {conn_in_window} connections")
+        Chế độ shard chỉ trả về các IP từ near_threshold_ratio ngưỡng trở lên,
+        đủ cho quyết định chặn và lịch thích ứng.
+        """
+        if self.shards is not None:
+            return self.shards.check(current_time, (CONFIG['syn_threshold'], CONFIG['conn_threshold']),
+                                     min(CONFIG['near_threshold_ratio'], 1.0))
+        return list(self.syn_count.items(current_time)), list(self.conn_count.items(current_time))
     
-    def block_ip(self, ip, reason):
+    def check_thresholds(self, current_time, onsets):
+        started = time.perf_counter()
+        syn_items, conn_items = self.window_items(current_time)
+        scanned = time.perf_counter()
+        self.profiler.record('detect.window_scan', scanned - started)
+        for key, syn_in_window in syn_items:
+            if self.is_blocked(key):
+                continue
+            self.track_onset(key, syn_in_window / CONFIG['syn_threshold'], current_time, onsets)
+            if syn_in_window > CONFIG['syn_threshold']:
+                self.queue_block(key, f"SYN flood detected: {syn_in_window} SYN packets",
+                                 onsets.get(key))
+        
+        for key, conn_in_window in conn_items:
+            if self.is_blocked(key):
+                continue
+            self.track_onset(key, conn_in_window / CONFIG['conn_threshold'], current_time, onsets)
+            if conn_in_window > CONFIG['conn_threshold']:
+                self.queue_block(key, f"Connection flood detected: {conn_in_window} connections",
+                                 onsets.get(key))
+        
+        limit = CONFIG['concurrent_threshold']
+        if limit > 0:
+            for key, concurrent in self.cycle_concurrent.items():
+                if self.is_blocked(key):
+                    continue
+                self.track_onset(key, concurrent / limit, current_time, onsets)
+                if concurrent > limit:
+                    self.queue_block(key, f"Too many concurrent connections: {concurrent}",
+                                     onsets.get(key))
+        checked = time.perf_counter()
+        self.profiler.record('detect.ip_thresholds', checked - scanned)
+        
+        for cidr, total, sources in self.syn_prefixes.offenders(current_time, self.net_has_whitelisted):
+            if cidr not in self.blocked_nets:
+                self.queue_block(cidr, f"Distributed SYN flood detected: {total} SYN packets "
+                                       f"from {sources} sources in {cidr}")
+        
+        for cidr, total, sources in self.conn_prefixes.offenders(current_time, self.net_has_whitelisted):
+            if cidr not in self.blocked_nets:
+                self.queue_block(cidr, f"Distributed connection flood detected: {total} connections "
+                                       f"from {sources} sources in {cidr}")
+        self.profiler.record('detect.prefixes', time.perf_counter() - checked)
+    
+    def queue_block(self, target, reason, onset=None, permanent=False):
+        """Đưa IP (khoá) hoặc CIDR vào batch của chu kỳ hiện tại (mỗi entry một lần)
+        
+        Thời hạn chặn tăng theo số lần vi phạm; với ipset kernel cũng tự gỡ khi
+        hết hạn nên entry không bị kẹt lại nếu daemon dừng.
+        """
+        entry = format_ip(target) if isinstance(target, int) else target
+        if entry in self.pending_blocks or entry in self.committing:
+            return
+        duration = 0 if permanent else self.bans.next_duration(entry, self.clock())
+        self.pending_blocks[entry] = (reason, onset, duration)
+        self.pending_unblocks.pop(entry, None)
+        self.batcher.block(entry, timeout=duration)
+    
+    def expire_bans(self):
+        """Đưa các entry hết hạn chặn vào batch gỡ chặn của chu kỳ"""
+        for entry in self.bans.expire(self.clock()):
+            if entry in self.pending_blocks:
+                continue
+            count = self.bans.offense_count(entry, self.clock())
+            self.pending_unblocks[entry] = f"Hết hạn chặn (lần vi phạm {count})"
+            self.batcher.unblock(entry)
+    
+    def next_drop_poll(self):
+        """Số giây tới lần đọc bộ đếm drop kế tiếp, None nếu tắt"""
+        interval = CONFIG['drop_poll_interval']
+        if not interval:
+            return None
+        if self.last_drop_poll is None:
+            return 0.0
+        return max(self.last_drop_poll + interval - self.clock(), 0.0)
+    
+    def harvest_drops(self):
+        """Bộ đếm {entry: (gói, byte)} của mọi entry trong một lần gọi firewall, None nếu lỗi"""
+        self.last_drop_poll = self.clock()
+        counters = getattr(self.blocklist, 'counters', None)
+        if counters is None:
+            return None
+        try:
+            return counters()
+        except Exception as e:
+            logging.error(f"Lỗi đọc bộ đếm drop: {e}")
+            return None
+    
+    def review_drops(self, counters):
+        """Cập nhật tốc độ drop, gia hạn lệnh chặn sắp hết hạn mà vẫn còn lưu lượng
+
+        Trả về báo cáo để ghi ra drop_stats_file. Backend tự hết hạn (ipset) được
+        chặn lại với timeout mới qua batch, người gọi commit sau.
+        """
+        now = self.clock()
+        packets, nbytes = self.drops.dropped_packets, self.drops.dropped_bytes
+        self.drops.update(counters, now)
+        DROPPED_PACKETS.inc(self.drops.dropped_packets - packets)
+        DROPPED_BYTES.inc(self.drops.dropped_bytes - nbytes)
+        min_pps = CONFIG['ban_extend_min_pps']
+        DROPPING.set(self.drops.active(min_pps))
+        
+        step = CONFIG['ban_extend_step']
+        # Lệnh chặn hết hạn trước lần đọc sau thì phải quyết định ngay bây giờ
+        horizon = now + CONFIG['drop_poll_interval'] + self.scheduler.interval
+        if min_pps > 0 and step > 0:
+            for entry, (expires, count) in list(self.bans.bans.items()):
+                if expires > horizon or entry in self.pending_unblocks:
+                    continue
+                pps = self.drops.rate(entry)
+                if pps < min_pps or not self.bans.extend(entry, now + step):
+                    continue
+                if getattr(self.blocklist, 'timeouts', False):
+                    self.batcher.block(entry, timeout=step)
+                BAN_EXTENSIONS.inc()
+                logging.info(f"Gia hạn chặn {entry} thêm {format_duration(step)}: "
+                             f"vẫn drop {pps:.1f} gói/s (lần vi phạm {count})")
+                self.write_alert({
+                    'timestamp': now,
+                    'ip': entry,
+                    'reason': f"Vẫn drop {pps:.1f} gói/s khi sắp hết hạn chặn",
+                    'action': 'EXTENDED',
+                    'duration': step,
+                })
+        
+        bans = self.bans.bans
+        entries = self.drops.stats()
+        for entry, stats in entries.items():
+            stats['expires'] = bans[entry][0] if entry in bans else None
+        return {'time': now, 'interval': CONFIG['drop_poll_interval'], 'entries': entries}
+    
+    def save_drop_stats(self, report):
+        path = CONFIG['drop_stats_file']
+        if not path or report is None:
+            return
         try:
-            subprocess.run([
-                'iptables', '-I', 'INPUT', '1', '-s', ip, '-j', 'DROP'
-            ], check=True)
+            write_drop_stats(path, report)
+        except OSError as e:
+            logging.error(f"Lỗi ghi số liệu drop {path}: {e}")
+    
+    def poll_drops(self):
+        """Đọc bộ đếm drop nếu đã đến hạn (vòng lặp đồng bộ)"""
+        delay = self.next_drop_poll()
+        if delay is None or delay > 0:
+            return
+        counters = self.harvest_drops()
+        if counters is None:
+            return
+        report = self.review_drops(counters)
+        self.bans.save(self.clock())
+        self.save_drop_stats(report)
+    
+    def next_slow_poll(self):
+        """Số giây tới lần đọc tcp_info kế tiếp, None nếu tắt"""
+        if self.slow_collector is None or not CONFIG['slow_conn_interval']:
+            return None
+        if self.last_slow_poll is None:
+            return 0.0
+        return max(self.last_slow_poll + CONFIG['slow_conn_interval'] - self.clock(), 0.0)
+    
+    def harvest_slow_connections(self):
+        """tcp_info của các kết nối tới slow_conn_ports, None nếu lỗi"""
+        self.last_slow_poll = self.clock()
+        try:
+            sockets = self.slow_collector.collect()
+        except Exception as e:
+            logging.error(f"Lỗi đọc tcp_info: {e}")
+            return None
+        self.profiler.record_all('slow', self.slow_collector.last_timings)
+        return sockets
+    
+    def review_slow_connections(self, sockets):
+        """Đánh dấu kết nối treo, chặn IP giữ quá slow_conn_threshold kết nối treo"""
+        now = self.clock()
+        stalled = self.slow_conns.update(sockets, now, CONFIG['slow_conn_min_age'],
+                                         CONFIG['slow_conn_max_rate'], CONFIG['slow_conn_min_window'])
+        STALLED_CONNECTIONS.set(self.slow_conns.total_stalled())
+        limit = CONFIG['slow_conn_threshold']
+        if limit <= 0:
+            return
+        for key, count in stalled.items():
+            if count <= limit or self.whitelist.contains(key) or self.is_blocked(key):
+                continue
+            self.queue_block(key, f"Slow connection attack detected: {count} stalled connections "
+                                  f"of {self.slow_conns.connections[key]}")
+    
+    def poll_slow_connections(self):
+        """Đọc tcp_info nếu đã đến hạn (vòng lặp đồng bộ)"""
+        delay = self.next_slow_poll()
+        if delay is None or delay > 0:
+            return
+        sockets = self.harvest_slow_connections()
+        if sockets is not None:
+            self.review_slow_connections(sockets)
+    
+    def commit_blocks(self):
+        """Commit mọi quyết định chặn / gỡ chặn của chu kỳ thành một giao dịch firewall"""
+        batch = self.take_batch()
+        if batch is None:
+            return
+        with self.profiler.span('commit.firewall'):
+            results = self.batcher.commit(batch[2])
+        self.finish_batch(batch, results)
+        with self.profiler.span('commit.save_bans'):
+            self.bans.save(self.clock())
+    
+    def take_batch(self):
+        """Lấy các quyết định đang chờ cùng phần batch firewall tương ứng, None nếu không có"""
+        # Batcher có thể giữ entry không kèm quyết định (gia hạn timeout của ipset)
+        if not self.pending_blocks and not self.pending_unblocks and not len(self.batcher):
+            return None
+        pending, self.pending_blocks = self.pending_blocks, {}
+        unblocks, self.pending_unblocks = self.pending_unblocks, {}
+        self.committing.update(pending)
+        return pending, unblocks, self.batcher.take()
+    
+    def finish_batch(self, batch, results):
+        """Ghi nhận kết quả commit của một batch: đánh dấu đã chặn, thời hạn, alert"""
+        pending, unblocks, _ = batch
+        self.committing.difference_update(pending)
+        committed = self.clock()
+        
+        for ip, (reason, onset, duration) in pending.items():
+            action, ok, error = results.get(ip, ('block', False, 'không có kết quả'))
+            if not ok:
+                logging.error(f"Lỗi khi chặn IP {ip}: {error}")
+                BLOCK_FAILURES.inc()
+                continue
             
-            self.blocked_ips.add(ip)
-            logging.warning(f"Đã chặn IP {ip}: {reason}")
+            self.mark_blocked(ip)
+            BLOCKS.labels(reason_label(reason)).inc()
+            if onset is not None:
+                self.scheduler.record_detection(committed - onset)
+                TIME_TO_BLOCK.observe(committed - onset)
+            offense = None
+            if duration and self.bans.is_banned(ip):
+                # Lệnh chặn khôi phục sau khi khởi động lại: giữ hạn và số lần cũ
+                offense = self.bans.bans[ip][1]
+            elif duration:
+                offense = self.bans.ban(ip, committed, duration)
+            if duration:
+                logging.warning(f"Đã chặn IP {ip} trong {format_duration(duration)} "
+                                f"(lần vi phạm {offense}): {reason}")
+            else:
+                logging.warning(f"Đã chặn IP {ip}: {reason}")
             
             alert_data = {
-                'timestamp': time.time(),
+                'timestamp': self.clock(),
                 'ip': ip,
                 'reason': reason,
                 'action': 'BLOCKED'
             }
+            if duration:
+                alert_data['duration'] = duration
+                alert_data['offense'] = offense
             self.write_alert(alert_data)
-            
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Lỗi khi chặn IP {ip}: {e}")
+        
+        for ip, reason in unblocks.items():
+            action, ok, error = results.get(ip, ('unblock', False, 'không có kết quả'))
+            if not ok:
+                if not (getattr(self.blocklist, 'timeouts', False) or entry_missing(error)):
+                    # Rule iptables không tự hết hạn: giữ entry và gỡ lại ở lần expire sau
+                    logging.warning(f"Lỗi khi gỡ chặn IP {ip}, thử lại ở chu kỳ sau: {error}")
+                    UNBLOCK_FAILURES.inc()
+                    self.bans.retry(ip, self.clock())
+                    continue
+                # Entry đã không còn (vd ipset tự hết hạn); vẫn coi là hết chặn
+                logging.debug(f"Gỡ chặn IP {ip}: {error}")
+            self.unmark_blocked(ip)
+            UNBLOCKS.labels(reason_label(reason)).inc()
+            logging.info(f"Đã gỡ chặn IP {ip}: {reason}")
+            self.write_alert({
+                'timestamp': self.clock(),
+                'ip': ip,
+                'reason': reason,
+                'action': 'UNBLOCKED'
+            })
+    
+    def block_ip(self, ip, reason):
+        self.queue_block(ip, reason)
+        self.commit_blocks()
     
     def write_alert(self, alert_data):
+        if self.alert_sink is not None:
+            self.alert_sink(alert_data)
+            return
+        self.store_alert(alert_data)
+    
+    def store_alert(self, alert_data):
+        """Đưa alert vào kho alert (AlertWriter), lỗi chỉ ghi log"""
         try:
-            alert_file = '/var/log/firewall_alerts.json'
-            alerts = []
-            
-            if os.path.exists(alert_file):
-                with open(alert_file, 'r') as f:
-                    try:
-                        alerts = json.load(f)
-                    except json.JSONDecodeError:
-                        alerts = []
-            
-            alerts.append(alert_data)
-            
-            if len(alerts) > 100:
-                alerts = alerts[-100:]
-            
-            with open(alert_file, 'w') as f:
-                json.dump(alerts, f, indent=2)
-                
+            self.alerts.append(alert_data)
         except Exception as e:
+            ALERT_ERRORS.inc()
             logging.error(f"Lỗi ghi alert: {e}")
     
+    def reload_config(self):
+        """Nạp lại file cấu hình, áp dụng nguyên tử giữa hai chu kỳ phát hiện
+        
+        Cửa sổ trượt, bộ đếm dải mạng và tập IP đã chặn được giữ nguyên.
+        Entry blocklist mới chỉ được đưa vào batch, người gọi commit sau.
+        """
+        new = load_config_file(CONFIG['config_file'], CONFIG)
+        if new is None:
+            return False
+        changed = {key: value for key, value in new.items() if CONFIG.get(key) != value}
+        restart = sorted(key for key in changed if key not in HOT_RELOAD_KEYS)
+        if restart:
+            logging.warning(f"Cần khởi động lại để áp dụng: {', '.join(restart)}")
+        changed = {key: value for key, value in changed.items() if key in HOT_RELOAD_KEYS}
+        if not changed:
+            return False
+        
+        # Dựng mọi đối tượng mới trước, lỗi thì không thay đổi gì
+        merged = dict(CONFIG, **changed)
+        whitelist = PrefixIndex(merged['whitelist'])
+        
+        CONFIG.update(changed)
+        self.whitelist = whitelist
+        self.syn_prefixes.set_thresholds(CONFIG['prefix_syn_thresholds'], CONFIG['prefix_min_sources'],
+                                         CONFIG['prefix_syn_thresholds_v6'])
+        self.conn_prefixes.set_thresholds(CONFIG['prefix_conn_thresholds'], CONFIG['prefix_min_sources'],
+                                          CONFIG['prefix_conn_thresholds_v6'])
+        self.retune_counters()
+        if 'whitelist' in changed and self.shards is not None:
+            self.shards.remove_whitelisted(CONFIG['whitelist'])
+        elif 'whitelist' in changed:
+            # IP vừa được whitelist không bị tính tiếp trong cửa sổ
+            now = self.clock()
+            for counter in (self.syn_count, self.conn_count):
+                for key in [key for key, _ in counter.items(now) if whitelist.contains(key)]:
+                    counter.remove(key)
+        if 'blocklist' in changed:
+            self.apply_static_blocklist()
+        self.bans.configure(CONFIG['ban_durations'], CONFIG['ban_forget_after'])
+        for detector in (self.syn_anomaly, self.conn_anomaly):
+            detector.sigmas = CONFIG['anomaly_sigmas']
+        self.syn_anomaly.min_rate = CONFIG['anomaly_min_syn']
+        self.conn_anomaly.min_rate = CONFIG['anomaly_min_conn']
+        self.scheduler.configure(CONFIG['min_check_interval'], CONFIG['check_interval'],
+                                 CONFIG['near_threshold_ratio'], CONFIG['load_rise_factor'],
+                                 CONFIG['interval_backoff'])
+        logging.info(f"Đã nạp lại cấu hình: {', '.join(sorted(changed))}")
+        return True
+    
+    def next_interval(self):
+        """Thời gian chờ đến chu kỳ sau"""
+        if not CONFIG['adaptive_interval']:
+            return CONFIG['check_interval']
+        near = CONFIG['near_threshold_ratio']
+        floors = {'syn': CONFIG['syn_threshold'] * near, 'conn': CONFIG['conn_threshold'] * near}
+        return self.scheduler.update(self.peak_ratio, self.cycle_totals, floors)
+    
+    def run_stage(self, stage, func, *args):
+        """Chạy một giai đoạn của chu kỳ, ghi thời gian vào auto_block_stage_seconds"""
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.labels(stage).observe(elapsed)
+            self.profiler.record(stage, elapsed)
+    
+    def finish_cycle(self, duration):
+        """Ghi nhận một chu kỳ đã xong: lịch thích ứng, số liệu /metrics và log"""
+        self.scheduler.record_cycle(duration)
+        self.profiler.finish(self.clock(), duration,
+                             sockets=getattr(self.collector, 'last_socket_count', 0),
+                             interval=self.scheduler.interval)
+        self.export_metrics(duration)
+        self.log_status()
+    
+    def export_metrics(self, duration):
+        CYCLE_SECONDS.observe(duration)
+        LAST_CYCLE.set(self.clock())
+        CHECK_INTERVAL.set(self.scheduler.interval)
+        sockets = getattr(self.collector, 'last_socket_count', 0)
+        SOCKETS.set(sockets)
+        SOCKETS_PARSED.inc(sockets)
+        if self.shards is not None:
+            syn_sources, conn_sources, memory = self.shards.stats()
+        else:
+            syn_sources, conn_sources = len(self.syn_count), len(self.conn_count)
+            memory = self.syn_count.memory_bytes() + self.conn_count.memory_bytes()
+        TRACKED.labels('syn', 'ip').set(syn_sources)
+        TRACKED.labels('conn', 'ip').set(conn_sources)
+        TRACKED.labels('syn', 'prefix').set(len(self.syn_prefixes))
+        TRACKED.labels('conn', 'prefix').set(len(self.conn_prefixes))
+        WINDOW_MEMORY.labels('ip').set(memory)
+        WINDOW_MEMORY.labels('prefix').set(sum(counter.memory_bytes()
+                                               for aggregator in (self.syn_prefixes, self.conn_prefixes)
+                                               for counter in aggregator.levels.values()))
+        BLOCKED.labels('ip').set(len(self.blocked_ips))
+        BLOCKED.labels('net').set(len(self.blocked_nets))
+        TIMED_BANS.set(len(self.bans))
+    
+    def dump_profile(self, *_):
+        """Ghi thời gian các chu kỳ gần nhất (và stack đã lấy mẫu) ra profile_dump_file"""
+        try:
+            report = dump_profile(CONFIG['profile_dump_file'], self.profiler, self.sampler,
+                                  runtime=CONFIG['runtime'], collector=self.collector.name)
+        except Exception as e:
+            logging.error(f"Lỗi ghi hồ sơ hiệu năng: {e}")
+            return
+        logging.info(f"Đã ghi hồ sơ hiệu năng {len(report['cycles'])} chu kỳ "
+                     f"vào {CONFIG['profile_dump_file']}")
+    
+    def sample_once(self, *_):
+        """Lấy mẫu stack trong profile_window giây rồi ghi hồ sơ (SIGUSR2)"""
+        if self.sampler.start(CONFIG['profile_window'], lambda sampler: self.dump_profile()):
+            logging.info(f"Bắt đầu lấy mẫu stack trong {CONFIG['profile_window']}s")
+        else:
+            logging.info("Đang lấy mẫu stack, bỏ qua yêu cầu mới")
+    
+    def log_status(self):
+        if len(self.blocked_ips) > 0:
+            logging.info(f"IP đang bị chặn: {len(self.blocked_ips)} "
+                         f"({len(self.bans)} có thời hạn)")
+        self.log_metrics()
+    
+    def log_metrics(self):
+        now = self.clock()
+        if now - self.last_metrics_log < CONFIG['metrics_log_interval']:
+            return
+        self.last_metrics_log = now
+        stats = self.scheduler.stats()
+        logging.info(f"Chu kỳ {stats['interval']:.2f}s ({'tải cao' if stats['hot'] else 'yên tĩnh'}), "
+                     f"xử lý tb {stats['cycle_avg'] * 1000:.1f}ms p95 {stats['cycle_p95'] * 1000:.1f}ms, "
+                     f"phát hiện tb {stats['detect_avg']:.2f}s p95 {stats['detect_p95']:.2f}s "
+                     f"({stats['detections']} lần)")
+        if isinstance(self.syn_count, HeavyHitterCounter):
+            for label, counter in (('SYN', self.syn_count), ('kết nối', self.conn_count)):
+                logging.info(f"Heavy hitter {label}: đếm chính xác {len(counter)} nguồn, "
+                             f"nhận {counter.promoted}, thay {counter.evicted}, "
+                             f"từ chối {counter.rejected}, bộ nhớ {counter.memory_bytes() / 1024:.0f} KiB")
+        if self.shards is not None:
+            syn_sources, conn_sources, memory = self.shards.stats()
+            logging.info(f"Shard: {self.shards.workers} worker, {syn_sources} nguồn SYN, "
+                         f"{conn_sources} nguồn kết nối, bộ nhớ {memory / 1024:.0f} KiB, "
+                         f"khởi động lại {self.shards.restarts} lần")
+    
+    def wait_config(self, timeout):
+        """Chờ tối đa timeout giây, True nếu file cấu hình đổi (luôn False khi không theo dõi)"""
+        if self.config_watcher is None:
+            time.sleep(timeout)
+            return False
+        return self.config_watcher.wait(timeout)
+    
     def run(self):
         logging.info("Bắt đầu giám sát tự động phát hiện DoS/DDoS...")
         
         while True:
             try:
-                syn_stats, conn_stats = self.get_network_stats()
-                self.update_stats(syn_stats, conn_stats)
-                self.clean_old_records()
-                self.check_for_attacks()
+                started = time.time()
+                syn_stats, conn_stats, new_stats = self.run_stage('collect', self.get_network_stats)
+                self.run_stage('update', self.update_stats, syn_stats, conn_stats, new_stats)
+                self.run_stage('clean', self.clean_old_records)
+                self.run_stage('expire', self.expire_bans)
+                self.run_stage('drops', self.poll_drops)
+                self.run_stage('slow', self.poll_slow_connections)
+                self.run_stage('detect', self.detect)
+                self.run_stage('commit', self.commit_blocks)
+                if self.snapshot_due():
+                    self.run_stage('snapshot', self.save_snapshot)
+                self.finish_cycle(time.time() - started)
                 
-                if len(self.blocked_ips) > 0:
-                    logging.info(f"IP đang bị chặn: {len(self.blocked_ips)}")
-                
-                time.sleep(CONFIG['check_interval'])
+                # Thức dậy sớm nếu file cấu hình đổi, nạp lại trước chu kỳ sau
+                if self.wait_config(self.next_interval()):
+                    self.reload_config()
+                    self.commit_blocks()
                 
             except Exception as e:
                 logging.error(f"Lỗi trong vòng lặp chính: {e}")
                 time.sleep(CONFIG['check_interval'])
 
 def main():
+    setup_logging()
+    overrides = load_config_file(CONFIG['config_file'], CONFIG)
+    if overrides:
+        CONFIG.update(overrides)
+        logging.info(f"Đã đọc cấu hình từ {CONFIG['config_file']}")
     detector = DosDetector()
-    detector.run()
+    metrics_server = None
+    if CONFIG['metrics_port'] or CONFIG['metrics_socket']:
+        try:
+            metrics_server = MetricsServer(host=CONFIG['metrics_host'], port=CONFIG['metrics_port'],
+                                           socket_path=CONFIG['metrics_socket']).start()
+        except OSError as e:
+            logging.error(f"Không mở được endpoint metrics: {e}")
+    if CONFIG['profile_sampling']:
+        detector.sampler.start()
+    signal.signal(signal.SIGUSR1, detector.dump_profile)
+    signal.signal(signal.SIGUSR2, detector.sample_once)
+    # SIGTERM (systemctl stop) đi qua finally để ghi snapshot trước khi thoát
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if CONFIG['runtime'] == 'asyncio':
+            asyncio.run(AsyncRuntime(detector).run())
+        else:
+            detector.run()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        detector.sampler.stop()
+        detector.save_snapshot()
+        if detector.config_watcher is not None:
+            detector.config_watcher.close()
+        detector.alerts.close()
+        if detector.shards is not None:
+            detector.shards.close()
 
 if __name__ == "__main__":
     main()
@@ -4,10 +4,13 @@ import subprocess
 import json
 import os
 
+from ip_index import is_valid_entry
+import config_watcher
+
 class AutoBlockTab:
     def __init__(self, parent):
         self.parent = parent
-        self.config_file = "/etc/firewall_auto_block.conf"
+        self.config_file = config_watcher.CONFIG_FILE
         self.service_name = "firewall-auto-block"
         
         self.create_widgets()
@@ -58,9 +61,9 @@ class AutoBlockTab:
         whitelist_control_frame = ttk.Frame(whitelist_frame)
         whitelist_control_frame.pack(fill=tk.X, padx=5, pady=5)
         
-        ttk.Label(whitelist_control_frame, text="Thêm IP:").pack(side=tk.LEFT)
+        ttk.Label(whitelist_control_frame, text="Thêm IP/CIDR/dải:").pack(side=tk.LEFT)
         self.new_ip_var = tk.StringVar()
-        ttk.Entry(whitelist_control_frame, textvariable=self.new_ip_var, width=15).pack(side=tk.LEFT, padx=5)
+        ttk.Entry(whitelist_control_frame, textvariable=self.new_ip_var, width=32).pack(side=tk.LEFT, padx=5)
         ttk.Button(whitelist_control_frame, text="Thêm", command=self.add_whitelist_ip).pack(side=tk.LEFT, padx=5)
         
         # Whitelist list
@@ -159,26 +162,34 @@ class AutoBlockTab:
             # Lấy whitelist từ listbox
             whitelist = list(self.whitelist_listbox.get(0, tk.END))
             
-            config = {
+            # Giữ các khoá khác trong file (vd ngưỡng theo dải) do người quản trị tự thêm
+            config = self.read_config_file()
+            config.update({
                 'syn_threshold': str(syn_val),
                 'conn_threshold': str(conn_val),
                 'check_interval': str(interval_val),
                 'whitelist': whitelist
-            }
+            })
             
             self.save_config_file(config)
-            messagebox.showinfo("Thành công", "Đã lưu cấu hình")
+            messagebox.showinfo("Thành công", "Đã lưu cấu hình (daemon tự nạp lại)")
             
         except ValueError as e:
             messagebox.showerror("Lỗi", f"Giá trị không hợp lệ: {e}")
+        except OSError as e:
+            messagebox.showerror("Lỗi", f"Không thể lưu cấu hình: {e}")
+    
+    def read_config_file(self):
+        try:
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+            return config if isinstance(config, dict) else {}
+        except (OSError, ValueError):
+            return {}
     
     def save_config_file(self, config):
-        """Lưu cấu hình vào file"""
-        # Đảm bảo thư mục tồn tại
-        os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
-        
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=2)
+        """Lưu cấu hình vào file (ghi nguyên tử để daemon không đọc phải file ghi dở)"""
+        config_watcher.save_config_file(self.config_file, config)
     
     def add_whitelist_ip(self):
         """Thêm IP vào whitelist"""
@@ -187,9 +198,9 @@ class AutoBlockTab:
             messagebox.showwarning("Cảnh báo", "Vui lòng nhập IP")
             return
         
-        # Validate IP
-        if not self.is_valid_ip(ip):
-            messagebox.showerror("Lỗi", "IP không hợp lệ")
+        # Validate IP, CIDR (10.0.0.0/8) hoặc dải (10.0.0.1-10.0.0.50)
+        if not is_valid_entry(ip):
+            messagebox.showerror("Lỗi", "IP/CIDR/dải IP không hợp lệ")
             return
         
         # Thêm vào listbox nếu chưa tồn tại
@@ -208,13 +219,3 @@ class AutoBlockTab:
         
         for index in reversed(selection):
             self.whitelist_listbox.delete(index)
-    
-    def is_valid_ip(self, ip):
-        """Kiểm tra IP hợp lệ"""
-        parts = ip.split('.')
-        if len(parts) != 4:
-            return False
-        try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError:
-            return False
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Thời hạn chặn tự hết hạn, tăng dần với IP vi phạm lặp lại
+
+Lần vi phạm thứ n bị chặn durations[min(n, len) - 1] giây (vd 5 phút, 1 giờ,
+1 ngày). Số lần vi phạm được nhớ forget_after giây kể từ lần vi phạm cuối.
+Hết hạn được điều khiển bằng TimerWheel nên mỗi tick là O(1) dù có hàng nghìn
+lệnh chặn đang chờ.
+
+Trạng thái (thời điểm hết hạn, số lần vi phạm) được ghi nguyên tử ra file JSON
+để giữ nguyên qua các lần khởi động lại daemon.
+"""
+
+import json
+import os
+import logging
+
+from timer_wheel import TimerWheel
+
+BAN_STATE_FILE = '/var/lib/firewall_auto_block/bans.json'
+
+
+def format_duration(seconds):
+    for unit, size in (('ngày', 86400), ('giờ', 3600), ('phút', 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"{seconds // size} {unit}"
+    return f"{seconds} giây"
+
+
+class BanManager:
+    def __init__(self, durations, forget_after=7 * 86400, state_path=None, now=0.0):
+        # durations rỗng = chặn vĩnh viễn như trước
+        self.durations = [int(d) for d in durations]
+        self.forget_after = forget_after
+        self.state_path = state_path
+        self.bans = {}      # entry -> (thời điểm hết hạn, lần vi phạm)
+        self.offenses = {}  # entry -> (số lần vi phạm, thời điểm vi phạm cuối)
+        self.wheel = TimerWheel(now=now)
+        self.dirty = False
+
+    def configure(self, durations, forget_after):
+        """Đổi mức chặn khi nạp lại cấu hình; lệnh chặn đang có giữ nguyên hạn"""
+        self.durations = [int(d) for d in durations]
+        self.forget_after = forget_after
+
+    def offense_count(self, entry, now):
+        count, last = self.offenses.get(entry, (0, 0))
+        if now - last > self.forget_after:
+            return 0
+        return count
+
+    def next_duration(self, entry, now):
+        """Thời hạn cho lần vi phạm tới của entry, 0 = vĩnh viễn"""
+        if not self.durations:
+            return 0
+        index = min(self.offense_count(entry, now), len(self.durations) - 1)
+        return self.durations[index]
+
+    def ban(self, entry, now, duration):
+        """Ghi nhận entry vừa bị chặn duration giây, trả về số lần vi phạm"""
+        count = self.offense_count(entry, now) + 1
+        self.offenses[entry] = (count, now)
+        if duration:
+            self.bans[entry] = (now + duration, count)
+            self.wheel.schedule(entry, now + duration)
+        self.dirty = True
+        return count
+
+    def extend(self, entry, expires):
+        """Dời hạn chặn của entry tới expires (không rút ngắn), False nếu entry không bị chặn"""
+        ban = self.bans.get(entry)
+        if ban is None or expires <= ban[0]:
+            return False
+        self.bans[entry] = (expires, ban[1])
+        self.wheel.schedule(entry, expires)
+        self.dirty = True
+        return True
+
+    def retry(self, entry, when):
+        """Hẹn lại entry gỡ chặn thất bại để expire() trả về lần nữa từ when, giữ số lần vi phạm"""
+        count = self.offenses.get(entry, (1, when))[0]
+        self.bans[entry] = (when, count)
+        self.wheel.schedule(entry, when)
+        self.dirty = True
+
+    def release(self, entry):
+        """Bỏ hẹn giờ của entry (vd đã được gỡ chặn thủ công)"""
+        if self.bans.pop(entry, None) is not None:
+            self.wheel.cancel(entry)
+            self.dirty = True
+
+    def expire(self, now):
+        """Các entry đã hết hạn chặn tính đến now"""
+        # Sắp xếp để thứ tự gỡ chặn không phụ thuộc hash của chuỗi (replay lặp lại được)
+        expired = sorted(self.wheel.advance(now))
+        for entry in expired:
+            self.bans.pop(entry, None)
+        if expired:
+            self.dirty = True
+        return expired
+
+    def is_banned(self, entry):
+        return entry in self.bans
+
+    def __len__(self):
+        return len(self.bans)
+
+    # ---------- lưu / nạp trạng thái ----------
+    def load(self, now):
+        """Nạp trạng thái đã lưu; lệnh chặn đã quá hạn sẽ trả về ở lần expire() kế tiếp"""
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Lỗi đọc trạng thái chặn {self.state_path}: {e}")
+            return
+        for entry, (count, last) in state.get('offenses', {}).items():
+            if now - last <= self.forget_after:
+                self.offenses[entry] = (int(count), float(last))
+        for entry, (expires, count) in state.get('bans', {}).items():
+            self.bans[entry] = (float(expires), int(count))
+            self.wheel.schedule(entry, float(expires))
+
+    def save(self, now):
+        self.write(self.snapshot(now))
+
+    def snapshot(self, now):
+        """Bản sao trạng thái cần ghi, None nếu không có gì đổi
+
+        Tách khỏi write() để có thể ghi đĩa ở thread khác trong khi trạng thái tiếp tục thay đổi.
+        """
+        if not self.state_path or not self.dirty:
+            return None
+        # Quên các vi phạm đã quá cũ để file không phình mãi
+        self.offenses = {entry: value for entry, value in self.offenses.items()
+                         if now - value[1] <= self.forget_after or entry in self.bans}
+        self.dirty = False
+        return {
+            'bans': {entry: list(value) for entry, value in self.bans.items()},
+            'offenses': {entry: list(value) for entry, value in self.offenses.items()},
+        }
+
+    def write(self, state):
+        if state is None:
+            return
+        tmp = self.state_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            self.dirty = True
+            logging.error(f"Lỗi lưu trạng thái chặn {self.state_path}: {e}")
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Mức nền thích ứng (EWMA trung bình + phương sai) theo nguồn, theo dải và toàn máy
+
+Mỗi nguồn chỉ giữ 4 số (trung bình, phương sai, lần cập nhật cuối, số mẫu)
+trong các array kiểu C; dict chỉ ánh xạ key -> vị trí trong array. Hệ số
+EWMA tính theo thời gian thực (chu kỳ bán rã), nên kết quả không phụ thuộc
+nhịp lấy mẫu; thời gian nguồn vắng mặt được tính như một mẫu bằng 0.
+
+Nguồn mới (chưa đủ `warmup` mẫu) được so với mức nền của cả quần thể nguồn
+(phân bố tốc độ giữa các nguồn, làm mượt theo thời gian) thay vì mức nền riêng.
+"""
+
+import math
+from array import array
+from collections import defaultdict
+
+from ip_core import network_key, format_cidr, V4_MAX
+
+
+def _alpha(elapsed, tau):
+    return 1.0 - math.exp(-max(elapsed, 0.0) / tau)
+
+
+def _sigma(mean, var):
+    # Chặn dưới để nguồn rất đều đặn không bị báo vì dao động nhỏ
+    return max(math.sqrt(max(var, 0.0)), 1.0, 0.1 * mean)
+
+
+class EwmaBaseline:
+    """EWMA trung bình / phương sai cho từng key, lưu trong array"""
+
+    def __init__(self, tau):
+        self.tau = tau
+        self._slots = {}
+        self._free = []
+        self._mean = array('d')
+        self._var = array('d')
+        self._last = array('d')
+        self._count = array('I')
+
+    def _slot(self, key, now):
+        index = self._slots.get(key)
+        if index is not None:
+            return index, False
+        if self._free:
+            index = self._free.pop()
+            self._mean[index] = self._var[index] = 0.0
+            self._last[index] = now
+            self._count[index] = 0
+        else:
+            index = len(self._mean)
+            self._mean.append(0.0)
+            self._var.append(0.0)
+            self._last.append(now)
+            self._count.append(0)
+        self._slots[key] = index
+        return index, True
+
+    def _step(self, index, value, alpha):
+        mean = self._mean[index]
+        diff = value - mean
+        increment = alpha * diff
+        self._mean[index] = mean + increment
+        self._var[index] = (1.0 - alpha) * (self._var[index] + diff * increment)
+
+    def expected(self, key, now, interval):
+        """(trung bình, độ lệch chuẩn, số mẫu) dự kiến tại now, trước khi có mẫu mới"""
+        index = self._slots.get(key)
+        if index is None:
+            return 0.0, 0.0, 0
+        mean, var = self._mean[index], self._var[index]
+        gap = now - interval - self._last[index]
+        if gap > 0.5 * interval:
+            # Vắng mặt một khoảng: coi như một mẫu 0
+            alpha = _alpha(gap, self.tau)
+            var = (1.0 - alpha) * (var + alpha * mean * mean)
+            mean -= alpha * mean
+        return mean, _sigma(mean, var), self._count[index]
+
+    def observe(self, key, value, now, interval, damping=1.0):
+        """Thêm mẫu value của khoảng interval giây kết thúc tại now
+
+        damping < 1 làm mức nền học chậm hơn (dùng cho mẫu bị nghi là tấn công).
+        """
+        index, _ = self._slot(key, now)
+        gap = now - interval - self._last[index]
+        if self._count[index] and gap > 0.5 * interval:
+            self._step(index, 0.0, _alpha(gap, self.tau))
+        if self._count[index] == 0:
+            self._mean[index] = value
+        else:
+            self._step(index, value, _alpha(interval, self.tau) * damping)
+        self._last[index] = now
+        if self._count[index] < 0xffffffff:
+            self._count[index] += 1
+
+    def expire(self, now, idle):
+        """Xoá các key không có mẫu trong idle giây"""
+        stale = [key for key, index in self._slots.items() if now - self._last[index] > idle]
+        for key in stale:
+            self._free.append(self._slots.pop(key))
+        return len(stale)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def memory_bytes(self):
+        return sum(a.itemsize * len(a) for a in (self._mean, self._var, self._last, self._count))
+
+
+class PopulationBaseline:
+    """Phân bố tốc độ giữa các nguồn của toàn máy, làm mượt theo thời gian"""
+
+    def __init__(self, tau):
+        self.tau = tau
+        self.mean = None
+        self.var = 0.0
+
+    def observe(self, values, interval):
+        if not values:
+            return
+        count = len(values)
+        mean = sum(values) / count
+        var = sum((v - mean) ** 2 for v in values) / count
+        if self.mean is None:
+            self.mean, self.var = mean, var
+            return
+        alpha = _alpha(interval, self.tau)
+        self.mean += alpha * (mean - self.mean)
+        self.var += alpha * (var - self.var)
+
+    def expected(self):
+        if self.mean is None:
+            return 0.0, 0.0
+        return self.mean, _sigma(self.mean, self.var)
+
+
+class AnomalyDetector:
+    """Phát hiện nguồn / dải có tốc độ lệch quá `sigmas` độ lệch chuẩn so với mức nền
+
+    Giá trị đưa vào là tốc độ của mỗi nguồn trong chu kỳ (cùng đơn vị giữa các chu kỳ).
+    min_rate: tốc độ tối thiểu để bị báo, tránh báo các nguồn gần như im lặng.
+    """
+
+    def __init__(self, halflife, sigmas, min_rate, warmup=10, prefix_v4=24, prefix_v6=64,
+                 min_sources=5):
+        tau = halflife / math.log(2)
+        self.sigmas = sigmas
+        self.min_rate = min_rate
+        self.warmup = warmup
+        self.prefix_lens = (prefix_v4, prefix_v6)
+        self.min_sources = min_sources
+        self.sources = EwmaBaseline(tau)
+        self.prefixes = EwmaBaseline(tau)
+        self.population = PopulationBaseline(tau)
+        self.prefix_population = PopulationBaseline(tau)
+        # Không báo gì trong warmup chu kỳ đầu: các nguồn có sẵn lúc khởi động
+        # (vd NAT gateway) được học mức nền riêng trước
+        self.cycles = 0
+
+    def _score(self, baseline, population, key, value, now, interval):
+        """(z, trung bình, độ lệch chuẩn) theo mức nền riêng, hoặc quần thể nếu chưa đủ mẫu"""
+        mean, sigma, count = baseline.expected(key, now, interval)
+        if count < self.warmup:
+            if population.mean is None:
+                return 0.0, 0.0, 0.0
+            mean, sigma = population.expected()
+        return (value - mean) / sigma, mean, sigma
+
+    def update(self, rates, now, interval):
+        """Cập nhật mức nền với tốc độ của chu kỳ, trả về (nguồn bất thường, dải bất thường)
+
+        Mỗi phần tử: (khoá hoặc (khoá mạng, độ dài prefix), tốc độ, trung bình, độ lệch chuẩn, z)
+        """
+        learning = self.cycles < self.warmup
+        self.cycles += 1
+        flagged_sources = []
+        for key, value in rates.items():
+            z, mean, sigma = self._score(self.sources, self.population, key, value, now, interval)
+            anomalous = not learning and value >= self.min_rate and z > self.sigmas
+            if anomalous:
+                flagged_sources.append((key, value, mean, sigma, z))
+            self.sources.observe(key, value, now, interval, 0.1 if anomalous else 1.0)
+
+        prefix_rates = defaultdict(float)
+        prefix_sources = defaultdict(int)
+        for key, value in rates.items():
+            plen = self.prefix_lens[0] if key <= V4_MAX else self.prefix_lens[1]
+            net = (network_key(key, plen), plen)
+            prefix_rates[net] += value
+            prefix_sources[net] += 1
+
+        flagged_prefixes = []
+        for net, value in prefix_rates.items():
+            z, mean, sigma = self._score(self.prefixes, self.prefix_population, net, value, now, interval)
+            anomalous = (not learning and value >= self.min_rate and z > self.sigmas
+                         and prefix_sources[net] >= self.min_sources)
+            if anomalous:
+                flagged_prefixes.append((net, value, mean, sigma, z))
+            self.prefixes.observe(net, value, now, interval, 0.1 if anomalous else 1.0)
+
+        # Mức nền quần thể không học từ các nguồn đang bị nghi
+        suspicious = {item[0] for item in flagged_sources}
+        self.population.observe([v for k, v in rates.items() if k not in suspicious], interval)
+        suspicious = {item[0] for item in flagged_prefixes}
+        self.prefix_population.observe([v for k, v in prefix_rates.items() if k not in suspicious],
+                                       interval)
+        return flagged_sources, flagged_prefixes
+
+    def expire(self, now, idle):
+        return self.sources.expire(now, idle) + self.prefixes.expire(now, idle)
+
+    def memory_bytes(self):
+        return self.sources.memory_bytes() + self.prefixes.memory_bytes()
+
+
+def format_prefix(net):
+    net_key, plen = net
+    return format_cidr(net_key, plen)
+
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Đo độ chính xác top-k và bộ nhớ của HeavyHitterCounter so với đếm chính xác
+
+Cùng một chuỗi số đếm theo chu kỳ được đưa vào SlidingWindowCounter (đường
+chính xác) và HeavyHitterCounter. Dữ liệu lấy từ file pcap đã ghi (mỗi gói
+SYN là một sự kiện, chia chu kỳ theo timestamp) hoặc sinh giả lập: nguồn hợp
+lệ phân bố Zipf, vài IP tấn công và flood từ IP giả mạo ngẫu nhiên.
+
+Báo cáo mỗi --report chu kỳ và cuối cùng:
+- precision / recall của top-k so với top-k thật
+- precision / recall của tập IP vượt ngưỡng (sẽ bị chặn) và độ trễ phát hiện
+- sai số tương đối của số đếm cho top-k thật, bộ nhớ và thời gian mỗi chu kỳ
+
+Chạy: python3 benchmarks/bench_heavy_hitters.py [--pcap file.pcap] [--spoofed 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from heavy_hitters import HeavyHitterCounter  # noqa: E402
+from sliding_window import SlidingWindowCounter  # noqa: E402
+from syn_capture import iter_pcap_syns  # noqa: E402
+
+
+def pcap_cycles(path, interval):
+    """Chia các gói SYN của file pcap thành (thời điểm, {khoá: số SYN}) theo chu kỳ"""
+    counts = defaultdict(int)
+    end = None
+    for ts, key in iter_pcap_syns(path):
+        if end is None:
+            end = ts + interval
+        while ts >= end:
+            yield end, dict(counts)
+            counts.clear()
+            end += interval
+        counts[key] += 1
+    if counts:
+        yield end, dict(counts)
+
+
+def synthetic_cycles(args, rng):
+    """Nguồn hợp lệ (Zipf) + IP tấn công đều đặn + IP giả mạo mới mỗi chu kỳ"""
+    legit = [rng.getrandbits(32) for _ in range(args.legit)]
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.legit)]
+    attackers = [rng.getrandbits(32) for _ in range(args.attackers)]
+    for cycle in range(args.cycles):
+        counts = defaultdict(int)
+        for key in rng.choices(legit, weights, k=args.legit_events):
+            counts[key] += 1
+        if cycle >= args.attack_start:
+            for key in attackers:
+                counts[key] += args.attack_rate
+        for _ in range(args.spoofed):
+            counts[rng.getrandbits(32)] += 1
+        yield (cycle + 1) * args.interval, counts
+
+
+def precision_recall(found, truth):
+    if not found and not truth:
+        return 1.0, 1.0
+    hit = len(found & truth)
+    return (hit / len(found) if found else 1.0), (hit / len(truth) if truth else 1.0)
+
+
+def evaluate(cycles, args):
+    exact = SlidingWindowCounter(args.window, args.buckets)
+    hh = HeavyHitterCounter(args.window, args.buckets, args.memory, args.depth, args.capacity,
+                            args.threshold * args.promote_ratio)
+    first_exact = {}
+    first_hh = {}
+    times = {'exact': 0.0, 'hh': 0.0}
+    peak = {'exact': 0, 'hh': 0}
+    cycle = 0
+
+    for now, counts in cycles:
+        cycle += 1
+        for label, counter in (('exact', exact), ('hh', hh)):
+            start = time.perf_counter()
+            counter.update(counts, now)
+            counter.expire(now)
+            times[label] += time.perf_counter() - start
+            peak[label] = max(peak[label], counter.memory_bytes())
+
+        true_totals = dict(exact.items(now))
+        for key, total in true_totals.items():
+            if total > args.threshold:
+                first_exact.setdefault(key, cycle)
+        for key, total in hh.items(now):
+            if total > args.threshold:
+                first_hh.setdefault(key, cycle)
+        if cycle % args.report == 0:
+            report(cycle, now, true_totals, exact, hh, first_exact, first_hh, times, peak, args)
+
+    if cycle and cycle % args.report:
+        report(cycle, now, dict(exact.items(now)), exact, hh, first_exact, first_hh, times, peak, args)
+
+
+def report(cycle, now, true_totals, exact, hh, first_exact, first_hh, times, peak, args):
+    k = args.top
+    true_top = sorted(true_totals.items(), key=lambda item: item[1], reverse=True)[:k]
+    # Chỉ so các vị trí top-k có số đếm vượt mức nhận (dưới đó top-k là nhiễu)
+    truth = {key for key, total in true_top if total >= args.threshold * args.promote_ratio}
+    found = {key for key, _, _ in hh.top(len(truth), now)} if truth else set()
+    top_p, top_r = precision_recall(found, truth)
+
+    over_truth = set(first_exact)
+    over_hh = set(first_hh)
+    over_p, over_r = precision_recall(over_hh, over_truth)
+    delays = [first_hh[key] - first_exact[key] for key in over_truth & over_hh]
+
+    errors = []
+    for key, total in true_top:
+        if key in truth:
+            errors.append(abs(total - hh.get(key, now)) / total)
+
+    print(f"Chu kỳ {cycle}: {len(true_totals)} nguồn trong cửa sổ, "
+          f"chính xác {len(exact)} / heavy hitter {len(hh)} khoá")
+    print(f"  top-{len(truth)}: precision {top_p:.3f} recall {top_r:.3f}, "
+          f"sai số tương đối tb {sum(errors) / len(errors) if errors else 0.0:.3f}")
+    print(f"  vượt ngưỡng {args.threshold}: thật {len(over_truth)}, precision {over_p:.3f} "
+          f"recall {over_r:.3f}, trễ tb {sum(delays) / len(delays) if delays else 0.0:.2f} chu kỳ")
+    print(f"  bộ nhớ đỉnh: chính xác {peak['exact'] / 1024:.0f} KiB, "
+          f"heavy hitter {peak['hh'] / 1024:.0f} KiB; "
+          f"thời gian tb {times['exact'] / cycle * 1000:.1f} / {times['hh'] / cycle * 1000:.1f} ms/chu kỳ")
+    print(f"  nhận {hh.promoted}, thay {hh.evicted}, từ chối {hh.rejected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--pcap', help='file pcap đã ghi (bỏ qua phần giả lập)')
+    parser.add_argument('--interval', type=float, default=10.0, help='chu kỳ (giây)')
+    parser.add_argument('--window', type=float, default=60.0)
+    parser.add_argument('--buckets', type=int, default=12)
+    parser.add_argument('--threshold', type=int, default=50)
+    parser.add_argument('--promote-ratio', type=float, default=0.5)
+    parser.add_argument('--memory', type=int, default=4 * 1024 * 1024, help='byte cho sketch')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--capacity', type=int, default=10000)
+    parser.add_argument('--top', type=int, default=100)
+    parser.add_argument('--report', type=int, default=5, help='in kết quả mỗi N chu kỳ')
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--legit', type=int, default=5000)
+    parser.add_argument('--legit-events', type=int, default=20000)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--attackers', type=int, default=50)
+    parser.add_argument('--attack-rate', type=int, default=15)
+    parser.add_argument('--attack-start', type=int, default=5)
+    parser.add_argument('--spoofed', type=int, default=100000,
+                        help='số IP giả mạo mới mỗi chu kỳ')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.pcap:
+        cycles = pcap_cycles(args.pcap, args.interval)
+    else:
+        cycles = synthetic_cycles(args, random.Random(args.seed))
+    evaluate(cycles, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+So sánh đường xử lý IP dạng chuỗi cũ với ip_core
+
+- Tốc độ parse cột địa chỉ của output ss (IP:port) và /proc/net/tcp
+- Bộ nhớ của dict đếm / set key theo chuỗi so với key số nguyên
+
+Chạy: python3 benchmarks/bench_ip_core.py [--ips 50000] [--lines 200000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ip_core import AddressParser, format_ip, from_proc_hex, parse_ip  # noqa: E402
+
+
+def legacy_is_valid_ip(ip):
+    """Bản is_valid_ip cũ (chỉ IPv4)"""
+    parts = ip.split('.')
+    if len(parts) != 4:
+        return False
+    try:
+        return all(0 <= int(part) <= 255 for part in parts)
+    except ValueError:
+        return False
+
+
+def make_ips(count, v6_ratio, rng):
+    ips = []
+    for _ in range(count):
+        if rng.random() < v6_ratio:
+            ips.append(format_ip((1 << 128) | (0x20010db8 << 96) | rng.getrandbits(64)))
+        else:
+            ips.append(format_ip(rng.getrandbits(32)))
+    return ips
+
+
+def make_ss_lines(ips, count, rng):
+    lines = []
+    for _ in range(count):
+        ip = rng.choice(ips)
+        peer = f"[{ip}]" if ':' in ip else ip
+        lines.append(f"ESTAB 0 0 10.0.0.1:443 {peer}:{rng.randint(1024, 65535)}")
+    return lines
+
+
+def make_proc_lines(ips, count, rng):
+    # /proc/net/tcp chỉ chứa IPv4, IPv6 nằm ở /proc/net/tcp6
+    v4_ips = [ip for ip in ips if ':' not in ip] or ['10.0.0.1']
+    lines = []
+    for _ in range(count):
+        ip = rng.choice(v4_ips)
+        hex_addr = parse_ip(ip).to_bytes(4, 'little').hex().upper()
+        lines.append(f"   0: 0100000A:01BB {hex_addr}:{rng.randint(1024, 65535):04X} 01")
+    return lines
+
+
+def timed(label, func, items):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<36} {elapsed * 1000:9.1f} ms  {items / elapsed / 1e6:6.2f} M dòng/s")
+    return result
+
+
+def bench_parse(lines):
+    print(f"Parse cột địa chỉ ss ({len(lines)} dòng)")
+
+    def legacy():
+        counts = defaultdict(int)
+        for line in lines:
+            parts = line.split()
+            ip = parts[4].rsplit(':', 1)[0]
+            if legacy_is_valid_ip(ip):
+                counts[ip] += 1
+        return counts
+
+    def core():
+        counts = defaultdict(int)
+        for key in AddressParser().parse_column(lines, 4):
+            counts[key] += 1
+        return counts
+
+    old = timed("chuỗi + is_valid_ip (chỉ IPv4)", legacy, len(lines))
+    new = timed("ip_core.AddressParser (IPv4 + IPv6)", core, len(lines))
+    print(f"  số nguồn: chuỗi={len(old)} ip_core={len(new)}")
+
+
+def bench_proc(lines):
+    print(f"Parse /proc/net/tcp ({len(lines)} dòng)")
+
+    def legacy():
+        counts = defaultdict(int)
+        for line in lines:
+            hex_addr = line.split()[2].split(':')[0]
+            raw = bytes.fromhex(hex_addr)
+            ip = '.'.join(str(b) for b in reversed(raw))
+            counts[ip] += 1
+        return counts
+
+    def core():
+        counts = defaultdict(int)
+        for line in lines:
+            counts[from_proc_hex(line.split()[2].split(':')[0])] += 1
+        return counts
+
+    timed("hex -> chuỗi dotted", legacy, len(lines))
+    timed("hex -> khoá (from_proc_hex)", core, len(lines))
+
+
+def measure(build):
+    tracemalloc.start()
+    data = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def bench_memory(ips):
+    keys = [parse_ip(ip) for ip in ips]
+    print(f"Bộ nhớ ({len(ips)} IP)")
+    # Tạo lại đối tượng key bên trong phép đo để tracemalloc tính cả chúng
+    for label, build_str, build_key in (
+        ('dict đếm', lambda: {format_ip(k): 1 for k in keys}, lambda: {parse_ip(ip): 1 for ip in ips}),
+        ('set', lambda: {format_ip(k) for k in keys}, lambda: {parse_ip(ip) for ip in ips}),
+    ):
+        str_size = measure(build_str)
+        key_size = measure(build_key)
+        print(f"  {label:<10} chuỗi={str_size / 1024:9.1f} KiB  "
+              f"khoá={key_size / 1024:9.1f} KiB  ({key_size / str_size:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--ips', type=int, default=50000)
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--v6-ratio', type=float, default=0.0,
+                        help='tỉ lệ IPv6 (đường chuỗi cũ bỏ qua toàn bộ IPv6)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ips = make_ips(args.ips, args.v6_ratio, rng)
+    bench_parse(make_ss_lines(ips, args.lines, rng))
+    bench_proc(make_proc_lines(ips, args.lines, rng))
+    bench_memory(ips)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+"""
+Đo khả năng mở rộng các đường nóng của daemon theo kích thước dữ liệu
+
+Với mỗi kích thước N (số socket / IP theo dõi / alert / entry bị chặn), sinh
+dữ liệu giả lập rồi chạy code thật của DosDetector:
+- get_network_stats: output `netstat -tn` + `ss -tn` (collector subprocess) và
+  /proc/net/tcp{,6} (collector proc) với N socket, lọc whitelist; với
+  --conn-signal new (mặc định) gồm cả so 4-tuple với chu kỳ trước, chi phí
+  theo --churn
+- update_stats, clean_old_records, check_for_attacks: N nguồn mỗi chu kỳ,
+  một phần nguồn thay mới mỗi chu kỳ và vài IP tấn công mới vượt ngưỡng
+  (firewall là MemoryBlocklist, đồng hồ ảo)
+- write_alert: N alert qua AlertWriter thật vào thư mục tạm (kể cả xoay vòng)
+- alert_recent / alert_since: đọc lại lịch sử N alert vừa ghi qua AlertReader
+- snapshot_capture / save_snapshot / restore_snapshot: sao chép, ghi và nạp lại
+  snapshot cửa sổ trượt sau các chu kỳ trên (khởi động nóng)
+- load_blocked_ips: output `iptables-save` hoặc `ipset save` với N entry
+- tcp_info_parse / slow_review: trả lời sock_diag kèm tcp_info của N kết nối
+  tới cổng dịch vụ (vài IP giữ kết nối treo) và bước đánh dấu kết nối treo
+
+Mỗi giai đoạn báo thông lượng (phần tử/s), độ trễ p50/p95/p99 của một lần
+gọi và bộ nhớ đỉnh (tracemalloc, phần cấp phát thêm trong lúc chạy giai
+đoạn, đo ở một lượt riêng). detector_state là bộ nhớ cửa sổ trượt và bộ đếm
+dải mạng còn giữ sau các chu kỳ.
+
+--save lưu kết quả làm mốc; --baseline so với mốc đã lưu, thoát mã 1 nếu
+thông lượng giảm hoặc bộ nhớ đỉnh tăng quá --tolerance.
+
+Chạy: python3 benchmarks/bench_pipeline.py [--sizes 10000,100000,1000000]
+                                            [--save base.json | --baseline base.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alert_store import AlertReader, AlertWriter  # noqa: E402
+from auto_block import CONFIG, DosDetector  # noqa: E402
+from firewall_backend import (IpsetBlocklist, IptablesBlocklist,  # noqa: E402
+                              MemoryBlocklist)
+from ip_core import V6_FLAG, format_ip  # noqa: E402
+from ip_index import PrefixIndex  # noqa: E402
+from replay import MemoryAlerts, VirtualClock  # noqa: E402
+from socket_collector import (_NLMSG_HDR, _TCPI_WND, INET_DIAG_INFO,  # noqa: E402
+                              SOCK_DIAG_BY_FAMILY, ProcNetCollector, SubprocessCollector,
+                              TcpInfoCollector)
+
+COLLECTORS = ('proc', 'subprocess')
+_WORDS_LE = struct.Struct('<4I')
+# inet_diag_msg: family, state, timer, retrans, sport, dport (big endian), src, dst,
+# if, cookie, expires, rqueue, wqueue, uid, inode
+_DIAG_MSG = struct.Struct('=BBBB2s2s16s16sI8x5I')
+_DIAG_ATTR = struct.Struct('=HH')
+
+
+# ---------- sinh dữ liệu ----------
+def random_key(rng, v6_ratio):
+    if v6_ratio and rng.random() < v6_ratio:
+        return V6_FLAG | (0x20010db8 << 96) | rng.getrandbits(80)
+    # Tránh 0.x.x.x, 127.x.x.x và dải multicast trở lên
+    return rng.randrange(0x01000000, 0xe0000000)
+
+
+def proc_hex(key):
+    if key <= 0xffffffff:
+        return key.to_bytes(4, 'little').hex().upper()
+    value = key ^ V6_FLAG
+    return _WORDS_LE.pack(value >> 96, (value >> 64) & 0xffffffff, (value >> 32) & 0xffffffff,
+                          value & 0xffffffff).hex().upper()
+
+
+class CycleSample:
+    """Bảng socket của một chu kỳ: danh sách (khoá, SYN_RECV?) và output các công cụ"""
+
+    def __init__(self, sockets):
+        self.sockets = sockets
+        self.sources = len({key for key, _ in sockets})
+
+    def netstat(self):
+        lines = ['Active Internet connections (w/o servers)',
+                 'Proto Recv-Q Send-Q Local Address           Foreign Address         State']
+        for port, (key, syn) in enumerate(self.sockets):
+            if key <= 0xffffffff:
+                lines.append(f"tcp        0      0 10.0.0.1:443            "
+                             f"{format_ip(key)}:{1024 + port % 64000:<10} "
+                             f"{'SYN_RECV' if syn else 'ESTABLISHED'}")
+            else:
+                lines.append(f"tcp6       0      0 2001:db8::1:443         "
+                             f"{format_ip(key)}:{1024 + port % 64000} "
+                             f"{'SYN_RECV' if syn else 'ESTABLISHED'}")
+        return '\n'.join(lines) + '\n'
+
+    def ss(self):
+        lines = ['State      Recv-Q Send-Q Local Address:Port   Peer Address:Port Process']
+        for port, (key, syn) in enumerate(self.sockets):
+            state = 'SYN-RECV' if syn else 'ESTAB   '
+            if key <= 0xffffffff:
+                lines.append(f"{state}   0      0      10.0.0.1:443      "
+                             f"{format_ip(key)}:{1024 + port % 64000}")
+            else:
+                lines.append(f"{state}   0      0      [2001:db8::1]:443 "
+                             f"[{format_ip(key)}]:{1024 + port % 64000}")
+        return '\n'.join(lines) + '\n'
+
+    def proc(self):
+        """(nội dung /proc/net/tcp, nội dung /proc/net/tcp6)"""
+        header = ('  sl  local_address rem_address   st tx_queue rx_queue tr tm->when '
+                  'retrnsmt   uid  timeout inode')
+        v4, v6 = [header], [header]
+        for n, (key, syn) in enumerate(self.sockets):
+            state = '03' if syn else '01'
+            port = f"{1024 + n % 64000:04X}"
+            if key <= 0xffffffff:
+                v4.append(f"{n:4}: 0100000A:01BB {proc_hex(key)}:{port} {state} "
+                          f"00000000:00000000 00:00000000 00000000     0        0 {n} 1 "
+                          f"0000000000000000 20 4 30 10 -1")
+            else:
+                v6.append(f"{n:4}: 00000000000000000000000001000000:01BB {proc_hex(key)}:{port} "
+                          f"{state} 00000000:00000000 00:00000000 00000000     0        0 {n} 1 "
+                          f"0000000000000000 20 4 30 10 -1")
+        return ('\n'.join(v4) + '\n').encode(), ('\n'.join(v6) + '\n').encode()
+
+
+class TrafficModel:
+    """N socket mỗi chu kỳ từ N / fanout nguồn; churn phần nguồn thay mới mỗi chu kỳ,
+    attackers IP tấn công mới mỗi chu kỳ, mỗi IP attack_syn socket SYN_RECV"""
+
+    def __init__(self, size, args, rng):
+        self.rng = rng
+        self.args = args
+        self.sources = [random_key(rng, args.v6_ratio) for _ in range(max(size // args.fanout, 1))]
+        self.size = size
+
+    def next_cycle(self):
+        rng, args = self.rng, self.args
+        sources = self.sources
+        for _ in range(int(len(sources) * args.churn)):
+            sources[rng.randrange(len(sources))] = random_key(rng, args.v6_ratio)
+        sockets = [(sources[i % len(sources)], rng.random() < args.syn_ratio)
+                   for i in range(self.size)]
+        for _ in range(args.attackers):
+            key = random_key(rng, args.v6_ratio)
+            sockets.extend((key, True) for _ in range(args.attack_syn))
+        return CycleSample(sockets)
+
+
+def alert_history(count, rng, start=1.7e9):
+    """count alert giống daemon ghi (chặn có thời hạn / gỡ chặn), cách nhau 1 giây"""
+    for n in range(count):
+        ip = format_ip(random_key(rng, 0.1))
+        if n % 4 == 3:
+            yield {'timestamp': start + n, 'ip': ip, 'reason': 'Hết hạn chặn (lần vi phạm 1)',
+                   'action': 'UNBLOCKED'}
+        else:
+            yield {'timestamp': start + n, 'ip': ip,
+                   'reason': f"SYN flood detected: {rng.randint(51, 5000)} SYN packets",
+                   'action': 'BLOCKED', 'duration': 300, 'offense': 1}
+
+
+def blocked_entries(count, net_ratio, rng):
+    entries = []
+    for _ in range(count):
+        key = random_key(rng, 0.1)
+        if rng.random() < net_ratio:
+            entries.append(f"{format_ip(key & 0xffffff00)}/24" if key <= 0xffffffff
+                           else f"{format_ip(key >> 64 << 64)}/64")
+        else:
+            entries.append(format_ip(key))
+    return entries
+
+
+def iptables_output(entries):
+    """(output `iptables-save -t filter`, output `ip6tables-save -t filter`)"""
+    head = ['*filter', ':INPUT ACCEPT [0:0]', ':FORWARD ACCEPT [0:0]', ':OUTPUT ACCEPT [0:0]']
+    v4 = head + [f"-A INPUT -s {e if '/' in e else e + '/32'} -j DROP"
+                 for e in entries if ':' not in e] + ['COMMIT']
+    v6 = head + [f"-A INPUT -s {e if '/' in e else e + '/128'} -j DROP"
+                 for e in entries if ':' in e] + ['COMMIT']
+    return '\n'.join(v4) + '\n', '\n'.join(v6) + '\n'
+
+
+def ipset_output(entries, blocklist):
+    """Output `ipset save` (cả bốn set)"""
+    lines = []
+    for name, kind, family, _ in blocklist._sets():
+        lines.append(f"create {name} {kind} family {family} hashsize 1024 maxelem 1048576 timeout 0")
+        for entry in entries:
+            if (':' in entry) == (family == 'inet6') and ('/' in entry) == (kind == 'hash:net'):
+                lines.append(f"add {name} {entry} timeout 300")
+    return '\n'.join(lines) + '\n'
+
+
+def tcp_info_datagrams(connections, per_datagram=64):
+    """Trả lời sock_diag với tcp_info cho các kết nối (khoá, cổng, nhận, ack, unacked) tới cổng 80"""
+    local4 = bytes([10, 0, 0, 1]) + bytes(12)
+    local6 = bytes.fromhex('20010db8000000000000000000000001')
+    datagrams = []
+    messages = []
+    for n, (key, port, received, acked, unacked) in enumerate(connections):
+        if key <= 0xffffffff:
+            family, local, remote = socket.AF_INET, local4, key.to_bytes(4, 'big') + bytes(12)
+        else:
+            family, local, remote = socket.AF_INET6, local6, (key ^ V6_FLAG).to_bytes(16, 'big')
+        body = (_DIAG_MSG.pack(family, 1, 0, 0, (80).to_bytes(2, 'big'), port.to_bytes(2, 'big'),
+                               local, remote, 0, 0, 0, 0, 0, n)
+                # INET_DIAG_SHUTDOWN (kernel luôn gửi, trước tcp_info)
+                + _DIAG_ATTR.pack(_DIAG_ATTR.size + 1, 8) + bytes(4)
+                + _DIAG_ATTR.pack(_DIAG_ATTR.size + _TCPI_WND.size, INET_DIAG_INFO)
+                + _TCPI_WND.pack(unacked, 0, acked, received, 0, 65535))
+        messages.append(_NLMSG_HDR.pack(_NLMSG_HDR.size + len(body), SOCK_DIAG_BY_FAMILY, 2, 1, 0)
+                        + body)
+        if len(messages) == per_datagram:
+            datagrams.append(b''.join(messages))
+            messages = []
+    messages.append(_NLMSG_HDR.pack(_NLMSG_HDR.size + 4, 3, 2, 1, 0) + bytes(4))
+    datagrams.append(b''.join(messages))
+    return datagrams
+
+
+# ---------- collector / firewall đọc output đã sinh ----------
+class FixtureCollector:
+    """Chạy phần parse thật của collector trên output đã sinh thay vì đọc hệ thống"""
+
+    def __init__(self, backend, track=False):
+        self.name = backend
+        collector_cls = ProcNetCollector if backend == 'proc' else SubprocessCollector
+        self.collector = collector_cls(track_connections=track)
+        self.output = None
+        self.last_socket_count = 0
+        self.last_new_connections = None
+
+    def collect(self):
+        tuples = {} if self.collector.tracker is not None else None
+        if self.name == 'subprocess':
+            result = self.collector.parse(*self.output, tuples)
+            self.last_socket_count = self.collector.last_socket_count
+        else:
+            syn_stats = defaultdict(int)
+            conn_stats = defaultdict(int)
+            self.last_socket_count = sum(self.collector.parse(data, syn_stats, conn_stats, tuples)
+                                         for data in self.output)
+            result = syn_stats, conn_stats
+        if tuples is not None:
+            self.last_new_connections = self.collector.tracker.diff(tuples)
+        return result
+
+
+class FixtureBlocklist(MemoryBlocklist):
+    """list() parse output iptables / ipset đã sinh bằng parser của backend thật"""
+
+    def __init__(self, clock, backend, entries):
+        super().__init__(clock)
+        self.backend = backend
+        if backend == 'ipset':
+            self.ipset = IpsetBlocklist()
+            self.outputs = ipset_output(entries, self.ipset)
+        else:
+            self.outputs = iptables_output(entries)
+
+    def list(self):
+        if self.backend == 'ipset':
+            return IpsetBlocklist.parse_save(self.outputs, {name for name, _, _, _ in self.ipset._sets()})
+        return [entry for output in self.outputs for entry in IptablesBlocklist.parse_rules(output)]
+
+
+# ---------- đo ----------
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class StageStats:
+    def __init__(self):
+        self.latencies = []
+        self.items = 0
+        self.peak = None
+
+    def record(self, seconds, items):
+        self.latencies.append(seconds)
+        self.items += items
+
+    def result(self):
+        total = sum(self.latencies)
+        return {
+            'calls': len(self.latencies),
+            'items': self.items,
+            'throughput': self.items / total if total else 0.0,
+            'p50_ms': percentile(self.latencies, 0.5) * 1000,
+            'p95_ms': percentile(self.latencies, 0.95) * 1000,
+            'p99_ms': percentile(self.latencies, 0.99) * 1000,
+            'peak_bytes': self.peak,
+        }
+
+
+class Recorder:
+    """Ghi thời gian (lượt đo thời gian) hoặc bộ nhớ đỉnh (lượt tracemalloc) từng giai đoạn"""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.stages = defaultdict(StageStats)
+
+    def run(self, stage, func, items):
+        if self.trace:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1] - current
+            stats = self.stages[stage]
+            stats.peak = max(stats.peak or 0, peak)
+            return result
+        started = time.perf_counter()
+        result = func()
+        self.stages[stage].record(time.perf_counter() - started, items)
+        return result
+
+
+def make_detector(clock, blocklist=None):
+    return DosDetector(collector=FixtureCollector('proc'), blocklist=blocklist or MemoryBlocklist(clock),
+                       alerts=MemoryAlerts(), clock=clock, watch_config=False)
+
+
+def bench_pipeline(size, args, recorder, rng):
+    """Chu kỳ thu thập -> cập nhật -> dọn -> phát hiện với N socket"""
+    model = TrafficModel(size, args, rng)
+    clock = VirtualClock(1.7e9)
+    baseline = tracemalloc.get_traced_memory()[0] if recorder.trace else 0
+    detector = make_detector(clock)
+    track = CONFIG['conn_signal'] == 'new'
+    collectors = {name: FixtureCollector(name, track) for name in args.collectors}
+    warmup = int(CONFIG['time_window'] // CONFIG['check_interval'])
+    # Lượt tracemalloc chậm hơn nhiều lần, vài chu kỳ đã đủ thấy mức đỉnh
+    cycles = min(args.cycles, 2) if recorder.trace else args.cycles
+    state = 0
+
+    for cycle in range(warmup + cycles):
+        sample = model.next_cycle()
+        for name, collector in collectors.items():
+            collector.output = sample.proc() if name == 'proc' else (sample.netstat(), sample.ss())
+        clock.now += CONFIG['check_interval']
+        measured = recorder if cycle >= warmup else Recorder(False)
+
+        stats = None
+        for name, collector in collectors.items():
+            detector.collector = collector
+            stats = measured.run(f"get_network_stats[{name}]", detector.get_network_stats,
+                                 len(sample.sockets))
+        for collector in collectors.values():
+            collector.output = None
+        syn_stats, conn_stats, new_stats = stats
+        measured.run('update_stats', lambda: detector.update_stats(syn_stats, conn_stats, new_stats),
+                     sample.sources)
+        tracked = len(detector.conn_count)
+        measured.run('clean_old_records', detector.clean_old_records, tracked)
+        measured.run('check_for_attacks', detector.check_for_attacks, tracked)
+        del stats, syn_stats, conn_stats, new_stats, sample
+        if recorder.trace and cycle >= warmup:
+            state = max(state, tracemalloc.get_traced_memory()[0] - baseline)
+
+    if recorder.trace:
+        recorder.stages['detector_state'].peak = state
+    logging.info(f"pipeline {size}: {len(detector.conn_count)} nguồn trong cửa sổ, "
+                 f"{len(detector.blocked_ips)} IP bị chặn")
+
+    # Khởi động nóng: ghi snapshot trạng thái vừa dựng rồi nạp vào một detector mới
+    restored = make_detector(clock)
+    tracked = sum(len(counter) for counter in detector.window_counters().values())
+    directory = tempfile.mkdtemp(prefix='bench_snapshot_')
+    CONFIG['state_snapshot_file'] = os.path.join(directory, 'state.snap')
+    try:
+        for _ in range(1 if recorder.trace else args.repeat):
+            # Sao chép (giữ khoá của detector) tách khỏi nén + ghi đĩa (ở thread)
+            states = []
+            recorder.run('snapshot_capture', lambda: states.append(detector.snapshot_state()), tracked)
+            recorder.run('save_snapshot', lambda: detector.write_state(states.pop()), tracked)
+            recorder.run('restore_snapshot', restored.restore_snapshot, tracked)
+    finally:
+        CONFIG['state_snapshot_file'] = None
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_alerts(size, args, recorder, rng):
+    """write_alert vào AlertWriter thật rồi đọc lại lịch sử vừa ghi"""
+    directory = tempfile.mkdtemp(prefix='bench_alerts_')
+    path = os.path.join(directory, 'alerts.json')
+    try:
+        clock = VirtualClock(1.7e9)
+        detector = make_detector(clock)
+        detector.alerts = AlertWriter(path, CONFIG['alert_max_bytes'], 10 ** 12, CONFIG['alert_backups'],
+                                      args.fsync, CONFIG['alert_flush_interval'])
+        history = list(alert_history(size, rng))
+        for alert in history:
+            recorder.run('write_alert', lambda: detector.write_alert(alert), 1)
+        # Phần còn trong hàng đợi write-behind cũng là chi phí ghi
+        recorder.run('write_alert', detector.alerts.close, 0)
+        del history
+
+        reader = AlertReader(path, CONFIG['alert_backups'])
+        middle = 1.7e9 + size / 2
+        for _ in range(1 if recorder.trace else args.repeat):
+            recorder.run('alert_recent', lambda: reader.recent(100), 100)
+            found = []
+            recorder.run('alert_since', lambda: found.append(len(reader.since(middle))), 0)
+            if not recorder.trace:
+                recorder.stages['alert_since'].items += found[0]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_blocked(size, args, recorder, rng):
+    """load_blocked_ips trên output iptables / ipset với N entry"""
+    clock = VirtualClock(1.7e9)
+    entries = blocked_entries(size, args.net_ratio, rng)
+    blocklist = FixtureBlocklist(clock, args.firewall, entries)
+    detector = make_detector(clock, blocklist)
+    del entries
+    for _ in range(1 if recorder.trace else args.repeat):
+        detector.blocked_ips = set()
+        detector.blocked_nets = set()
+        detector.blocked_index = PrefixIndex()
+        recorder.run(f"load_blocked_ips[{args.firewall}]", detector.load_blocked_ips, size)
+
+
+def bench_slow(size, args, recorder, rng):
+    """Đánh dấu kết nối treo từ tcp_info của N kết nối tới cổng dịch vụ"""
+    clock = VirtualClock(1.7e9)
+    detector = make_detector(clock)
+    collector = TcpInfoCollector([80])
+    sources = [random_key(rng, args.v6_ratio) for _ in range(max(size // args.fanout, 1))]
+    connections = [(sources[n % len(sources)], 1024 + n % 64000,
+                    rng.randint(300, 5000), rng.randint(2000, 200000), 0) for n in range(size)]
+    # Mỗi IP tấn công giữ attack_syn kết nối còn response chờ mà gần như không đọc
+    for _ in range(args.attackers):
+        key = random_key(rng, args.v6_ratio)
+        connections.extend((key, 1024 + n, 120, 0, 4096) for n in range(args.attack_syn))
+    datagrams = tcp_info_datagrams(connections)
+    del connections
+
+    for _ in range(1 if recorder.trace else args.repeat):
+        detector.slow_conns.tracked = {}
+        detector.slow_conns.last_poll = None
+        detector.pending_blocks.clear()
+        for poll in range(2):
+            sockets = {}
+            recorder.run('tcp_info_parse',
+                         lambda: [collector.parse(datagram, sockets) for datagram in datagrams],
+                         size)
+            # Lần đọc thứ hai: mọi kết nối đã đủ slow_conn_min_age
+            clock.now += 0 if poll == 0 else CONFIG['slow_conn_min_age'] + 1
+            recorder.run('slow_review', lambda: detector.review_slow_connections(sockets), len(sockets))
+    logging.info(f"slow {size}: {detector.slow_conns.total_stalled()} kết nối treo, "
+                 f"{len(detector.pending_blocks)} IP chờ chặn")
+
+
+BENCHES = {
+    'pipeline': bench_pipeline,
+    'alerts': bench_alerts,
+    'blocked': bench_blocked,
+    'slow': bench_slow,
+}
+
+
+def run_size(size, args):
+    results = {}
+    passes = [False] if args.no_memory else [False, True]
+    for trace in passes:
+        recorder = Recorder(trace)
+        if trace:
+            tracemalloc.start()
+        try:
+            for name in args.benches:
+                BENCHES[name](size, args, recorder, random.Random(args.seed))
+        finally:
+            if trace:
+                tracemalloc.stop()
+        for stage, stats in recorder.stages.items():
+            if trace:
+                results.setdefault(stage, StageStats().result())['peak_bytes'] = stats.peak
+            else:
+                results[stage] = stats.result()
+    return results
+
+
+# ---------- báo cáo / mốc ----------
+def print_results(size, results):
+    print(f"N = {size}")
+    print(f"  {'giai đoạn':<32} {'phần tử/s':>12} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'đỉnh MiB':>9}")
+    for stage, r in results.items():
+        peak = '-' if r['peak_bytes'] is None else f"{r['peak_bytes'] / 2 ** 20:.1f}"
+        throughput = f"{r['throughput']:,.0f}" if r['calls'] else '-'
+        latency = (f"{r['p50_ms']:9.3f} {r['p95_ms']:9.3f} {r['p99_ms']:9.3f}" if r['calls']
+                   else f"{'-':>9} {'-':>9} {'-':>9}")
+        print(f"  {stage:<32} {throughput:>12} {latency} {peak:>9}")
+
+
+def compare(report, baseline, tolerance):
+    """In thay đổi so với mốc, trả về số chỉ số chậm / tốn bộ nhớ hơn quá tolerance
+
+    So thông lượng (tổng thời gian, ổn định hơn percentile của vài lần gọi) và bộ nhớ đỉnh.
+    """
+    regressions = 0
+    print(f"So với mốc (python {baseline['meta'].get('python')}, "
+          f"{baseline['meta'].get('machine')}), ngưỡng {tolerance:.0%}")
+    for key, old in baseline['results'].items():
+        new = report['results'].get(key)
+        if new is None:
+            continue
+        for metric, label, scale, worse in (('throughput', 'phần tử/s', 1, lambda r: r < 1 / (1 + tolerance)),
+                                            ('peak_bytes', 'MiB', 2 ** 20, lambda r: r > 1 + tolerance)):
+            before, after = old.get(metric), new.get(metric)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            flag = ''
+            if worse(ratio):
+                flag = '  <-- CHẬM HƠN' if metric == 'throughput' else '  <-- TỐN BỘ NHỚ HƠN'
+                regressions += 1
+            print(f"  {key:<40} {before / scale:14,.1f} -> {after / scale:14,.1f} {label:<10} "
+                  f"({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='các kích thước N, phân tách bởi dấu phẩy')
+    parser.add_argument('--benches', default=','.join(BENCHES),
+                        help=f"nhóm cần chạy ({', '.join(BENCHES)})")
+    parser.add_argument('--collectors', default=','.join(COLLECTORS))
+    parser.add_argument('--cycles', type=int, default=10, help='số chu kỳ đo (sau khi làm đầy cửa sổ)')
+    parser.add_argument('--repeat', type=int, default=5, help='số lần đo các giai đoạn đọc / nạp')
+    parser.add_argument('--fanout', type=int, default=1, help='số socket tb mỗi nguồn')
+    parser.add_argument('--churn', type=float, default=0.1, help='tỉ lệ nguồn thay mới mỗi chu kỳ')
+    parser.add_argument('--conn-signal', default=CONFIG['conn_signal'], choices=('new', 'level'))
+    parser.add_argument('--syn-ratio', type=float, default=0.05)
+    parser.add_argument('--v6-ratio', type=float, default=0.1)
+    parser.add_argument('--attackers', type=int, default=20, help='IP tấn công mới mỗi chu kỳ')
+    parser.add_argument('--attack-syn', type=int, default=60)
+    parser.add_argument('--fsync', default='batch', help='chính sách fsync của AlertWriter')
+    parser.add_argument('--firewall', default='ipset', choices=('ipset', 'iptables'))
+    parser.add_argument('--net-ratio', type=float, default=0.001,
+                        help='tỉ lệ entry bị chặn là dải mạng')
+    parser.add_argument('--no-memory', action='store_true', help='bỏ lượt đo bộ nhớ (tracemalloc)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='lưu kết quả làm mốc')
+    parser.add_argument('--baseline', help='so với mốc đã lưu')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    args.benches = [name for name in args.benches.split(',') if name]
+    args.collectors = [name for name in args.collectors.split(',') if name]
+    unknown = [name for name in args.benches if name not in BENCHES]
+    unknown += [name for name in args.collectors if name not in COLLECTORS]
+    if unknown:
+        parser.error(f"không có: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR,
+                        format='%(levelname)s - %(message)s')
+    # Không đụng tới hệ thống: không bắt gói, không lưu trạng thái chặn
+    CONFIG.update(syn_source='snapshot', ban_state_file=None, state_snapshot_file=None,
+                  shard_workers=0, blocklist=[], conn_signal=args.conn_signal, slow_conn_ports=[])
+
+    report = {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'platform': platform.platform(), 'time': time.time(),
+                 'args': {key: value for key, value in vars(args).items()
+                          if key not in ('save', 'baseline', 'verbose')}},
+        'results': {},
+    }
+    for size in [int(value) for value in args.sizes.split(',') if value]:
+        results = run_size(size, args)
+        print_results(size, results)
+        report['results'].update({f"{stage}@{size}": result for stage, result in results.items()})
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Đọc và theo dõi file cấu hình của daemon auto_block
+
+File /etc/firewall_auto_block.conf là JSON do AutoBlockTab ghi (giá trị số
+có thể ở dạng chuỗi, vd "50"). coerce_config() ép kiểu theo CONFIG mặc định
+và kiểm tra hợp lệ (khoá dạng lựa chọn theo CONFIG_CHOICES); file lỗi thì bị
+bỏ qua, cấu hình đang chạy giữ nguyên.
+
+ConfigWatcher theo dõi thư mục chứa file bằng inotify (qua ctypes), nên bắt
+được cả kiểu lưu nguyên tử ghi file tạm rồi rename. Nếu không có inotify thì
+so sánh mtime/inode định kỳ.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import struct
+import time
+import logging
+
+CONFIG_FILE = '/etc/firewall_auto_block.conf'
+
+# Các khoá áp dụng được khi daemon đang chạy; các khoá khác cần khởi động lại
+HOT_RELOAD_KEYS = {
+    'check_interval', 'syn_threshold', 'conn_threshold', 'concurrent_threshold',
+    'prefix_syn_thresholds', 'prefix_conn_thresholds',
+    'prefix_syn_thresholds_v6', 'prefix_conn_thresholds_v6', 'prefix_min_sources',
+    'whitelist', 'blocklist', 'ban_durations', 'ban_forget_after',
+    'adaptive_interval', 'min_check_interval', 'near_threshold_ratio',
+    'load_rise_factor', 'interval_backoff', 'metrics_log_interval',
+    'detection_mode', 'anomaly_sigmas', 'anomaly_min_syn', 'anomaly_min_conn',
+    'hh_promote_ratio', 'ban_extend_min_pps', 'ban_extend_step',
+    'slow_conn_interval', 'slow_conn_min_age', 'slow_conn_max_rate', 'slow_conn_min_window',
+    'slow_conn_threshold',
+}
+
+# Giá trị hợp lệ của các khoá dạng lựa chọn; sai chính tả sẽ làm daemon lặng lẽ
+# rơi vào nhánh mặc định nên bị từ chối như mọi giá trị sai kiểu khác
+CONFIG_CHOICES = {
+    'collector': ('proc', 'netlink', 'subprocess'),
+    'syn_source': ('snapshot', 'capture'),
+    'conn_signal': ('new', 'level'),
+    'counting_mode': ('exact', 'heavy_hitter'),
+    'detection_mode': ('threshold', 'anomaly', 'both'),
+    'block_backend': ('ipset', 'iptables', 'memory'),
+    'alert_fsync': ('always', 'batch', 'never'),
+    'runtime': ('asyncio', 'sync'),
+}
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')
+
+
+def _coerce_value(key, value, default):
+    choices = CONFIG_CHOICES.get(key)
+    if choices is not None:
+        if not isinstance(value, str) or value.strip() not in choices:
+            raise ValueError(f"{key} phải là một trong {', '.join(choices)}")
+        return value.strip()
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
+    if isinstance(default, int):
+        value = int(value)
+    elif isinstance(default, float):
+        value = float(value)
+    elif isinstance(default, list) and default and all(isinstance(v, int) for v in default):
+        if not isinstance(value, list):
+            raise ValueError(f"{key} phải là danh sách số")
+        value = [int(v) for v in value]
+        if any(v <= 0 for v in value):
+            raise ValueError(f"{key} phải là các số dương")
+        return value
+    elif isinstance(default, list):
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{key} phải là danh sách chuỗi")
+        return [v.strip() for v in value if v.strip()]
+    elif isinstance(default, dict):
+        if not isinstance(value, dict):
+            raise ValueError(f"{key} phải là object")
+        if default and all(isinstance(k, int) for k in default):
+            # {độ dài prefix: ngưỡng}: key JSON luôn là chuỗi
+            value = {int(k): int(v) for k, v in value.items()}
+            if any(v < 0 for v in value.values()):
+                raise ValueError(f"{key} không được âm")
+        return value
+    elif default is None or isinstance(default, str):
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{key} phải là chuỗi")
+        return value
+    if value < 0:
+        raise ValueError(f"{key} không được âm")
+    return value
+
+
+def coerce_config(raw, defaults):
+    """Ép kiểu và kiểm tra các khoá của file cấu hình theo CONFIG mặc định
+
+    Trả về dict các khoá hợp lệ; ValueError nếu có giá trị sai.
+    Khoá không có trong defaults bị bỏ qua.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("file cấu hình phải là một object JSON")
+    config = {}
+    for key, value in raw.items():
+        if key not in defaults:
+            logging.warning(f"Bỏ qua khoá cấu hình không biết: {key}")
+            continue
+        try:
+            config[key] = _coerce_value(key, value, defaults[key])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{key}={value!r}: {e}")
+    if config.get('check_interval', 1) <= 0:
+        raise ValueError("check_interval phải lớn hơn 0")
+    return config
+
+
+def load_config_file(path, defaults):
+    """Đọc file cấu hình, trả về dict đã ép kiểu hoặc None nếu không có / lỗi"""
+    try:
+        with open(path, 'r') as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Lỗi đọc file cấu hình {path}: {e}")
+        return None
+    try:
+        return coerce_config(raw, defaults)
+    except ValueError as e:
+        logging.error(f"File cấu hình {path} không hợp lệ: {e}")
+        return None
+
+
+def save_config_file(path, config):
+    """Ghi nguyên tử: ghi file tạm cùng thư mục, fsync rồi rename đè lên file cũ"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(config, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class ConfigWatcher:
+    """Báo khi file cấu hình thay đổi (inotify, hoặc so sánh stat nếu không có)"""
+
+    def __init__(self, path, poll_interval=1.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._name = os.path.basename(path).encode()
+        self._fd = None
+        self._stat = self._file_stat()
+        self._open_inotify()
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1')
+            directory = os.path.dirname(self.path) or '.'
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MODIFY
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+                err = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(err, f"inotify_add_watch {directory}")
+        except (OSError, AttributeError) as e:
+            logging.warning(f"Không dùng được inotify, kiểm tra file cấu hình định kỳ: {e}")
+            return
+        self._fd = fd
+
+    def _drain_events(self):
+        """Đọc hết sự kiện đang chờ, True nếu có sự kiện của file cấu hình"""
+        touched = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return touched
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                _, _, _, name_len = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + name_len].rstrip(b'\0')
+                if name == self._name:
+                    touched = True
+                offset += _EVENT.size + name_len
+
+    def fileno(self):
+        """fd inotify để chờ bằng select / event loop, None nếu đang kiểm tra định kỳ"""
+        return self._fd
+
+    def changed(self):
+        """Kiểm tra không chặn: file có thay đổi kể từ lần kiểm tra trước không"""
+        if self._fd is not None and not self._drain_events():
+            return False
+        stat = self._file_stat()
+        if stat == self._stat:
+            return False
+        self._stat = stat
+        return True
+
+    def wait(self, timeout):
+        """Ngủ tối đa timeout giây, trả về sớm với True nếu file cấu hình thay đổi"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._fd is not None:
+                readable, _, _ = select.select([self._fd], [], [], remaining)
+                if not readable:
+                    return False
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+            if self.changed():
+                return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Số gói / byte bị DROP của từng entry đang chặn
+
+Backend firewall trả về bộ đếm tích luỹ của mọi entry trong một lần gọi
+(`iptables-save -c` hoặc `ipset save` với set có counters). DropMonitor giữ
+lần đọc trước để tính tốc độ drop của từng entry và thời điểm gần nhất entry
+còn chặn lưu lượng; bộ đếm nhỏ hơn lần trước (entry bị gỡ rồi chặn lại) được
+tính lại từ 0.
+
+Daemon ghi kết quả ra DROP_STATS_FILE (JSON, thay nguyên tử) để web_dashboard
+và GUI đọc.
+"""
+
+import json
+import logging
+import os
+
+DROP_STATS_FILE = '/var/lib/firewall_auto_block/drops.json'
+
+# Vị trí trong entry [gói, byte, gói/s, byte/s, thời điểm còn drop gần nhất]
+_PACKETS = 0
+_BYTES = 1
+_PPS = 2
+_BPS = 3
+_LAST_DROP = 4
+
+
+class DropMonitor:
+    def __init__(self):
+        self.entries = {}
+        self.last_poll = None
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+
+    def update(self, counters, now):
+        """Nạp bộ đếm {entry: (gói, byte)} của lần đọc mới; entry không còn trong firewall bị bỏ"""
+        elapsed = now - self.last_poll if self.last_poll is not None else 0
+        entries = {}
+        for entry, (packets, nbytes) in counters.items():
+            old = self.entries.get(entry)
+            if old is None or packets < old[_PACKETS]:
+                # Entry mới chặn từ sau lần đọc trước (hoặc bị chặn lại): đếm từ 0
+                delta_packets, delta_bytes = packets, nbytes
+                last_drop = None
+            else:
+                delta_packets, delta_bytes = packets - old[_PACKETS], nbytes - old[_BYTES]
+                last_drop = old[_LAST_DROP]
+            if elapsed > 0:
+                pps, bps = delta_packets / elapsed, delta_bytes / elapsed
+                if delta_packets:
+                    last_drop = now
+                self.dropped_packets += delta_packets
+                self.dropped_bytes += delta_bytes
+            else:
+                # Lần đọc đầu: chưa biết bộ đếm tích luỹ từ lúc nào
+                pps = bps = 0.0
+            entries[entry] = [packets, nbytes, pps, bps, last_drop]
+        self.entries = entries
+        self.last_poll = now
+
+    def rate(self, entry):
+        """Số gói/s bị drop của entry giữa hai lần đọc gần nhất"""
+        stats = self.entries.get(entry)
+        return stats[_PPS] if stats else 0.0
+
+    def active(self, min_pps):
+        """Số entry có tốc độ drop >= min_pps"""
+        return sum(1 for stats in self.entries.values() if stats[_PPS] and stats[_PPS] >= min_pps)
+
+    def stats(self):
+        return {entry: {'packets': packets, 'bytes': nbytes, 'pps': round(pps, 3),
+                        'bps': round(bps, 1), 'last_drop': last_drop}
+                for entry, (packets, nbytes, pps, bps, last_drop) in self.entries.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def write_drop_stats(path, report):
+    tmp = path + '.tmp'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(tmp, 'w') as f:
+        json.dump(report, f)
+    os.replace(tmp, path)
+
+
+def read_drop_stats(path=DROP_STATS_FILE):
+    """{'time', 'interval', 'entries': {entry: {...}}} do daemon ghi, {} nếu chưa có / lỗi"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Lỗi đọc số liệu drop {path}: {e}")
+        return {}
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Backend chặn IP dùng chung cho auto_block.py và web_dashboard.py
+
+- 'iptables': mỗi IP một rule `-s IP -j DROP` trong INPUT (cách cũ)
+- 'ipset': mọi IP nằm trong một set hash:ip / hash:net, khớp bằng một rule
+  iptables duy nhất; timeout của từng phần tử do kernel tự xử lý
+
+Entry IPv6 đi qua ip6tables và các set họ inet6 (tên có hậu tố '6').
+
+- 'memory': không đụng tới firewall, chỉ ghi lại các lệnh (chạy thử / replay)
+
+add() và remove() nhận danh sách và trả về {entry: (thành công, thông báo)}.
+apply() thực hiện cả thêm lẫn xoá trong một giao dịch; FirewallBatcher gom
+các quyết định của một chu kỳ phát hiện rồi gọi apply() một lần.
+"""
+
+import subprocess
+import threading
+import time
+import logging
+
+from metrics import Counter, Histogram
+
+IPSET_NAME = 'firewall_blocked'
+IPSET_NET_NAME = 'firewall_blocked_net'
+
+# Thông báo lỗi khi xoá một entry vốn không có trong firewall
+ENTRY_MISSING = 'entry không có trong firewall'
+MISSING_MARKERS = (
+    ENTRY_MISSING,
+    'does a matching rule exist',  # iptables -D: "Bad rule (does a matching rule exist in that chain?)"
+    "it's not added",              # ipset del: "Element cannot be deleted from the set: it's not added"
+)
+
+COMMIT_SECONDS = Histogram('firewall_commit_seconds',
+                           'Thời gian áp dụng một batch lên firewall', ['backend'])
+COMMIT_ENTRIES = Counter('firewall_commit_entries', 'Số entry đã gửi tới firewall',
+                         ['backend', 'action'])
+COMMIT_FAILURES = Counter('firewall_commit_failures', 'Số entry firewall áp dụng thất bại',
+                          ['backend', 'action'])
+
+
+def _run(cmd, input_text=None):
+    """Chạy lệnh, trả về (thành công, stdout hoặc thông báo lỗi)"""
+    try:
+        result = subprocess.run(cmd, input=input_text, capture_output=True, text=True)
+    except OSError as e:
+        return False, str(e)
+    if result.returncode != 0:
+        return False, (result.stderr or result.stdout).strip() or f"exit {result.returncode}"
+    return True, result.stdout
+
+
+def entry_missing(message):
+    """Lỗi xoá entry là do entry không còn trong firewall (không phải lỗi tạm thời như khoá xtables)"""
+    return any(marker in message for marker in MISSING_MARKERS)
+
+
+def is_ipv6(entry):
+    return ':' in entry
+
+
+def is_network(entry):
+    """Entry là dải mạng (CIDR khác /32 với IPv4, /128 với IPv6) hay một host"""
+    if '/' not in entry:
+        return False
+    return entry.rsplit('/', 1)[1] != ('128' if is_ipv6(entry) else '32')
+
+
+def host_part(entry):
+    """Bỏ hậu tố /32 (/128) để so khớp với IP đơn"""
+    if '/' in entry and not is_network(entry):
+        return entry.rsplit('/', 1)[0]
+    return entry
+
+
+class IptablesBlocklist:
+    """Mỗi IP một rule DROP ở đầu chain INPUT"""
+    name = 'iptables'
+    # Rule không tự hết hạn, daemon gỡ khi hết thời hạn chặn
+    timeouts = False
+
+    def add(self, entries, timeout=None):
+        return self.apply({entry: timeout for entry in entries}, [])
+
+    def remove(self, entries):
+        return self.apply({}, entries)
+
+    def apply(self, adds, removes):
+        """Thêm/xoá trong một giao dịch `iptables-restore --noflush`
+
+        Mỗi họ địa chỉ một giao dịch (iptables-restore / ip6tables-restore).
+        Nếu giao dịch thất bại (vd xoá rule không tồn tại) thì không rule nào
+        được áp dụng; khi đó chạy lại từng lệnh để có kết quả cho từng entry.
+        """
+        results = {}
+        for v6 in (False, True):
+            family_adds = [entry for entry in adds if is_ipv6(entry) == v6]
+            family_removes = [entry for entry in removes if is_ipv6(entry) == v6]
+            if family_adds or family_removes:
+                results.update(self._apply_family(v6, family_adds, family_removes))
+        return results
+
+    def _apply_family(self, v6, adds, removes):
+        binary = 'ip6tables' if v6 else 'iptables'
+        lines = ['*filter']
+        lines += [f"-I INPUT 1 -s {entry} -j DROP" for entry in adds]
+        lines += [f"-D INPUT -s {entry} -j DROP" for entry in removes]
+        lines.append('COMMIT')
+        ok, out = _run([f'{binary}-restore', '--noflush'], '\n'.join(lines) + '\n')
+        if ok:
+            return {entry: (True, '') for entry in list(adds) + list(removes)}
+
+        logging.warning(f"{binary}-restore thất bại, áp dụng từng rule: {out}")
+        results = {}
+        for entry in adds:
+            ok, out = _run([binary, '-I', 'INPUT', '1', '-s', entry, '-j', 'DROP'])
+            results[entry] = (ok, '' if ok else out)
+        for entry in removes:
+            ok, out = _run([binary, '-D', 'INPUT', '-s', entry, '-j', 'DROP'])
+            results[entry] = (ok, '' if ok else out)
+        return results
+
+    def list(self):
+        """Các entry bị DROP ở INPUT, đọc bằng một lần `iptables-save -t filter` mỗi họ địa chỉ
+
+        RuntimeError nếu không đọc được họ nào.
+        """
+        blocked = []
+        errors = []
+        for binary in ('iptables', 'ip6tables'):
+            ok, out = _run([f'{binary}-save', '-t', 'filter'])
+            if not ok:
+                logging.error(f"Lỗi đọc rules {binary}: {out}")
+                errors.append(out)
+                continue
+            blocked.extend(self.parse_rules(out))
+        if len(errors) == 2:
+            raise RuntimeError(f"Không đọc được rules iptables: {errors[0]}")
+        return blocked
+
+    def counters(self):
+        """{entry: (gói, byte)} đã bị DROP, một lần `iptables-save -c -t filter` mỗi họ địa chỉ"""
+        counters = {}
+        errors = []
+        for binary in ('iptables', 'ip6tables'):
+            ok, out = _run([f'{binary}-save', '-c', '-t', 'filter'])
+            if not ok:
+                errors.append(out)
+                continue
+            counters.update(self.parse_counters(out))
+        if len(errors) == 2:
+            raise RuntimeError(f"Không đọc được bộ đếm iptables: {errors[0]}")
+        return counters
+
+    @staticmethod
+    def parse_counters(output):
+        """Bộ đếm các rule DROP ở INPUT trong output của `iptables-save -c` ("[gói:byte] -A ...")"""
+        counters = {}
+        for line in output.split('\n'):
+            parts = line.split()
+            if (len(parts) == 7 and parts[0].startswith('[') and parts[1:4] == ['-A', 'INPUT', '-s']
+                    and parts[5:] == ['-j', 'DROP']):
+                packets, _, nbytes = parts[0][1:-1].partition(':')
+                entry = host_part(parts[4])
+                # Rule trùng của cùng entry: cộng dồn
+                old = counters.get(entry, (0, 0))
+                counters[entry] = (old[0] + int(packets), old[1] + int(nbytes))
+        return counters
+
+    @staticmethod
+    def parse_rules(output):
+        """Các entry bị DROP ở chain INPUT trong output của `iptables-save` (hoặc `iptables -S`)"""
+        blocked = []
+        for line in output.split('\n'):
+            parts = line.split()
+            if (len(parts) == 6 and parts[:3] == ['-A', 'INPUT', '-s']
+                    and parts[4:] == ['-j', 'DROP']):
+                blocked.append(host_part(parts[3]))
+        return blocked
+
+
+class IpsetBlocklist:
+    """Chặn qua ipset: một rule iptables, thêm/xoá hàng loạt bằng `ipset restore`"""
+    name = 'ipset'
+    timeouts = True
+
+    def __init__(self, set_name=IPSET_NAME, net_set_name=IPSET_NET_NAME, maxelem=1048576):
+        self.set_name = set_name
+        self.net_set_name = net_set_name
+        self.maxelem = maxelem
+        self._ready = False
+
+    def _sets(self):
+        """(tên set, kiểu, họ địa chỉ, lệnh iptables tương ứng)"""
+        return (
+            (self.set_name, 'hash:ip', 'inet', 'iptables'),
+            (self.net_set_name, 'hash:net', 'inet', 'iptables'),
+            (self.set_name + '6', 'hash:ip', 'inet6', 'ip6tables'),
+            (self.net_set_name + '6', 'hash:net', 'inet6', 'ip6tables'),
+        )
+
+    def ensure(self):
+        """Tạo set (có hỗ trợ timeout và bộ đếm gói) và rule iptables khớp set nếu chưa có"""
+        if self._ready:
+            return True
+        for name, set_type, family, binary in self._sets():
+            create = ['ipset', 'create', name, set_type, 'family', family,
+                      'timeout', '0', 'maxelem', str(self.maxelem)]
+            ok, out = _run(create + ['counters', '-exist'])
+            if not ok:
+                # Set cũ tạo không có counters: vẫn chặn được, chỉ thiếu số gói bị drop
+                ok, out = _run(create + ['-exist'])
+                if ok:
+                    logging.warning(f"ipset {name} không có bộ đếm gói, tạo lại set để bật")
+            if not ok:
+                logging.error(f"Lỗi tạo ipset {name}: {out}")
+                return False
+            match = ['INPUT', '-m', 'set', '--match-set', name, 'src', '-j', 'DROP']
+            exists, _ = _run([binary, '-C'] + match)
+            if not exists:
+                ok, out = _run([binary, '-I', match[0], '1'] + match[1:])
+                if not ok:
+                    logging.error(f"Lỗi thêm rule cho ipset {name}: {out}")
+                    return False
+        self._ready = True
+        return True
+
+    def _set_for(self, entry):
+        name = self.net_set_name if is_network(entry) else self.set_name
+        return name + '6' if is_ipv6(entry) else name
+
+    def _restore(self, lines, entries):
+        """Áp dụng nhiều lệnh trong một lần `ipset restore`, lỗi thì thử từng dòng"""
+        if not self.ensure():
+            return {entry: (False, 'ipset chưa sẵn sàng') for entry in entries}
+        if not lines:
+            return {}
+        ok, out = _run(['ipset', 'restore', '-exist'], '\n'.join(lines) + '\n')
+        if ok:
+            return {entry: (True, '') for entry in entries}
+
+        results = {}
+        for line, entry in zip(lines, entries):
+            ok, out = _run(['ipset', '-exist'] + line.split())
+            results[entry] = (ok, '' if ok else out)
+        return results
+
+    def add(self, entries, timeout=None):
+        return self.apply({entry: timeout for entry in entries}, [])
+
+    def remove(self, entries):
+        return self.apply({}, entries)
+
+    def apply(self, adds, removes):
+        """Thêm/xoá trong một lần `ipset restore`; adds là {entry: timeout}"""
+        lines = []
+        for entry, timeout in adds.items():
+            line = f"add {self._set_for(entry)} {host_part(entry)}"
+            if timeout:
+                line += f" timeout {int(timeout)}"
+            lines.append(line)
+        lines += [f"del {self._set_for(entry)} {host_part(entry)}" for entry in removes]
+        return self._restore(lines, list(adds) + list(removes))
+
+    def list(self):
+        """Phần tử của cả bốn set, đọc bằng một lần `ipset save`; RuntimeError nếu lỗi"""
+        ok, out = _run(['ipset', 'save'])
+        if not ok:
+            raise RuntimeError(f"Lỗi đọc ipset: {out}")
+        return self.parse_save(out, {name for name, _, _, _ in self._sets()})
+
+    def counters(self):
+        """{entry: (gói, byte)} đã bị DROP, đọc cùng một lần `ipset save`
+
+        Phần tử của set không có counters không có trong kết quả.
+        """
+        ok, out = _run(['ipset', 'save'])
+        if not ok:
+            raise RuntimeError(f"Lỗi đọc ipset: {out}")
+        return self.parse_counters(out, {name for name, _, _, _ in self._sets()})
+
+    @staticmethod
+    def parse_counters(output, names):
+        """Bộ đếm "packets N bytes M" của các phần tử thuộc names trong output `ipset save`"""
+        counters = {}
+        for line in output.split('\n'):
+            parts = line.split()
+            if len(parts) >= 3 and parts[0] == 'add' and parts[1] in names and 'packets' in parts:
+                fields = dict(zip(parts[3::2], parts[4::2]))
+                counters[host_part(parts[2])] = (int(fields.get('packets', 0)),
+                                                 int(fields.get('bytes', 0)))
+        return counters
+
+    @staticmethod
+    def parse_save(output, names):
+        """Các phần tử thuộc các set trong names trong output của `ipset save`"""
+        blocked = []
+        for line in output.split('\n'):
+            parts = line.split()
+            if len(parts) >= 3 and parts[0] == 'add' and parts[1] in names:
+                blocked.append(host_part(parts[2]))
+        return blocked
+
+
+class MemoryBlocklist:
+    """Firewall giả trong bộ nhớ: giữ tập entry và nhật ký (thời điểm, hành động, entry, timeout)"""
+    name = 'memory'
+
+    timeouts = True
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.entries = {}  # entry -> thời điểm hết hạn (None = vĩnh viễn)
+        self.drops = {}    # entry -> [gói, byte] đã drop
+        self.log = []
+        self.transactions = 0
+
+    def add(self, entries, timeout=None):
+        return self.apply({entry: timeout for entry in entries}, [])
+
+    def remove(self, entries):
+        return self.apply({}, entries)
+
+    def apply(self, adds, removes):
+        now = self.clock()
+        self.transactions += 1
+        results = {}
+        for entry, timeout in adds.items():
+            self.entries[entry] = now + timeout if timeout else None
+            self.log.append((now, 'block', entry, timeout))
+            results[entry] = (True, '')
+        for entry in removes:
+            self.drops.pop(entry, None)
+            if self.entries.pop(entry, False) is False:
+                results[entry] = (False, ENTRY_MISSING)
+            else:
+                results[entry] = (True, '')
+            self.log.append((now, 'unblock', entry, None))
+        return results
+
+    def list(self):
+        # Giống ipset: entry có timeout tự biến mất khi hết hạn
+        now = self.clock()
+        return [entry for entry, expires in self.entries.items() if expires is None or expires > now]
+
+    def drop(self, entry, packets, nbytes=0):
+        """Ghi nhận gói của nguồn bị entry chặn (replay mô phỏng lưu lượng sau khi chặn)"""
+        counts = self.drops.setdefault(entry, [0, 0])
+        counts[0] += packets
+        counts[1] += nbytes
+
+    def counters(self):
+        return {entry: tuple(self.drops.get(entry, (0, 0))) for entry in self.list()}
+
+
+BLOCKLISTS = {
+    IptablesBlocklist.name: IptablesBlocklist,
+    IpsetBlocklist.name: IpsetBlocklist,
+    MemoryBlocklist.name: MemoryBlocklist,
+}
+
+
+def get_blocklist(name):
+    """Tạo backend chặn theo tên, mặc định iptables nếu tên không hợp lệ"""
+    blocklist_cls = BLOCKLISTS.get(name)
+    if blocklist_cls is None:
+        logging.warning(f"Backend chặn '{name}' không tồn tại, dùng iptables")
+        blocklist_cls = IptablesBlocklist
+    return blocklist_cls()
+
+
+class BatchTicket:
+    """Kết quả của một quyết định trong batch, có được sau khi commit"""
+
+    def __init__(self, entry, action):
+        self.entry = entry
+        self.action = action
+        self.ok = False
+        self.message = ''
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.ok, self.message
+
+    def _resolve(self, ok, message):
+        self.ok = ok
+        self.message = message
+        self._done.set()
+
+
+class FirewallBatcher:
+    """Gom quyết định chặn/gỡ chặn rồi commit thành một giao dịch
+
+    Nếu một entry vừa được chặn vừa được gỡ trong cùng batch thì quyết định
+    sau cùng thắng. An toàn khi gọi từ nhiều thread (vd các request Flask).
+    """
+
+    def __init__(self, blocklist):
+        self.blocklist = blocklist
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._pending = {}  # entry -> (action, timeout, [ticket])
+
+    def _enqueue(self, entry, action, timeout=None):
+        ticket = BatchTicket(entry, action)
+        with self._lock:
+            previous = self._pending.get(entry)
+            tickets = previous[2] if previous else []
+            tickets.append(ticket)
+            self._pending[entry] = (action, timeout, tickets)
+        return ticket
+
+    def block(self, entry, timeout=None):
+        return self._enqueue(entry, 'block', timeout)
+
+    def unblock(self, entry):
+        return self._enqueue(entry, 'unblock')
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def take(self):
+        """Lấy các quyết định đang chờ để commit sau (vd ở thread khác)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def commit(self, pending=None):
+        """Áp dụng mọi quyết định đang chờ (hoặc phần đã take()), trả về {entry: (action, ok, thông báo)}"""
+        with self._commit_lock:
+            if pending is None:
+                pending = self.take()
+            if not pending:
+                return {}
+
+            adds = {e: timeout for e, (action, timeout, _) in pending.items() if action == 'block'}
+            removes = [e for e, (action, _, _) in pending.items() if action == 'unblock']
+            backend = getattr(self.blocklist, 'name', 'unknown')
+            started = time.perf_counter()
+            try:
+                results = self.blocklist.apply(adds, removes)
+            except Exception as e:
+                logging.error(f"Lỗi commit batch firewall: {e}")
+                results = {}
+            COMMIT_SECONDS.labels(backend).observe(time.perf_counter() - started)
+
+            report = {}
+            for entry, (action, _, tickets) in pending.items():
+                ok, message = results.get(entry, (False, 'không có kết quả'))
+                report[entry] = (action, ok, message)
+                COMMIT_ENTRIES.labels(backend, action).inc()
+                if not ok:
+                    COMMIT_FAILURES.labels(backend, action).inc()
+                for ticket in tickets:
+                    if ticket.action == action:
+                        ticket._resolve(ok, message)
+                    else:
+                        ticket._resolve(False, 'đã bị thay bằng quyết định sau')
+            return report
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Đếm theo IP với bộ nhớ cố định khi bị flood từ hàng triệu nguồn (giả mạo)
+
+CountMinSketch: Count-Min theo cửa sổ trượt, mỗi bucket thời gian một bảng
+depth x width ô uint32 (cập nhật bảo thủ), cộng thêm một bảng tổng của cả cửa
+sổ. Ước lượng không bao giờ nhỏ hơn số đếm thật; bộ nhớ chỉ phụ thuộc width,
+depth và số bucket, không phụ thuộc số nguồn.
+
+HeavyHitterCounter: thay SlidingWindowCounter. Mọi nguồn đều đi qua sketch,
+nhưng chỉ nguồn có ước lượng đạt promote_at mới được đếm chính xác (tối đa
+capacity nguồn). Khi đầy, nguồn mới thay nguồn có tổng nhỏ nhất nếu ước lượng
+của nó lớn hơn (luật thay thế của Space-Saving). Số đếm chính xác chỉ tính
+từ lúc được nhận, nên va chạm trong sketch không làm chặn nhầm; phần trước đó
+(ước lượng - số đếm lúc nhận) được giữ làm sai số như Space-Saving.
+"""
+
+import heapq
+import operator
+import random
+from array import array
+
+from sliding_window import SlidingWindowCounter
+
+_P61 = (1 << 61) - 1
+_MAX_COUNT = 0xffffffff
+
+
+class CountMinSketch:
+    def __init__(self, window, buckets, width, depth=4, seed=0x5eed):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.width = width
+        self.depth = depth
+        rng = random.Random(seed)
+        self._a = rng.randrange(1, _P61)
+        self._b = rng.randrange(0, _P61)
+        size = width * depth
+        self._zero = array('I', bytes(4 * size))
+        self._tables = [array('I', self._zero) for _ in range(buckets)]
+        # Tổng của các bucket còn trong cửa sổ, ô nào cũng = tổng cùng ô các bảng
+        self._totals = array('I', self._zero)
+        self._epoch = None
+
+    @classmethod
+    def for_memory(cls, window, buckets, memory_bytes, depth=4, seed=0x5eed):
+        """Chọn width lớn nhất để sketch vừa memory_bytes"""
+        width = max(memory_bytes // (4 * depth * (buckets + 1)), 16)
+        return cls(window, buckets, width, depth, seed)
+
+    def _indexes(self, key):
+        # Khoá IPv6 (129 bit) được gập về 61 bit; hàng i dùng h1 + i*h2 (double hashing)
+        folded = (key & _P61) ^ (key >> 61)
+        h = (self._a * folded + self._b) % _P61
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def _rotate(self, now):
+        """Xoá các bucket đã trượt ra khỏi cửa sổ, trả về bảng của bucket hiện tại"""
+        epoch = int(now // self.bucket_width)
+        if self._epoch is None or epoch - self._epoch >= self.buckets:
+            for table in self._tables:
+                table[:] = self._zero
+            self._totals[:] = self._zero
+        elif epoch > self._epoch:
+            for e in range(self._epoch + 1, epoch + 1):
+                table = self._tables[e % self.buckets]
+                self._totals = array('I', map(operator.sub, self._totals, table))
+                table[:] = self._zero
+        if self._epoch is None or epoch > self._epoch:
+            self._epoch = epoch
+        return self._tables[self._epoch % self.buckets]
+
+    def add(self, key, count, now):
+        """Cộng count cho key, trả về ước lượng tổng trong cửa sổ sau khi cộng"""
+        table = self._rotate(now)
+        totals = self._totals
+        indexes = self._indexes(key)
+        # Cập nhật bảo thủ: chỉ nâng các ô đang thấp hơn ước lượng mới
+        target = min(min(table[i] for i in indexes) + count, _MAX_COUNT)
+        for i in indexes:
+            current = table[i]
+            if current < target:
+                totals[i] = min(totals[i] + target - current, _MAX_COUNT)
+                table[i] = target
+        return min(totals[i] for i in indexes)
+
+    def estimate(self, key, now):
+        self._rotate(now)
+        return min(self._totals[i] for i in self._indexes(key))
+
+    def memory_bytes(self):
+        return (len(self._tables) + 1) * len(self._zero) * 4
+
+
+class HeavyHitterCounter:
+    """Cùng giao diện với SlidingWindowCounter, bộ nhớ giới hạn bởi sketch + capacity"""
+
+    def __init__(self, window, buckets, memory_bytes, depth=4, capacity=10000, promote_at=1):
+        self.sketch = CountMinSketch.for_memory(window, buckets, memory_bytes, depth)
+        self.exact = SlidingWindowCounter(window, buckets)
+        self.capacity = capacity
+        self.promote_at = promote_at
+        # key -> phần ước lượng có trước lúc được nhận (sai số kiểu Space-Saving)
+        self.errors = {}
+        self.promoted = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def add(self, key, count, now):
+        self.update({key: count}, now)
+
+    def update(self, counts, now):
+        """Cộng số đếm {key: count} của một chu kỳ"""
+        exact = self.exact
+        candidates = []
+        for key, count in counts.items():
+            estimate = self.sketch.add(key, count, now)
+            if key in exact:
+                exact.add(key, count, now)
+            elif estimate >= self.promote_at:
+                candidates.append((estimate, key, count))
+        if candidates:
+            self._admit(candidates, now)
+
+    def _admit(self, candidates, now):
+        exact = self.exact
+        free = self.capacity - len(exact)
+        if len(candidates) > free:
+            exact.expire(now)
+            free = self.capacity - len(exact)
+        if len(candidates) > free:
+            candidates.sort(reverse=True)
+            # Nguồn mạnh nhất thay nguồn đang đếm có tổng nhỏ nhất, chừng nào còn lớn hơn
+            overflow = candidates[free:]
+            victims = heapq.nsmallest(len(overflow), ((total, key) for key, total in
+                                                      self._totals(now)))
+            admitted = free
+            for (estimate, _, _), (total, victim) in zip(overflow, victims):
+                if total >= estimate:
+                    break
+                exact.remove(victim)
+                self.errors.pop(victim, None)
+                self.evicted += 1
+                admitted += 1
+            self.rejected += len(candidates) - admitted
+            candidates = candidates[:admitted]
+        for estimate, key, count in candidates:
+            exact.add(key, count, now)
+            self.errors[key] = estimate - count
+            self.promoted += 1
+
+    def _totals(self, now):
+        # Kể cả key đã về 0 nhưng chưa bị expire (tổng 0 là nạn nhân đầu tiên)
+        for key in list(self.exact):
+            yield key, self.exact.get(key, now)
+
+    def get(self, key, now):
+        return self.exact.get(key, now)
+
+    def items(self, now):
+        """Duyệt (key, số đếm chính xác từ lúc được nhận) của các nguồn đang theo dõi"""
+        return self.exact.items(now)
+
+    def top(self, k, now):
+        """k nguồn lớn nhất: (key, số đếm chính xác, sai số tối đa phía trên)"""
+        largest = heapq.nlargest(k, self.exact.items(now), key=operator.itemgetter(1))
+        return [(key, total, self.errors.get(key, 0)) for key, total in largest]
+
+    def expire(self, now):
+        expired = self.exact.expire(now)
+        if expired:
+            self.errors = {key: error for key, error in self.errors.items() if key in self.exact}
+        return expired
+
+    def remove(self, key):
+        self.exact.remove(key)
+        self.errors.pop(key, None)
+
+    def memory_bytes(self):
+        return self.sketch.memory_bytes() + self.exact.memory_bytes() + len(self.errors) * 64
+
+    def __contains__(self, key):
+        return key in self.exact
+
+    def __iter__(self):
+        return iter(self.exact)
+
+    def __len__(self):
+        return len(self.exact)
+
+
+def make_window_counter(options, threshold):
+    """Bộ đếm cửa sổ trượt cho một ngưỡng theo options['counting_mode']
+
+    options là dict cùng khoá với CONFIG của auto_block (time_window, window_buckets, hh_*).
+    """
+    if options['counting_mode'] == 'heavy_hitter':
+        return HeavyHitterCounter(options['time_window'], options['window_buckets'],
+                                  options['hh_memory_bytes'], options['hh_depth'],
+                                  options['hh_capacity'], threshold * options['hh_promote_ratio'])
+    return SlidingWindowCounter(options['time_window'], options['window_buckets'])
@@ -14,6 +14,7 @@ sudo apt install -y \
     python3-pip \
     python3-tk \
     iptables \
+    ipset \
     fail2ban \
     net-tools \
     iproute2 \
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Lõi địa chỉ IP dùng chung cho mọi module
+
+Địa chỉ được parse một lần thành khoá số nguyên gọn:
+- IPv4: chính giá trị 32 bit (0 .. 2**32-1), là int nhỏ của Python
+- IPv6: (1 << 128) | giá trị 128 bit, để không trùng với khoá IPv4
+IPv6 dạng ánh xạ IPv4 (::ffff:a.b.c.d) được quy về khoá IPv4.
+
+Khoá dùng làm key cho mọi bộ đếm, set và chỉ mục; chỉ đổi lại thành chuỗi
+khi ghi log, alert hoặc gọi firewall.
+"""
+
+import socket
+import struct
+
+V6_FLAG = 1 << 128
+V4_MAX = 0xffffffff
+V4_BITS = 32
+V6_BITS = 128
+
+_V4_MAPPED = 0xffff << 32
+_V4_MAPPED_MASK = ((1 << 96) - 1) << 32
+_WORDS_LE = struct.Struct('<4I')
+
+
+def parse_ip(text):
+    """Chuỗi (hoặc bytes) IPv4/IPv6 -> khoá số nguyên, None nếu không hợp lệ"""
+    if isinstance(text, bytes):
+        text = text.decode('ascii', 'replace')
+    if ':' in text:
+        if text.startswith('['):
+            text = text[1:text.find(']')] if ']' in text else text[1:]
+        try:
+            return from_packed(socket.inet_pton(socket.AF_INET6, text.split('%', 1)[0]))
+        except (OSError, ValueError):
+            return None
+    # inet_pton (khác inet_aton) chỉ nhận đúng dạng a.b.c.d
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def is_valid_ip(text):
+    return parse_ip(text) is not None
+
+
+def from_packed(raw):
+    """4 hoặc 16 byte theo thứ tự mạng -> khoá"""
+    value = int.from_bytes(raw, 'big')
+    if len(raw) == 4:
+        return value
+    if value & _V4_MAPPED_MASK == _V4_MAPPED:
+        return value & V4_MAX
+    return V6_FLAG | value
+
+
+def from_proc_hex(hex_addr):
+    """Cột địa chỉ hex của /proc/net/tcp{,6} -> khoá"""
+    raw = bytes.fromhex(hex_addr.decode() if isinstance(hex_addr, bytes) else hex_addr)
+    if len(raw) == 4:
+        # Một từ 32 bit in theo thứ tự byte của máy (little-endian)
+        return int.from_bytes(raw, 'little')
+    w0, w1, w2, w3 = _WORDS_LE.unpack(raw)
+    value = (w0 << 96) | (w1 << 64) | (w2 << 32) | w3
+    if value & _V4_MAPPED_MASK == _V4_MAPPED:
+        return value & V4_MAX
+    return V6_FLAG | value
+
+
+def is_ipv4(key):
+    return key <= V4_MAX
+
+
+def address_bits(key):
+    return V4_BITS if key <= V4_MAX else V6_BITS
+
+
+def to_packed(key):
+    if key <= V4_MAX:
+        return key.to_bytes(4, 'big')
+    return (key ^ V6_FLAG).to_bytes(16, 'big')
+
+
+def format_ip(key):
+    """Khoá -> chuỗi IP"""
+    if key <= V4_MAX:
+        return socket.inet_ntoa(key.to_bytes(4, 'big'))
+    return socket.inet_ntop(socket.AF_INET6, (key ^ V6_FLAG).to_bytes(16, 'big'))
+
+
+def network_key(key, prefix_len):
+    """Khoá của dải /prefix_len chứa key (cùng họ địa chỉ với key)"""
+    if key <= V4_MAX:
+        return key & ((V4_MAX << (V4_BITS - prefix_len)) & V4_MAX)
+    host_bits = V6_BITS - prefix_len
+    return ((key ^ V6_FLAG) >> host_bits << host_bits) | V6_FLAG
+
+
+def network_last(net_key, prefix_len):
+    """Khoá cuối cùng của dải bắt đầu ở net_key"""
+    bits = address_bits(net_key)
+    return net_key | ((1 << (bits - prefix_len)) - 1)
+
+
+def format_cidr(net_key, prefix_len):
+    return f"{format_ip(net_key)}/{prefix_len}"
+
+
+class AddressParser:
+    """Parse hàng loạt với cache: trong một snapshot, rất nhiều dòng cùng IP"""
+
+    def __init__(self, max_size=1 << 18):
+        self.max_size = max_size
+        self._cache = {}
+
+    def parse(self, text):
+        key = self._cache.get(text)
+        if key is None:
+            key = parse_ip(text)
+            if key is None:
+                return None
+            if len(self._cache) >= self.max_size:
+                self._cache.clear()
+            self._cache[text] = key
+        return key
+
+    def parse_column(self, lines, index, strip_port=True):
+        """Parse cột thứ index (tách theo khoảng trắng) của mỗi dòng -> danh sách khoá
+
+        strip_port: cột có dạng IP:port (IPv6 có thể là [IP]:port hoặc IP:port)
+        """
+        keys = []
+        parse = self.parse
+        for line in lines:
+            parts = line.split()
+            if len(parts) <= index:
+                continue
+            token = parts[index]
+            if strip_port:
+                token = token.rsplit(':', 1)[0]
+            key = parse(token)
+            if key is not None:
+                keys.append(key)
+        return keys
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Chỉ mục prefix cho whitelist / blocklist
+
+Mỗi entry có thể là một IP ('10.0.0.5'), một CIDR ('10.0.0.0/8') hoặc một
+dải ('10.0.0.5-10.0.0.20'). Khi biên dịch, các entry được đổi thành khoảng
+khoá ip_core [đầu, cuối], sắp xếp và gộp các khoảng chồng nhau; tra cứu một
+IP là một lần tìm nhị phân, O(log n) với n là số khoảng sau khi gộp.
+"""
+
+import ipaddress
+from array import array
+from bisect import bisect_right
+
+from ip_core import V4_MAX, V6_FLAG, parse_ip
+
+
+def _key(address):
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return int(address.ipv4_mapped)
+    return int(address) if address.version == 4 else V6_FLAG | int(address)
+
+
+def parse_entry(text):
+    """Đổi entry thành khoảng khoá (đầu, cuối), ValueError nếu không hợp lệ"""
+    text = text.strip()
+    if not text:
+        raise ValueError("entry rỗng")
+    if '-' in text:
+        first, _, last = text.partition('-')
+        start = ipaddress.ip_address(first.strip())
+        end = ipaddress.ip_address(last.strip())
+        if start.version != end.version:
+            raise ValueError(f"dải {text} trộn IPv4 và IPv6")
+        if int(start) > int(end):
+            raise ValueError(f"dải {text} có đầu lớn hơn cuối")
+        return _key(start), _key(end)
+    network = ipaddress.ip_network(text, strict=False)
+    return _key(network.network_address), _key(network.broadcast_address)
+
+
+def is_valid_entry(text):
+    try:
+        parse_entry(text)
+        return True
+    except ValueError:
+        return False
+
+
+def entry_to_cidrs(text):
+    """Đổi entry thành danh sách CIDR tương đương (để đưa vào firewall)"""
+    start, end = parse_entry(text)
+    if end <= V4_MAX:
+        first, last = ipaddress.IPv4Address(start), ipaddress.IPv4Address(end)
+    else:
+        first, last = ipaddress.IPv6Address(start ^ V6_FLAG), ipaddress.IPv6Address(end ^ V6_FLAG)
+    networks = ipaddress.summarize_address_range(first, last)
+    return [str(net) if net.num_addresses > 1 else str(net.network_address) for net in networks]
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class PrefixIndex:
+    """Tập các khoảng khoá đã gộp, tra cứu bằng tìm nhị phân"""
+
+    def __init__(self, entries=()):
+        self.entries = []
+        intervals = []
+        for entry in entries:
+            try:
+                intervals.append(parse_entry(entry))
+            except ValueError:
+                continue
+            self.entries.append(entry)
+
+        merged = _merge(intervals)
+        v4 = [iv for iv in merged if iv[1] <= V4_MAX]
+        v6 = [iv for iv in merged if iv[0] > V4_MAX]
+        # Khoá IPv4 vừa 32 bit nên dùng array cho gọn; khoá IPv6 cần số nguyên lớn
+        self._v4_starts = array('L', (s for s, _ in v4))
+        self._v4_ends = array('L', (e for _, e in v4))
+        self._v6_starts = [s for s, _ in v6]
+        self._v6_ends = [e for _, e in v6]
+
+    def contains(self, key):
+        """Khoá IP có nằm trong một entry nào không"""
+        if key <= V4_MAX:
+            starts, ends = self._v4_starts, self._v4_ends
+        else:
+            starts, ends = self._v6_starts, self._v6_ends
+        i = bisect_right(starts, key) - 1
+        return i >= 0 and key <= ends[i]
+
+    def contains_ip(self, ip):
+        key = parse_ip(ip)
+        return key is not None and self.contains(key)
+
+    def overlaps(self, start, end):
+        """Khoảng khoá [start, end] có giao với entry nào không"""
+        if end <= V4_MAX:
+            starts, ends = self._v4_starts, self._v4_ends
+        else:
+            starts, ends = self._v6_starts, self._v6_ends
+        i = bisect_right(starts, end) - 1
+        return i >= 0 and ends[i] >= start
+
+    def __len__(self):
+        return len(self._v4_starts) + len(self._v6_starts)
+
+    def __bool__(self):
+        return len(self) > 0
@@ -4,9 +4,11 @@ from tkinter import ttk, messagebox
 import subprocess
 import os
 import sys
-import json
 from datetime import datetime, timezone
 
+from alert_store import AlertReader
+from drop_counters import read_drop_stats
+
 # Import các tab mới (giữ nguyên nếu bạn đã có các file này)
 try:
     from auto_block_tab import AutoBlockTab
@@ -19,8 +21,9 @@ except Exception:
     Fail2BanTab = None
 
 
-LOG_JSON = '/var/log/firewall_alerts.json'    # file JSON ghi các alert
+LOG_JSON = '/var/log/firewall_alerts.json'    # file NDJSON ghi các alert (alert_store)
 LOG_PLAIN = '/var/log/firewall_auto_block.log'  # (tuỳ chọn) file log thuần
+DROP_STATS = '/var/lib/firewall_auto_block/drops.json'  # số gói bị drop của từng entry (auto_block)
 
 
 class FirewallGUI:
@@ -28,6 +31,7 @@ class FirewallGUI:
         self.root = root
         self.root.title("Firewall Management System - PBL4")
         self.root.geometry("1200x800")
+        self.alert_reader = AlertReader(LOG_JSON)
 
         # Kiểm tra quyền root
         self.check_root_privileges()
@@ -45,6 +49,7 @@ class FirewallGUI:
 
         # Bắt đầu vòng polling logs -> cập nhật dashboard
         self.update_dashboard_from_logs()
+        self.update_drops()
         # cập nhật mỗi 5s
         self._after_id = self.root.after(5000, self.periodic_update)
 
@@ -160,6 +165,28 @@ class FirewallGUI:
         self.alerts_text.insert(tk.END, "Chưa có cảnh báo nào...\n")
         self.alerts_text.config(state=tk.DISABLED)
 
+        # Lưu lượng các entry đang chặn còn drop (bộ đếm firewall do auto_block đọc)
+        drops_frame = ttk.LabelFrame(dashboard_frame, text="Lưu Lượng Bị Chặn")
+        drops_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self.drops_tree = ttk.Treeview(drops_frame, columns=("entry", "pps", "packets", "bytes", "last", "expires"),
+                                       show='headings', height=6)
+        self.drops_tree.heading("entry", text="IP / Dải")
+        self.drops_tree.heading("pps", text="Gói/s")
+        self.drops_tree.heading("packets", text="Tổng Gói")
+        self.drops_tree.heading("bytes", text="Tổng Byte")
+        self.drops_tree.heading("last", text="Drop Gần Nhất")
+        self.drops_tree.heading("expires", text="Hết Hạn Chặn")
+        self.drops_tree.column("entry", width=220)
+        for column in ("pps", "packets", "bytes"):
+            self.drops_tree.column(column, width=100, anchor=tk.E)
+        self.drops_tree.column("last", width=160, anchor=tk.CENTER)
+        self.drops_tree.column("expires", width=160, anchor=tk.CENTER)
+        drops_scrollbar = ttk.Scrollbar(drops_frame, orient=tk.VERTICAL, command=self.drops_tree.yview)
+        self.drops_tree.config(yscrollcommand=drops_scrollbar.set)
+        self.drops_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        drops_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
         # Quick actions
         actions_frame = ttk.LabelFrame(dashboard_frame, text="Hành Động Nhanh")
         actions_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -379,38 +406,10 @@ class FirewallGUI:
         self.status_var.set("Đã lưu cài đặt hệ thống")
 
     # ---------- Log parsing & dashboard update ----------
-    def load_alerts(self):
-        """Đọc file JSON log và trả về danh sách alert (mỗi alert là dict).
-        File dự kiến là 1 JSON array: [ {...}, {...}, ... ]"""
-        if not os.path.exists(LOG_JSON):
-            return []
-
+    def load_alerts(self, limit=100):
+        """Đọc tối đa limit alert mới nhất từ file NDJSON (mỗi alert là dict)"""
         try:
-            with open(LOG_JSON, 'r') as f:
-                data = f.read().strip()
-                if not data:
-                    return []
-                # Một số file có thể ghi nhiều object lên từng dòng (ndjson) hoặc là 1 array.
-                try:
-                    alerts = json.loads(data)
-                    # nếu file là object đơn lẻ, bọc thành list
-                    if isinstance(alerts, dict):
-                        return [alerts]
-                    if isinstance(alerts, list):
-                        return alerts
-                    return []
-                except json.JSONDecodeError:
-                    # thử parse từng dòng json (ndjson)
-                    alerts = []
-                    for line in data.splitlines():
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            alerts.append(json.loads(line))
-                        except json.JSONDecodeError:
-                            continue
-                    return alerts
+            return self.alert_reader.recent(limit)
         except Exception as e:
             # không raise, chỉ trả rỗng để GUI vẫn chạy
             print("Lỗi đọc log JSON:", e)
@@ -435,12 +434,13 @@ class FirewallGUI:
 
         # đếm unique IP bị BLOCKED
         blocked_ips = set()
-        today_count = 0
         recent_lines = []
 
         now = datetime.now(timezone.utc)
         # midnight UTC của hôm nay để tính (nếu bạn muốn theo local time, sửa .utc -> local)
         midnight = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+        # Dùng chỉ mục thời gian của file alert, chỉ đọc các lô từ nửa đêm
+        today_count = len(self.alert_reader.since(midnight.timestamp()))
 
         for entry in alerts:
             # dự kiến entry chứa: timestamp, ip, reason, action
@@ -463,13 +463,6 @@ class FirewallGUI:
             if action == 'BLOCKED' and ip:
                 blocked_ips.add(ip)
 
-            if entry_dt:
-                if entry_dt >= midnight:
-                    today_count += 1
-            else:
-                # nếu không parse được timestamp, vẫn cộng như 1 cảnh báo
-                today_count += 1
-
             # format recent line
             time_str = entry_dt.astimezone().strftime('%Y-%m-%d %H:%M:%S') if entry_dt else str(ts)
             recent_lines.append(f"{time_str} - {ip or 'unknown'} - {action} - {reason}")
@@ -509,10 +502,25 @@ class FirewallGUI:
             self.alerts_text.insert(tk.END, line + "\n")
         self.alerts_text.config(state=tk.DISABLED)
 
+    def update_drops(self, limit=200):
+        """Hiện limit entry drop nhiều nhất (gói/s) từ file số liệu drop của auto_block"""
+        entries = read_drop_stats(DROP_STATS).get('entries', {})
+        ranked = sorted(entries.items(), key=lambda item: (item[1]['pps'], item[1]['packets']), reverse=True)
+
+        def _time(ts):
+            return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts else '-'
+
+        self.drops_tree.delete(*self.drops_tree.get_children())
+        for entry, stats in ranked[:limit]:
+            self.drops_tree.insert('', tk.END, values=(
+                entry, f"{stats['pps']:.1f}", stats['packets'], stats['bytes'],
+                _time(stats.get('last_drop')), _time(stats.get('expires')) if stats.get('expires') else 'vĩnh viễn'))
+
     def periodic_update(self):
         """Hàm gọi định kỳ để refresh dashboard"""
         try:
             self.update_dashboard_from_logs()
+            self.update_drops()
         except Exception as e:
             print("Lỗi periodic_update:", e)
         # triệu hồi lại sau 5s
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Số liệu của daemon theo định dạng Prometheus / OpenMetrics
+
+Không cần prometheus_client: Counter, Gauge và Histogram (có nhãn) đăng ký
+vào REGISTRY toàn cục, module nào cần đo thì khai báo metric ở đầu module
+rồi gọi inc() / set() / observe(). MetricsServer phục vụ GET /metrics qua
+HTTP cục bộ và/hoặc Unix socket trong thread nền; scrape() đọc lại từ đó
+(web_dashboard dùng để xuất lại số liệu của daemon).
+
+Định dạng text 0.0.4 của Prometheus, hoặc OpenMetrics 1.0 khi client gửi
+Accept: application/openmetrics-text.
+"""
+
+import http.client
+import logging
+import math
+import os
+import socket
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Giây, từ 1ms đến 30s: đủ cho một giai đoạn của chu kỳ lẫn một lần gọi iptables chậm
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _format_bound(bound):
+    """Nhãn le của bucket dạng float chuẩn của OpenMetrics ("1.0", "+Inf")"""
+    if bound == math.inf:
+        return '+Inf'
+    return repr(float(bound))
+
+
+def _escape(text, quote=True):
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"metric {metric.name} đã được đăng ký")
+            self._metrics.append(metric)
+
+    def render(self, openmetrics=False):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(openmetrics))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} cần nhãn {self.labelnames}")
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _family(self, openmetrics):
+        return self.name
+
+    def render(self, openmetrics=False):
+        family = self._family(openmetrics)
+        lines = [f"# HELP {family} {_escape(self.documentation, quote=False)}",
+                 f"# TYPE {family} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng; tên không kèm hậu tố _total (thêm khi xuất)"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def _family(self, openmetrics):
+        return self.name if openmetrics else self.name + '_total'
+
+    def _samples(self, values, child):
+        yield f"{self.name}_total{_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def _samples(self, values, child):
+        yield f"{self.name}{_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramValue:
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        """Đo thời gian của khối with (giây)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self._lock, self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def _samples(self, values, child):
+        with self._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            labels = _labels(self.labelnames, values, [('le', _format_bound(bound))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels} {_format_value(total)}"
+        yield f"{self.name}_count{labels} {count}"
+
+
+# ---------- phục vụ / đọc lại ----------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        try:
+            body = self.server.registry.render(openmetrics).encode()
+        except Exception as e:
+            logging.error(f"Lỗi xuất metrics: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"metrics: {format % args}")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler cần client_address dạng (host, port)
+        return request, ('unix', 0)
+
+
+class MetricsServer:
+    """Phục vụ /metrics ở host:port (port 0 hoặc None = không mở TCP) và/hoặc socket_path"""
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=None, socket_path=None):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self._servers = []
+        self._threads = []
+
+    def start(self):
+        if self.port:
+            self._serve(ThreadingHTTPServer((self.host, self.port), _Handler))
+            logging.info(f"Metrics tại http://{self.host}:{self.port}/metrics")
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self._serve(_UnixHTTPServer(self.socket_path, _Handler))
+            logging.info(f"Metrics tại unix:{self.socket_path}")
+        return self
+
+    def _serve(self, server):
+        server.registry = self.registry
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+        thread.start()
+        self._servers.append(server)
+        self._threads.append(thread)
+
+    def close(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if self.socket_path and self._servers and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._servers = []
+        self._threads = []
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def scrape(host='127.0.0.1', port=None, socket_path=None, accept=None, timeout=5.0):
+    """Đọc /metrics của một MetricsServer -> (content type, body bytes)
+
+    Ưu tiên Unix socket nếu có socket_path. OSError / HTTPException nếu không đọc được.
+    """
+    if socket_path:
+        conn = _UnixHTTPConnection(socket_path, timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request('GET', '/metrics', headers={'Accept': accept} if accept else {})
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status}")
+        return response.getheader('Content-Type', TEXT_CONTENT_TYPE), body
+    finally:
+        conn.close()
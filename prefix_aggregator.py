@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Gộp số đếm theo IP thành số đếm theo dải mạng (/24, /16, ...)
+
+Mỗi độ dài prefix là một tầng của cây prefix, lưu bằng SlidingWindowCounter
+với key là khoá ip_core của địa chỉ mạng. Mỗi chu kỳ chỉ cộng phần tăng thêm
+của các IP vừa quan sát vào các tầng nên chi phí tỉ lệ với số nguồn của chu kỳ.
+
+Khi xét ngưỡng, tầng dài (cụ thể) được xét trước; số đếm của các dải con đã
+vượt ngưỡng được trừ khỏi dải cha, nên một /16 chỉ bị chặn khi phần còn lại
+ngoài các /24 đã chặn vẫn vượt ngưỡng của /16.
+"""
+
+from collections import defaultdict
+
+from sliding_window import SlidingWindowCounter
+from ip_core import V4_MAX, network_key, format_cidr
+
+
+class PrefixAggregator:
+    """thresholds: {độ dài prefix IPv4: ngưỡng}, vd {24: 200, 16: 1000}
+    thresholds_v6: tương tự cho IPv6, vd {64: 200, 48: 1000}
+    counter_factory(ngưỡng): tạo bộ đếm cho một tầng (mặc định SlidingWindowCounter)
+    """
+
+    def __init__(self, window, buckets, thresholds, min_sources=5, thresholds_v6=None,
+                 counter_factory=None):
+        self.window = window
+        self.buckets = buckets
+        self.counter_factory = counter_factory
+        self.levels = {}
+        # Số nguồn khác nhau của mỗi dải trong chu kỳ gần nhất
+        self.sources = {}
+        self.set_thresholds(thresholds, min_sources, thresholds_v6)
+
+    def set_thresholds(self, thresholds, min_sources=5, thresholds_v6=None):
+        """Đổi ngưỡng khi đang chạy; tầng giữ nguyên thì giữ nguyên số đếm"""
+        # Tầng = (họ địa chỉ, độ dài prefix)
+        new = {(4, plen): value for plen, value in thresholds.items()}
+        new.update({(6, plen): value for plen, value in (thresholds_v6 or {}).items()})
+        self.thresholds = new
+        self.min_sources = min_sources
+        self.levels = {level: self.levels[level] if level in self.levels
+                       else self._new_counter(value)
+                       for level, value in new.items()}
+        self.sources = {level: self.sources.get(level, {}) for level in new}
+        self._v4_levels = [plen for family, plen in self.levels if family == 4]
+        self._v6_levels = [plen for family, plen in self.levels if family == 6]
+
+    def _new_counter(self, threshold):
+        if self.counter_factory is not None:
+            return self.counter_factory(threshold)
+        return SlidingWindowCounter(self.window, self.buckets)
+
+    def update(self, counts, now):
+        """Cộng số đếm theo IP (khoá) của một chu kỳ vào mọi tầng prefix"""
+        if not self.levels:
+            return
+        tick = {level: defaultdict(int) for level in self.levels}
+        sources = {level: defaultdict(int) for level in self.levels}
+        v4_levels = [(plen, tick[(4, plen)], sources[(4, plen)]) for plen in self._v4_levels]
+        v6_levels = [(plen, tick[(6, plen)], sources[(6, plen)]) for plen in self._v6_levels]
+
+        for key, count in counts.items():
+            for plen, level_tick, level_sources in (v4_levels if key <= V4_MAX else v6_levels):
+                net = network_key(key, plen)
+                level_tick[net] += count
+                level_sources[net] += 1
+
+        for level, counter in self.levels.items():
+            counter.update(tick[level], now)
+            self.sources[level] = sources[level]
+
+    def expire(self, now):
+        for counter in self.levels.values():
+            counter.expire(now)
+
+    def offenders(self, now, skip=None):
+        """Danh sách (cidr, tổng, số nguồn) vượt ngưỡng, dải cụ thể trước
+
+        skip(net_key, prefix_len) trả về True để bỏ qua một dải (vd chứa IP whitelist).
+        """
+        # (net, phần đã tính) của các dải vượt ngưỡng ở tầng dài hơn; chỉ ghi phần còn
+        # lại để dải cha không trừ hai lần phần của dải cháu đã nằm trong dải con
+        fired = []
+        result = []
+        for level in sorted(self.levels, key=lambda lv: lv[1], reverse=True):
+            family, plen = level
+            threshold = self.thresholds[level]
+            sources = self.sources[level]
+
+            # Phần đã bị tính ở các dải con vượt ngưỡng (cùng họ địa chỉ)
+            claimed = defaultdict(int)
+            for child_net, child_total in fired:
+                if (child_net <= V4_MAX) == (family == 4):
+                    claimed[network_key(child_net, plen)] += child_total
+
+            for net, total in self.levels[level].items(now):
+                remaining = total - claimed.get(net, 0)
+                if remaining <= threshold:
+                    continue
+                if sources.get(net, 0) < self.min_sources:
+                    continue
+                if skip is not None and skip(net, plen):
+                    continue
+                fired.append((net, remaining))
+                result.append((format_cidr(net, plen), remaining, sources.get(net, 0)))
+        return result
+
+    def __len__(self):
+        return sum(len(counter) for counter in self.levels.values())
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Đo thời gian từng giai đoạn của chu kỳ phát hiện và lấy mẫu stack
+
+CycleProfiler: ring buffer giữ thời gian từng giai đoạn (và bước con như
+collect.netstat, collect.ss, detect.window_scan, commit.firewall) của các
+chu kỳ gần nhất. Mỗi giai đoạn chỉ tốn hai lần đọc perf_counter và một
+phép cộng vào dict, nên luôn bật.
+
+StackSampler: thread nền lấy stack của mọi thread (sys._current_frames)
+mỗi interval giây, giữ các mẫu trong window giây gần nhất. Là profiler theo
+thời gian thực (wall-clock): thread đang chờ I/O (vd iptables-restore) vẫn
+được tính. Xuất dạng "folded" (mỗi dòng "thread;hàm;hàm... số mẫu") dùng
+trực tiếp với flamegraph.pl, speedscope hoặc inferno. Chỉ chạy khi bật.
+
+dump_profile() ghi cả hai ra file JSON (và <file>.folded), thay file một
+cách nguyên tử; auto_block gọi khi nhận SIGUSR1.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class CycleProfiler:
+    """Thời gian từng giai đoạn của capacity chu kỳ gần nhất
+
+    record() / span() cộng dồn vào chu kỳ đang chạy; finish() đóng chu kỳ. Với
+    runtime asyncio, commit firewall chạy song song với chu kỳ sau nên được
+    tính vào chu kỳ kết thúc sau nó.
+    """
+
+    def __init__(self, capacity=1000):
+        self.cycles = deque(maxlen=capacity)
+        self._current = {}
+        # Handler SIGUSR1 chạy trên main thread, có thể chen giữa một record()
+        self._lock = threading.RLock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._current[stage] = self._current.get(stage, 0.0) + seconds
+
+    def record_all(self, prefix, timings):
+        """Ghi các bước con {tên: giây} dưới dạng prefix.tên"""
+        for name, seconds in timings.items():
+            self.record(f"{prefix}.{name}", seconds)
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def finish(self, timestamp, duration, **fields):
+        with self._lock:
+            stages, self._current = self._current, {}
+        record = {'time': timestamp, 'duration': duration, 'stages': stages}
+        record.update(fields)
+        self.cycles.append(record)
+
+    def summary(self):
+        """{giai đoạn: số chu kỳ, tb / p50 / p95 / max (ms), tỉ lệ trên tổng thời gian chu kỳ}"""
+        with self._lock:
+            cycles = list(self.cycles)
+        per_stage = {}
+        for cycle in cycles:
+            for stage, seconds in cycle['stages'].items():
+                per_stage.setdefault(stage, []).append(seconds)
+        total = sum(cycle['duration'] for cycle in cycles) or 1.0
+        return {stage: {'cycles': len(values),
+                        'avg_ms': sum(values) / len(values) * 1000,
+                        'p50_ms': _percentile(values, 0.5) * 1000,
+                        'p95_ms': _percentile(values, 0.95) * 1000,
+                        'max_ms': max(values) * 1000,
+                        'share': sum(values) / total}
+                for stage, values in sorted(per_stage.items())}
+
+    def snapshot(self):
+        with self._lock:
+            cycles = list(self.cycles)
+        return {'summary': self.summary(), 'cycles': cycles}
+
+
+class StackSampler:
+    """Lấy mẫu stack mọi thread mỗi interval giây, giữ window giây gần nhất
+
+    max_stacks: số stack khác nhau tối đa mỗi giây; stack mới vượt quá bị gộp
+    vào "<thread>;[khác]" để bộ nhớ có giới hạn.
+    """
+
+    def __init__(self, interval=0.01, window=60, max_stacks=5000):
+        self.interval = interval
+        self.window = window
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.started = None
+        self._buckets = deque()  # (giây, {stack: số mẫu})
+        self._labels = {}        # code object -> nhãn frame
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._active = False
+
+    @property
+    def running(self):
+        return self._active
+
+    def start(self, duration=None, on_done=None):
+        """Bắt đầu lấy mẫu; duration: tự dừng sau duration giây rồi gọi on_done(self)"""
+        if self.running:
+            return False
+        self._stop.clear()
+        with self._lock:
+            self._buckets.clear()
+        self.samples = 0
+        self.started = time.time()
+        self._active = True
+        self._thread = threading.Thread(target=self._run, args=(duration, on_done),
+                                        name='stack-sampler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _fold(self, frame, thread_name):
+        frames = []
+        while frame is not None:
+            frames.append(self._label(frame.f_code))
+            frame = frame.f_back
+        frames.append(thread_name)
+        frames.reverse()
+        return ';'.join(frames)
+
+    def _run(self, duration, on_done):
+        me = threading.get_ident()
+        deadline = None if duration is None else time.monotonic() + duration
+        names = {}
+        names_at = 0.0
+        try:
+            while not self._stop.wait(self.interval):
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    break
+                if now - names_at >= 1.0:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    names_at = now
+                second = int(now)
+                stacks = [self._fold(frame, names.get(ident, str(ident)))
+                          for ident, frame in sys._current_frames().items() if ident != me]
+                with self._lock:
+                    buckets = self._buckets
+                    if not buckets or buckets[-1][0] != second:
+                        buckets.append((second, {}))
+                        while buckets and buckets[0][0] <= second - self.window:
+                            buckets.popleft()
+                    counts = buckets[-1][1]
+                    for stack in stacks:
+                        if stack not in counts and len(counts) >= self.max_stacks:
+                            stack = stack.split(';', 1)[0] + ';[khác]'
+                        counts[stack] = counts.get(stack, 0) + 1
+                    self.samples += 1
+        except Exception as e:
+            logging.error(f"Lỗi lấy mẫu stack: {e}")
+        finally:
+            self._active = False
+            if on_done is not None:
+                on_done(self)
+
+    def folded(self):
+        """Các dòng "stack số_mẫu" của window giây gần nhất, nhiều mẫu trước"""
+        merged = {}
+        with self._lock:
+            for _, counts in self._buckets:
+                for stack, count in counts.items():
+                    merged[stack] = merged.get(stack, 0) + count
+        return [f"{stack} {count}" for stack, count in
+                sorted(merged.items(), key=lambda item: item[1], reverse=True)]
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def dump_profile(path, profiler, sampler=None, **fields):
+    """Ghi thời gian các chu kỳ (JSON) và stack đã lấy mẫu (<path>.folded nếu có)"""
+    report = {'pid': os.getpid(), 'time': time.time()}
+    report.update(fields)
+    report.update(profiler.snapshot())
+    if sampler is not None and sampler.samples:
+        folded = sampler.folded()
+        _write_atomic(path + '.folded', '\n'.join(folded) + '\n')
+        report['sampling'] = {'file': path + '.folded', 'interval': sampler.interval,
+                              'window': sampler.window, 'samples': sampler.samples,
+                              'running': sampler.running, 'stacks': len(folded)}
+    _write_atomic(path, json.dumps(report, indent=2, ensure_ascii=False))
+    return report
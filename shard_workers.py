@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Chia bộ đếm cửa sổ trượt theo IP nguồn cho nhiều tiến trình worker
+
+Nguồn được chia theo khoá % số worker; mỗi worker giữ cửa sổ SYN / kết nối
+của phần nguồn của mình. Số đếm mỗi chu kỳ và kết quả kiểm tra đi qua hai
+vùng shared memory của từng worker (mỗi bản ghi 3 số uint64), pipe chỉ mang
+lệnh điều khiển nhỏ. Tiến trình chính (coordinator) vẫn thu thập số liệu,
+gộp theo dải mạng và quyết định chặn, nên mọi lệnh chặn vẫn nằm trong một
+giao dịch firewall mỗi chu kỳ.
+
+Bản ghi số đếm: (64 bit thấp của khoá, 64 bit kế tiếp, count << 1 | cờ IPv6)
+Bản ghi kết quả: (64 bit thấp, 64 bit kế tiếp, tổng << 2 | loại << 1 | cờ IPv6),
+loại 0 = SYN, 1 = kết nối.
+"""
+
+import heapq
+import logging
+import multiprocessing
+import signal
+from array import array
+from multiprocessing import shared_memory
+
+from heavy_hitters import HeavyHitterCounter, make_window_counter
+from ip_core import V4_MAX
+from ip_index import PrefixIndex
+
+_M64 = (1 << 64) - 1
+_WORDS = 3  # số uint64 mỗi bản ghi
+
+
+def _encode(flat, key, value):
+    if key <= V4_MAX:
+        flat += (key, 0, value << 1)
+    else:
+        flat += (key & _M64, (key >> 64) & _M64, value << 1 | key >> 128)
+
+
+def _decode(words, start, count):
+    """{khoá: count} từ count bản ghi bắt đầu ở bản ghi start"""
+    counts = {}
+    end = (start + count) * _WORDS
+    for i in range(start * _WORDS, end, _WORDS):
+        tail = words[i + 2]
+        counts[(tail & 1) << 128 | words[i + 1] << 64 | words[i]] = tail >> 1
+    return counts
+
+
+def _worker_main(index, conn, input_name, output_name, capacity, options):
+    # Ctrl+C do tiến trình chính xử lý rồi gửi lệnh dừng
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shm_in = shared_memory.SharedMemory(name=input_name)
+    shm_out = shared_memory.SharedMemory(name=output_name)
+    words_in = shm_in.buf.cast('Q')
+    words_out = shm_out.buf.cast('Q')
+    counters = (make_window_counter(options, options['syn_threshold']),
+                make_window_counter(options, options['conn_threshold']))
+    try:
+        while True:
+            message = conn.recv()
+            op = message[0]
+            if op == 'update':
+                _, now, n_syn, n_conn, thresholds, promote_ratio = message
+                records = words_in[:(n_syn + n_conn) * _WORDS].tolist()
+                for counter, start, count, threshold in ((counters[0], 0, n_syn, thresholds[0]),
+                                                         (counters[1], n_syn, n_conn, thresholds[1])):
+                    if isinstance(counter, HeavyHitterCounter):
+                        counter.promote_at = threshold * promote_ratio
+                    if count:
+                        counter.update(_decode(records, start, count), now)
+                    counter.expire(now)
+                conn.send(('ok', len(counters[0]), len(counters[1]),
+                           sum(counter.memory_bytes() for counter in counters)))
+            elif op == 'check':
+                _, now, thresholds, near_ratio = message
+                hits = []
+                for kind, (counter, threshold) in enumerate(zip(counters, thresholds)):
+                    floor = threshold * near_ratio
+                    hits.extend((total / threshold, kind, key, total)
+                                for key, total in counter.items(now) if total >= floor)
+                if len(hits) > capacity:
+                    # Không đủ chỗ: giữ các IP gần ngưỡng nhất
+                    hits = heapq.nlargest(capacity, hits)
+                flat = []
+                for _, kind, key, total in hits:
+                    _encode(flat, key, total << 1 | kind)
+                words_out[:len(flat)] = array('Q', flat)
+                conn.send(('checked', len(hits)))
+            elif op == 'whitelist':
+                whitelist = PrefixIndex(message[1])
+                for counter in counters:
+                    for key in [key for key in counter if whitelist.contains(key)]:
+                        counter.remove(key)
+                conn.send(('ok',))
+            elif op == 'stop':
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        words_in.release()
+        words_out.release()
+        shm_in.close()
+        shm_out.close()
+
+
+class ShardPool:
+    """Coordinator: chia số đếm cho worker, gom IP gần / vượt ngưỡng
+
+    options: dict cùng khoá với CONFIG (time_window, window_buckets, counting_mode,
+    hh_*, syn_threshold, conn_threshold).
+    buffer_records: số bản ghi tối đa mỗi lượt gửi; nhiều hơn thì gửi nhiều lượt.
+    """
+
+    def __init__(self, workers, options, buffer_records=65536, timeout=30.0):
+        self.workers = workers
+        self.options = dict(options)
+        self.capacity = buffer_records
+        self.timeout = timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._shm = []
+        self._views = []
+        self._processes = [None] * workers
+        self._pipes = [None] * workers
+        self.sizes = [(0, 0, 0)] * workers
+        self.restarts = 0
+
+    def start(self):
+        size = self.capacity * _WORDS * 8
+        for index in range(self.workers):
+            shms = (shared_memory.SharedMemory(create=True, size=size),
+                    shared_memory.SharedMemory(create=True, size=size))
+            self._shm.append(shms)
+            self._views.append(tuple(shm.buf.cast('Q') for shm in shms))
+            self._spawn(index)
+        logging.info(f"Đã khởi động {self.workers} worker đếm theo shard")
+
+    def _spawn(self, index):
+        parent, child = self._context.Pipe()
+        shm_in, shm_out = self._shm[index]
+        process = self._context.Process(
+            target=_worker_main, name=f"auto_block-shard-{index}", daemon=True,
+            args=(index, child, shm_in.name, shm_out.name, self.capacity, self.options))
+        process.start()
+        child.close()
+        self._processes[index] = process
+        self._pipes[index] = parent
+
+    def _restart(self, index, error):
+        logging.error(f"Worker shard {index} lỗi ({error}), khởi động lại (mất cửa sổ của shard)")
+        process = self._processes[index]
+        if process.is_alive():
+            process.terminate()
+        process.join(1)
+        self._pipes[index].close()
+        self.restarts += 1
+        self._spawn(index)
+
+    def _request(self, messages):
+        """Gửi lệnh cho các worker song song, trả về {index: trả lời} (None nếu lỗi)"""
+        replies = {}
+        for index, message in messages.items():
+            try:
+                self._pipes[index].send(message)
+            except (OSError, ValueError) as e:
+                self._restart(index, e)
+                replies[index] = None
+        for index in messages:
+            if index in replies:
+                continue
+            pipe = self._pipes[index]
+            try:
+                if not pipe.poll(self.timeout):
+                    raise TimeoutError(f"không trả lời sau {self.timeout}s")
+                replies[index] = pipe.recv()
+            except (OSError, EOFError, TimeoutError) as e:
+                self._restart(index, e)
+                replies[index] = None
+        return replies
+
+    def update(self, syn_stats, conn_stats, now, thresholds, promote_ratio):
+        """Cộng số đếm của chu kỳ vào các shard và xoá phần đã trượt khỏi cửa sổ"""
+        workers = self.workers
+        parts = [([], []) for _ in range(workers)]
+        for kind, stats in enumerate((syn_stats, conn_stats)):
+            for key, count in stats.items():
+                _encode(parts[key % workers][kind], key, count)
+
+        positions = [[0, 0] for _ in range(workers)]
+        pending = set(range(workers))
+        limit = self.capacity * _WORDS
+        while pending:
+            messages = {}
+            for index in sorted(pending):
+                syn_flat, conn_flat = parts[index]
+                syn_pos, conn_pos = positions[index]
+                syn_part = syn_flat[syn_pos:syn_pos + limit]
+                conn_part = conn_flat[conn_pos:conn_pos + limit - len(syn_part)]
+                data = array('Q', syn_part + conn_part)
+                self._views[index][0][:len(data)] = data
+                positions[index] = [syn_pos + len(syn_part), conn_pos + len(conn_part)]
+                messages[index] = ('update', now, len(syn_part) // _WORDS,
+                                   len(conn_part) // _WORDS, thresholds, promote_ratio)
+                if positions[index][0] >= len(syn_flat) and positions[index][1] >= len(conn_flat):
+                    pending.discard(index)
+            for index, reply in self._request(messages).items():
+                if reply is not None:
+                    self.sizes[index] = reply[1:]
+
+    def check(self, now, thresholds, near_ratio):
+        """([(khoá, tổng SYN)], [(khoá, tổng kết nối)]) của các IP đạt near_ratio ngưỡng"""
+        replies = self._request({index: ('check', now, thresholds, near_ratio)
+                                 for index in range(self.workers)})
+        hits = ([], [])
+        for index, reply in replies.items():
+            if reply is None:
+                continue
+            words = self._views[index][1][:reply[1] * _WORDS].tolist()
+            for i in range(0, len(words), _WORDS):
+                tail = words[i + 2]
+                key = (tail & 1) << 128 | words[i + 1] << 64 | words[i]
+                hits[(tail >> 1) & 1].append((key, tail >> 2))
+        return hits
+
+    def remove_whitelisted(self, entries):
+        """Xoá khỏi cửa sổ các IP vừa được whitelist"""
+        self._request({index: ('whitelist', list(entries)) for index in range(self.workers)})
+
+    def stats(self):
+        """(số nguồn SYN, số nguồn kết nối, bộ nhớ) cộng trên mọi shard"""
+        return tuple(sum(size[i] for size in self.sizes) for i in range(3))
+
+    def close(self):
+        for index, pipe in enumerate(self._pipes):
+            if pipe is None:
+                continue
+            try:
+                pipe.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        for pipe in self._pipes:
+            if pipe is not None:
+                pipe.close()
+        for views, shms in zip(self._views, self._shm):
+            for view in views:
+                view.release()
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+        self._views = []
+        self._shm = []
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Bộ đếm cửa sổ trượt dùng bucket thời gian cố định cho mỗi key (IP)
+
+Mỗi key chỉ giữ `buckets` ô đếm nên bộ nhớ cố định, không phụ thuộc số sự
+kiện. Cập nhật và truy vấn là O(1) (tối đa `buckets` ô phải xoá khi key
+lâu không được cập nhật), hết hạn hàng loạt chỉ duyệt các key đã cũ.
+"""
+
+from array import array
+from collections import OrderedDict
+
+# Vị trí trong entry [total, epoch đã trượt tới, counts, epoch của lần cộng cuối]
+_TOTAL = 0
+_EPOCH = 1
+_COUNTS = 2
+_LAST = 3
+
+
+class SlidingWindowCounter:
+    def __init__(self, window, buckets=12):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        # key -> [total, epoch, array('I'), last_epoch], xếp theo lần cộng cuối
+        self._entries = OrderedDict()
+        self._zero = array('I', bytes(4 * buckets))
+
+    def _epoch(self, now):
+        return int(now // self.bucket_width)
+
+    def _advance(self, entry, epoch):
+        """Xoá các bucket đã trượt ra khỏi cửa sổ tính đến epoch hiện tại"""
+        last = entry[_EPOCH]
+        if epoch <= last:
+            return
+        if epoch - last >= self.buckets:
+            entry[_COUNTS] = array('I', self._zero)
+            entry[_TOTAL] = 0
+        else:
+            counts = entry[_COUNTS]
+            for e in range(last + 1, epoch + 1):
+                idx = e % self.buckets
+                entry[_TOTAL] -= counts[idx]
+                counts[idx] = 0
+        entry[_EPOCH] = epoch
+
+    def add(self, key, count, now):
+        epoch = self._epoch(now)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = [0, epoch, array('I', self._zero), epoch]
+            self._entries[key] = entry
+        else:
+            self._advance(entry, epoch)
+            self._entries.move_to_end(key)
+            entry[_LAST] = epoch
+        entry[_COUNTS][epoch % self.buckets] += count
+        entry[_TOTAL] += count
+
+    def update(self, counts, now):
+        """Cộng số đếm {key: count} của một chu kỳ"""
+        for key, count in counts.items():
+            self.add(key, count, now)
+
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        self._advance(entry, self._epoch(now))
+        return entry[_TOTAL]
+
+    def items(self, now):
+        """Duyệt (key, tổng trong cửa sổ) của các key còn số đếm"""
+        epoch = self._epoch(now)
+        for key, entry in self._entries.items():
+            self._advance(entry, epoch)
+            if entry[_TOTAL]:
+                yield key, entry[_TOTAL]
+
+    def expire(self, now):
+        """Xoá hàng loạt các key không còn sự kiện nào trong cửa sổ"""
+        cutoff = self._epoch(now) - self.buckets
+        entries = self._entries
+        expired = 0
+        while entries:
+            key, entry = next(iter(entries.items()))
+            # Theo lần cộng cuối: get()/items() trượt _EPOCH nhưng không đổi thứ tự
+            if entry[_LAST] > cutoff:
+                break
+            del entries[key]
+            expired += 1
+        return expired
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def memory_bytes(self):
+        """Ước lượng bộ nhớ của các ô đếm (không tính overhead của dict)"""
+        return len(self._entries) * (self.buckets * 4 + 64)
+
+    def export_arrays(self):
+        """(khoá, tổng, epoch, epoch cộng cuối, counts nối liền) theo thứ tự cộng cuối,
+        để lưu snapshot"""
+        totals = array('Q')
+        epochs = array('q')
+        lasts = array('q')
+        counts = array('I')
+        for entry in self._entries.values():
+            totals.append(entry[_TOTAL])
+            epochs.append(entry[_EPOCH])
+            lasts.append(entry[_LAST])
+            counts.extend(entry[_COUNTS])
+        return list(self._entries), totals, epochs, lasts, counts
+
+    def import_arrays(self, keys, totals, epochs, lasts, counts):
+        """Nạp lại trạng thái từ export_arrays(); cùng window và buckets"""
+        buckets = self.buckets
+        entries = self._entries
+        for i, key in enumerate(keys):
+            entries.pop(key, None)
+            entries[key] = [totals[i], epochs[i], counts[i * buckets:(i + 1) * buckets], lasts[i]]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
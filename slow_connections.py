@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Phát hiện tấn công kết nối chậm (slowloris, slow read) từ tcp_info
+
+Các tấn công này (vd slowhttptest) giữ ít nhưng lâu các kết nối gần như
+không truyền gì: gửi header từng chút một, hoặc đọc chậm với cửa sổ nhận rất
+nhỏ, nên không vượt ngưỡng SYN / kết nối mới. TcpInfoCollector
+(socket_collector) lấy tcp_info của mọi kết nối tới cổng dịch vụ trong một
+lần dump netlink; SlowConnectionMonitor so số byte (nhận + gửi được ack) của
+từng kết nối (theo 4-tuple) với lần đọc trước.
+
+Kết nối chỉ bị coi là treo khi đang có request / response dở dang mà tiến
+triển dưới max_rate byte/s liên tục ít nhất min_age giây:
+- còn dữ liệu chờ peer (unacked / notsent) mà peer nhận chậm (slow read);
+  cửa sổ nhận của peer dưới min_window byte thì không bao giờ tính là nhanh, hoặc
+- peer gửi nhỏ giọt: ít nhất hai lần đọc có byte mới nhưng tốc độ vẫn thấp
+  (slowloris)
+
+Kết nối keep-alive / HTTP/2 / websocket rảnh sau lần trao đổi đầu không có
+dữ liệu dở dang nên không bị đánh dấu. Một lần đọc nhanh, hoặc peer im lặng
+min_age giây mà không còn dữ liệu chờ, bắt đầu lại khoảng đo.
+"""
+
+from collections import defaultdict
+
+# Trạng thái mỗi kết nối: [đầu khoảng đo, byte lần đọc trước, số lần đọc có byte mới trong khoảng]
+_START, _BYTES, _TRICKLES = range(3)
+
+
+class SlowConnectionMonitor:
+    def __init__(self):
+        self.tracked = {}      # hash(4-tuple) -> trạng thái
+        self.stalled = {}      # khoá IP -> số kết nối treo ở lần đọc gần nhất
+        self.connections = {}  # khoá IP -> số kết nối ở lần đọc gần nhất
+        self.last_poll = None
+
+    def update(self, sockets, now, min_age, max_rate, min_window):
+        """Nạp kết quả TcpInfoCollector.collect(), trả về {khoá IP: số kết nối treo}"""
+        previous = self.tracked
+        elapsed = now - self.last_poll if self.last_poll is not None else 0.0
+        fast = max_rate * elapsed
+        tracked = {}
+        stalled = defaultdict(int)
+        connections = defaultdict(int)
+        for tuple_hash, (key, received, acked, waiting, window, idle) in sockets.items():
+            connections[key] += 1
+            total = received + acked
+            state = previous.get(tuple_hash)
+            if state is None:
+                # Kết nối mới (hoặc có trước lần đọc đầu): đo từ bây giờ
+                tracked[tuple_hash] = [now, total, 0]
+                continue
+            tracked[tuple_hash] = state
+            delta = total - state[_BYTES]
+            state[_BYTES] = total
+            small_window = waiting and window is not None and window < min_window
+            if (delta >= fast and not small_window) or (not waiting and idle >= min_age):
+                # Đang truyền bình thường hoặc rảnh hẳn: bắt đầu lại khoảng đo
+                state[_START] = now
+                state[_TRICKLES] = 0
+                continue
+            if delta > 0:
+                state[_TRICKLES] += 1
+            if now - state[_START] >= min_age and (waiting or state[_TRICKLES] >= 2):
+                stalled[key] += 1
+        # Kết nối đã đóng rơi khỏi tracked
+        self.tracked = tracked
+        self.stalled = stalled
+        self.connections = connections
+        self.last_poll = now
+        return stalled
+
+    def total_stalled(self):
+        return sum(self.stalled.values())
+
+    def __len__(self):
+        return len(self.tracked)
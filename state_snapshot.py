@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Snapshot trạng thái detector để khởi động nóng
+
+File nhị phân gọn:
+- MAGIC, độ dài (uint32) + header JSON: thời điểm lưu, time_window,
+  window_buckets, conn_signal, thứ tự byte, các entry đang bị chặn và danh
+  sách bộ đếm (tên, số khoá)
+- phần thân nén zlib: với mỗi bộ đếm cửa sổ trượt lần lượt các mảng
+  64 bit thấp của khoá, 64 bit kế tiếp, tổng trong cửa sổ (uint64), bit IPv6
+  (uint8), epoch, epoch cộng cuối (int64) và counts (uint32 x buckets mỗi khoá)
+
+Đọc / ghi chỉ là array.frombytes / tobytes nên 100k khoá mất cỡ vài chục ms.
+capture_snapshot() chỉ sao chép trạng thái (gọi khi giữ khoá của detector);
+write_snapshot() nén và ghi đĩa, chạy được ở thread khác. File được thay
+nguyên tử (file tạm + rename).
+"""
+
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b'FWSNAP1\n'
+VERSION = 1
+_LENGTH = struct.Struct('<I')
+_M64 = (1 << 64) - 1
+
+
+def _pack_counter(keys, totals, epochs, lasts, counts):
+    low = array('Q', [key & _M64 for key in keys])
+    high = array('Q', [(key >> 64) & _M64 for key in keys])
+    flags = bytes(key >> 128 for key in keys)
+    return [low.tobytes(), high.tobytes(), totals.tobytes(), flags, epochs.tobytes(),
+            lasts.tobytes(), counts.tobytes()]
+
+
+def capture_snapshot(saved, time_window, buckets, blocked, counters, conn_signal='level'):
+    """Bản sao (header, mảng của từng bộ đếm) của trạng thái; counters: {tên: SlidingWindowCounter}"""
+    header = {
+        'version': VERSION,
+        'saved': saved,
+        'time_window': time_window,
+        'window_buckets': buckets,
+        'conn_signal': conn_signal,
+        'byteorder': sys.byteorder,
+        'blocked': sorted(blocked),
+        'counters': [[name, len(counter)] for name, counter in counters.items()],
+    }
+    return header, [counter.export_arrays() for counter in counters.values()]
+
+
+def write_snapshot(path, snapshot):
+    """Nén và ghi snapshot từ capture_snapshot(), trả về số byte đã ghi"""
+    header, arrays = snapshot
+    body = []
+    for exported in arrays:
+        body.extend(_pack_counter(*exported))
+    head = json.dumps(header).encode()
+    data = b''.join([MAGIC, _LENGTH.pack(len(head)), head, zlib.compress(b''.join(body), 1)])
+
+    tmp = path + '.tmp'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(data)
+
+
+def read_snapshot(path):
+    """(header, {tên: (khoá, tổng, epoch, epoch cộng cuối, counts)}); ValueError nếu file hỏng
+
+    FileNotFoundError nếu chưa có snapshot.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("không phải file snapshot")
+    pos = len(MAGIC)
+    if len(data) < pos + _LENGTH.size:
+        raise ValueError("header bị cắt")
+    (length,) = _LENGTH.unpack_from(data, pos)
+    pos += _LENGTH.size
+    if len(data) < pos + length:
+        raise ValueError("header bị cắt")
+    header = json.loads(data[pos:pos + length])
+    if not isinstance(header, dict):
+        raise ValueError("header không hợp lệ")
+    if header.get('version') != VERSION:
+        raise ValueError(f"phiên bản snapshot {header.get('version')} không hỗ trợ")
+    try:
+        body = zlib.decompress(data[pos + length:])
+    except zlib.error as e:
+        raise ValueError(f"phần thân hỏng: {e}")
+
+    swap = header['byteorder'] != sys.byteorder
+    buckets = header['window_buckets']
+    offset = 0
+
+    def take(typecode, count):
+        nonlocal offset
+        values = array(typecode)
+        size = values.itemsize * count
+        if offset + size > len(body):
+            raise ValueError("phần thân bị cắt")
+        values.frombytes(body[offset:offset + size])
+        offset += size
+        if swap:
+            values.byteswap()
+        return values
+
+    counters = {}
+    for name, count in header['counters']:
+        low, high, totals = take('Q', count), take('Q', count), take('Q', count)
+        flags = take('B', count)
+        epochs, lasts = take('q', count), take('q', count)
+        counts = take('I', count * buckets)
+        keys = [flag << 128 | hi << 64 | lo for lo, hi, flag in zip(low, high, flags)]
+        counters[name] = (keys, totals, epochs, lasts, counts)
+    return header, counters
@@ -4,19 +4,22 @@ from tkinter import ttk, messagebox
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.dates as mdates
-from datetime import datetime, timedelta
-import json
-import subprocess
+from datetime import datetime
 from collections import defaultdict, deque
 import threading
 import time
-import os
+
+from socket_collector import get_collector
+from ip_core import format_ip
+from alert_store import AlertReader
 
 class StatisticsTab:
-    def __init__(self, parent):
+    def __init__(self, parent, collector_backend='proc'):
         self.parent = parent
+        self.collector = get_collector(collector_backend)
         self.connection_data = deque(maxlen=100)  # Lưu 100 điểm dữ liệu
         self.alert_data = deque(maxlen=50)       # Lưu 50 cảnh báo
+        self.alert_reader = AlertReader()
         self.ip_connections = defaultdict(int)
         
         self.setup_matplotlib()
@@ -102,20 +105,12 @@ class StatisticsTab:
     def collect_connection_stats(self):
         """Thu thập thống kê kết nối"""
         try:
-            result = subprocess.run(['ss', '-tn'], capture_output=True, text=True)
-            connection_count = 0
+            _, conn_stats = self.collector.collect()
+            connection_count = self.collector.last_socket_count
             current_ips = defaultdict(int)
             
-            for line in result.stdout.split('\n'):
-                if 'ESTAB' in line or 'SYN-' in line:
-                    connection_count += 1
-                    parts = line.split()
-                    # phần địa chỉ thường ở cột 4 hoặc 5 tùy output, cố gắng lấy cột cuối
-                    if len(parts) >= 1:
-                        ipport = parts[-1]
-                        ip = ipport.split(':')[0]
-                        if self.is_valid_ip(ip):
-                            current_ips[ip] += 1
+            for key, count in conn_stats.items():
+                current_ips[format_ip(key)] += count
             
             # Cập nhật dữ liệu
             timestamp = datetime.now()
@@ -128,28 +123,19 @@ class StatisticsTab:
     def collect_alerts(self):
         """Thu thập cảnh báo từ file log"""
         try:
-            alert_file = '/var/log/firewall_alerts.json'
-            if os.path.exists(alert_file):
-                with open(alert_file, 'r') as f:
-                    try:
-                        alerts = json.load(f)
-                    except json.JSONDecodeError:
-                        alerts = []
+            # Chỉ đọc phần mới ghi thêm của file alert kể từ lần trước
+            for alert in self.alert_reader.poll()[-10:]:
+                ts = alert.get('timestamp')
+                ip = alert.get('ip')
+                reason = alert.get('reason', '')
+                try:
+                    alert_time = datetime.fromtimestamp(int(ts)) if ts else datetime.now()
+                except Exception:
+                    alert_time = datetime.now()
+                alert_text = f"{alert_time.strftime('%Y-%m-%d %H:%M:%S')} - {ip} - {reason}\n"
                 
-                # Chỉ lấy alerts mới (10 gần nhất)
-                for alert in alerts[-10:]:
-                    # chấp nhận alert có 'timestamp','ip','reason' hoặc ko
-                    ts = alert.get('timestamp') if isinstance(alert, dict) else None
-                    ip = alert.get('ip') if isinstance(alert, dict) else str(alert)
-                    reason = alert.get('reason', '') if isinstance(alert, dict) else ''
-                    try:
-                        alert_time = datetime.fromtimestamp(int(ts)) if ts else datetime.now()
-                    except Exception:
-                        alert_time = datetime.now()
-                    alert_text = f"{alert_time.strftime('%Y-%m-%d %H:%M:%S')} - {ip} - {reason}\n"
-                    
-                    if alert_text not in self.alert_data:
-                        self.alert_data.append(alert_text)
+                if alert_text not in self.alert_data:
+                    self.alert_data.append(alert_text)
         except Exception as e:
             print(f"Lỗi thu thập cảnh báo: {e}")
     
@@ -265,14 +251,3 @@ class StatisticsTab:
             
         except Exception as e:
             messagebox.showerror("Lỗi", f"Không thể xuất báo cáo: {e}")
-    
-    def is_valid_ip(self, ip):
-        """Kiểm tra IP hợp lệ"""
-        parts = ip.split('.')
-        if len(parts) != 4:
-            return False
-        try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError:
-            return False
-
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Đo tốc độ gói SYN theo IP nguồn ở mức gói tin
+
+Mở socket AF_PACKET có gắn bộ lọc BPF cổ điển (chỉ TCP SYN không ACK, bỏ
+gói đi ra), nhận gói qua ring buffer PACKET_MMAP (TPACKET_V2) và cộng dồn
+số SYN theo IP nguồn trong một thread nền. Chế độ đọc file pcap dùng cùng
+logic lọc để thử nghiệm mà không cần interface thật.
+"""
+
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import threading
+import time
+import logging
+from collections import defaultdict
+
+from ip_core import from_packed
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V2 = 1
+SO_ATTACH_FILTER = 26
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket2_hdr: status, len, snaplen, mac, net, sec, nsec, vlan_tci, vlan_tpid
+_TPACKET2_HDR = struct.Struct('=IIIHHIIHH4x')
+_TP_STATUS = struct.Struct('=I')
+
+# Số byte đầu gói được copy vào ring: đủ cho header IPv6 + TCP
+CAPTURE_SNAPLEN = 96
+
+_SKF_AD_PROTOCOL = 0xfffff000
+_SKF_AD_PKTTYPE = 0xfffff004
+_PACKET_OUTGOING = 4
+
+# Tương đương `tcp[tcpflags] & (tcp-syn|tcp-ack) == tcp-syn` cho IPv4 và IPv6,
+# áp dụng trên socket SOCK_DGRAM nên offset tính từ đầu header IP.
+# Mỗi lệnh: (code, jt, jf, k)
+SYN_FILTER = [
+    (0x20, 0, 0, _SKF_AD_PKTTYPE),   # 0: ld pkttype
+    (0x15, 16, 0, _PACKET_OUTGOING), # 1: jeq OUTGOING -> drop
+    (0x20, 0, 0, _SKF_AD_PROTOCOL),  # 2: ld proto
+    (0x15, 0, 8, ETH_P_IP),          # 3: jeq IPv4 ? 4 : 12
+    (0x30, 0, 0, 9),                 # 4: ldb [9]      (protocol)
+    (0x15, 0, 12, 6),                # 5: jeq TCP ? 6 : drop
+    (0x28, 0, 0, 6),                 # 6: ldh [6]      (flags + fragment offset)
+    (0x45, 10, 0, 0x1fff),           # 7: jset fragment -> drop
+    (0xb1, 0, 0, 0),                 # 8: ldxb 4*([0]&0xf)
+    (0x50, 0, 0, 13),                # 9: ldb [x+13]   (TCP flags)
+    (0x54, 0, 0, 0x12),              # 10: and SYN|ACK
+    (0x15, 7, 6, 0x02),              # 11: jeq SYN ? accept : drop
+    (0x15, 0, 5, ETH_P_IPV6),        # 12: jeq IPv6 ? 13 : drop
+    (0x30, 0, 0, 6),                 # 13: ldb [6]     (next header)
+    (0x15, 0, 3, 6),                 # 14: jeq TCP ? 15 : drop
+    (0x30, 0, 0, 53),                # 15: ldb [53]    (TCP flags)
+    (0x54, 0, 0, 0x12),              # 16: and SYN|ACK
+    (0x15, 1, 0, 0x02),              # 17: jeq SYN ? accept : drop
+    (0x06, 0, 0, 0),                 # 18: drop
+    (0x06, 0, 0, CAPTURE_SNAPLEN),   # 19: accept
+]
+
+
+def syn_source(packet):
+    """Trả về khoá IP nguồn nếu packet (bắt đầu từ header IP) là TCP SYN không ACK"""
+    if len(packet) < 20:
+        return None
+    version = packet[0] >> 4
+    if version == 4:
+        ihl = (packet[0] & 0x0f) * 4
+        if packet[9] != 6 or (struct.unpack_from('!H', packet, 6)[0] & 0x1fff):
+            return None
+        if len(packet) < ihl + 14:
+            return None
+        if packet[ihl + 13] & 0x12 != 0x02:
+            return None
+        return int.from_bytes(packet[12:16], 'big')
+    if version == 6:
+        if len(packet) < 54 or packet[6] != 6:
+            return None
+        if packet[53] & 0x12 != 0x02:
+            return None
+        return from_packed(bytes(packet[8:24]))
+    return None
+
+
+def _network_offset(linktype, frame):
+    """Vị trí header IP trong frame theo linktype của pcap, None nếu không hỗ trợ"""
+    if linktype == 1:          # Ethernet
+        offset, ethertype = 14, struct.unpack_from('!H', frame, 12)[0]
+        while ethertype in (0x8100, 0x88a8) and len(frame) >= offset + 4:
+            ethertype = struct.unpack_from('!H', frame, offset + 2)[0]
+            offset += 4
+        return offset if ethertype in (ETH_P_IP, ETH_P_IPV6) else None
+    if linktype == 113:        # Linux cooked (SLL)
+        return 16
+    if linktype == 276:        # Linux cooked v2 (SLL2)
+        return 20
+    if linktype in (12, 101):  # Raw IP
+        return 0
+    if linktype == 0:          # BSD loopback
+        return 4
+    return None
+
+
+def iter_pcap_syns(path):
+    """Đọc file pcap, sinh (timestamp, khoá IP nguồn) cho mỗi gói SYN"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            return
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        else:
+            raise ValueError(f"{path} không phải file pcap")
+        nano = magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0fffffff
+        record = struct.Struct(endian + 'IIII')
+        divisor = 1e9 if nano else 1e6
+
+        while True:
+            raw = f.read(record.size)
+            if len(raw) < record.size:
+                return
+            sec, frac, incl_len, _ = record.unpack(raw)
+            frame = f.read(incl_len)
+            offset = _network_offset(linktype, frame)
+            if offset is None:
+                continue
+            ip = syn_source(frame[offset:])
+            if ip is not None:
+                yield sec + frac / divisor, ip
+
+
+class SynCapture:
+    """Đếm SYN theo IP nguồn liên tục trong thread nền
+
+    interface: tên interface (None = mọi interface)
+    pcap_path: đọc từ file pcap thay vì socket thật
+    realtime: với pcap, phát lại theo đúng nhịp thời gian trong file
+    """
+
+    def __init__(self, interface=None, pcap_path=None, realtime=False,
+                 block_size=1 << 20, block_nr=16, frame_size=256):
+        self.interface = interface
+        self.pcap_path = pcap_path
+        self.realtime = realtime
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.frame_size = frame_size
+
+        self.packets = 0
+        self.last_rates = {}
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_drain = time.time()
+        self._sock = None
+        self._ring = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.pcap_path:
+            target = self._run_pcap
+        else:
+            self._open_socket()
+            target = self._run_ring
+        self._stop.clear()
+        self._thread = threading.Thread(target=target, name='syn-capture', daemon=True)
+        self._thread.start()
+        logging.info(f"Bắt đầu đếm SYN từ {self.pcap_path or self.interface or 'mọi interface'}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def is_finished(self):
+        """Với chế độ pcap: đã đọc hết file"""
+        return self._thread is None or not self._thread.is_alive()
+
+    def drain(self):
+        """Lấy số SYN theo khoá IP nguồn kể từ lần drain trước và đặt lại bộ đếm"""
+        now = time.time()
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+        elapsed = max(now - self._last_drain, 1e-6)
+        self._last_drain = now
+        self.last_rates = {ip: count / elapsed for ip, count in counts.items()}
+        return counts
+
+    def _add(self, ip):
+        with self._lock:
+            self._counts[ip] += 1
+        self.packets += 1
+
+    # ---------- AF_PACKET + PACKET_MMAP ----------
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+        try:
+            program = b''.join(struct.pack('HBBI', *ins) for ins in SYN_FILTER)
+            buf = ctypes.create_string_buffer(program, len(program))
+            fprog = struct.pack('HL', len(SYN_FILTER), ctypes.addressof(buf))
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+            frame_nr = self.block_size // self.frame_size * self.block_nr
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                            struct.pack('IIII', self.block_size, self.block_nr,
+                                        self.frame_size, frame_nr))
+            self._ring = mmap.mmap(sock.fileno(), self.block_size * self.block_nr,
+                                   mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if self.interface:
+                sock.bind((self.interface, ETH_P_ALL))
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._frame_nr = frame_nr
+
+    def _run_ring(self):
+        ring = self._ring
+        frames_per_block = self.block_size // self.frame_size
+        poller = select.poll()
+        poller.register(self._sock.fileno(), select.POLLIN | select.POLLERR)
+        index = 0
+
+        while not self._stop.is_set():
+            offset = (index // frames_per_block) * self.block_size \
+                + (index % frames_per_block) * self.frame_size
+            status = _TP_STATUS.unpack_from(ring, offset)[0]
+            if not status & TP_STATUS_USER:
+                poller.poll(500)
+                continue
+
+            _, _, snaplen, _, net = _TPACKET2_HDR.unpack_from(ring, offset)[:5]
+            start = offset + net
+            ip = syn_source(ring[start:start + snaplen])
+            if ip is not None:
+                self._add(ip)
+
+            _TP_STATUS.pack_into(ring, offset, TP_STATUS_KERNEL)
+            index = (index + 1) % self._frame_nr
+
+    # ---------- pcap ----------
+    def _run_pcap(self):
+        first_ts = None
+        started = time.time()
+        try:
+            for ts, ip in iter_pcap_syns(self.pcap_path):
+                if self._stop.is_set():
+                    return
+                if self.realtime:
+                    if first_ts is None:
+                        first_ts = ts
+                    delay = (ts - first_ts) - (time.time() - started)
+                    if delay > 0:
+                        self._stop.wait(delay)
+                self._add(ip)
+        except (OSError, ValueError) as e:
+            logging.error(f"Lỗi đọc pcap {self.pcap_path}: {e}")
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Các module nằm phẳng ở thư mục gốc của repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def config():
+    """CONFIG của auto_block không đụng tới hệ thống, khôi phục sau mỗi test"""
+    from auto_block import CONFIG
+    saved = dict(CONFIG)
+    CONFIG.update(syn_source='snapshot', conn_signal='level', shard_workers=0,
+                  ban_state_file=None, state_snapshot_file=None, drop_stats_file=None,
+                  slow_conn_ports=[], whitelist=[], blocklist=[], adaptive_interval=False,
+                  metrics_port=0, metrics_socket=None)
+    yield CONFIG
+    CONFIG.clear()
+    CONFIG.update(saved)
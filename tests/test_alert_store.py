@@ -0,0 +1,139 @@
+import json
+import os
+
+import pytest
+
+import alert_store
+from alert_store import AlertReader, AlertWriter
+
+
+def alert(ts, ip='10.0.0.1'):
+    return {'timestamp': ts, 'ip': ip, 'reason': 'test', 'action': 'BLOCKED'}
+
+
+def write(path, timestamps, **options):
+    options.setdefault('max_bytes', 0)
+    options.setdefault('max_age', 0)
+    writer = AlertWriter(str(path), fsync='always', **options)
+    for ts in timestamps:
+        writer.append(alert(ts))
+    writer.close()
+    return writer
+
+
+def times(alerts):
+    return [a['timestamp'] for a in alerts]
+
+
+def test_rotates_by_size_and_keeps_backups(tmp_path):
+    path = tmp_path / 'alerts.json'
+    line = len(json.dumps(alert(0)).encode()) + 1
+    # Mỗi file chứa 4 alert
+    write(path, range(20), max_bytes=4 * line, backups=2)
+    assert sorted(os.listdir(tmp_path)) == ['alerts.json', 'alerts.json.1', 'alerts.json.1.idx',
+                                            'alerts.json.2', 'alerts.json.2.idx', 'alerts.json.idx']
+    reader = AlertReader(str(path), backups=2)
+    assert times(reader.since(0)) == list(range(8, 20))
+
+
+def test_rotates_by_age(tmp_path):
+    path = tmp_path / 'alerts.json'
+    write(path, [0, 50, 99, 100, 150, 210], max_age=100, backups=5)
+    assert times(AlertReader(str(path))._read_from(str(path), 0)) == [210]
+    assert times(AlertReader(str(path))._read_from(str(path) + '.1', 0)) == [100, 150]
+    assert times(AlertReader(str(path))._read_from(str(path) + '.2', 0)) == [0, 50, 99]
+
+
+@pytest.mark.parametrize('since, expected', [
+    (0, list(range(0, 20))),
+    (5, list(range(5, 20))),
+    (11.5, list(range(12, 20))),
+    (19, [19]),
+    (20, []),
+])
+def test_since_reads_across_rotated_files(tmp_path, since, expected):
+    path = tmp_path / 'alerts.json'
+    line = len(json.dumps(alert(0)).encode()) + 1
+    write(path, range(20), max_bytes=3 * line, backups=10)
+    reader = AlertReader(str(path), backups=10)
+    assert times(reader.since(since)) == expected
+    assert times(reader.since(since, limit=2)) == expected[-2:]
+
+
+@pytest.mark.parametrize('limit', [1, 3, 7, 20, 50])
+def test_recent_reads_across_rotated_files(tmp_path, limit):
+    path = tmp_path / 'alerts.json'
+    line = len(json.dumps(alert(0)).encode()) + 1
+    write(path, range(20), max_bytes=3 * line, backups=10)
+    assert times(AlertReader(str(path), backups=10).recent(limit)) == list(range(19, -1, -1))[:limit]
+
+
+def test_poll_follows_rotation_without_losing_alerts(tmp_path):
+    path = tmp_path / 'alerts.json'
+    line = len(json.dumps(alert(0)).encode()) + 1
+    writer = AlertWriter(str(path), max_bytes=4 * line, max_age=0, backups=3, fsync='always')
+    reader = AlertReader(str(path), backups=3)
+    assert reader.poll() == []
+    seen = []
+    for ts in range(10):
+        writer.append(alert(ts))
+        if ts % 3 == 0:
+            seen += times(reader.poll())
+    writer.close()
+    seen += times(reader.poll())
+    assert seen == list(range(10))
+    assert reader.poll() == []
+
+
+def test_truncated_last_line_is_skipped_then_repaired(tmp_path):
+    path = tmp_path / 'alerts.json'
+    write(path, [1, 2])
+    with open(path, 'ab') as f:
+        f.write(b'{"timestamp": 3, "ip": "10.0')
+    reader = AlertReader(str(path))
+    assert times(reader.since(0)) == [1, 2]
+    assert times(reader.recent(10)) == [2, 1]
+    assert times(reader.poll()) == [1, 2]
+
+    # Lần mở sau cắt phần ghi dở, alert mới không bị dính vào dòng hỏng
+    write(path, [4])
+    assert path.read_bytes().endswith(b'\n')
+    assert times(reader.since(0)) == [1, 2, 4]
+    assert times(reader.poll()) == [4]
+
+
+@pytest.mark.parametrize('damage', ['missing', 'stale'])
+def test_index_is_rebuilt_when_missing_or_stale(tmp_path, monkeypatch, damage):
+    monkeypatch.setattr(alert_store, 'INDEX_STRIDE', 2)
+    path = tmp_path / 'alerts.json'
+    index = tmp_path / 'alerts.json.idx'
+    write(path, range(5))
+    if damage == 'missing':
+        index.unlink()
+    else:
+        index.write_bytes(b'0 0\n3 999999\n')
+    write(path, [5])
+
+    ts_list, offsets = alert_store._load_index(str(path))
+    # 5 alert cũ: dòng chỉ mục ở alert 0, 2, 4; lô mới thêm một dòng
+    assert ts_list == [0, 2, 4, 5]
+    data = path.read_bytes()
+    for ts, offset in zip(ts_list, offsets):
+        assert json.loads(data[offset:data.index(b'\n', offset)])['timestamp'] == ts
+    assert times(AlertReader(str(path)).since(3)) == [3, 4, 5]
+
+
+def test_valid_index_is_not_rebuilt(tmp_path, monkeypatch):
+    path = tmp_path / 'alerts.json'
+    write(path, range(3))
+    monkeypatch.setattr(alert_store, '_rebuild_index', lambda *_: pytest.fail('dựng lại chỉ mục'))
+    write(path, [3])
+    assert times(AlertReader(str(path)).since(0)) == [0, 1, 2, 3]
+
+
+def test_legacy_json_array_is_migrated(tmp_path):
+    path = tmp_path / 'alerts.json'
+    path.write_text(json.dumps([alert(1), alert(2)]))
+    assert times(AlertReader(str(path)).recent(5)) == [2, 1]
+    write(path, [3])
+    assert times(AlertReader(str(path)).since(0)) == [1, 2, 3]
@@ -0,0 +1,155 @@
+from auto_block import DosDetector
+from ban_manager import BanManager
+from drop_counters import DropMonitor
+from firewall_backend import MemoryBlocklist
+from ip_core import parse_ip
+from replay import FeedCollector, MemoryAlerts, VirtualClock, simulate_drops
+
+
+def run(config, samples, cycles, interval=10):
+    """Chạy chu kỳ như replay; samples(t) trả về (syn, kết nối) của chu kỳ kết thúc ở t"""
+    config.update(check_interval=interval, syn_threshold=50, conn_threshold=100,
+                  ban_durations=[60], drop_poll_interval=interval,
+                  ban_extend_min_pps=1.0, ban_extend_step=60,
+                  prefix_syn_thresholds={24: 200}, prefix_conn_thresholds={},
+                  prefix_syn_thresholds_v6={}, prefix_conn_thresholds_v6={}, prefix_min_sources=5)
+    clock = VirtualClock(1000.0)
+    feed = FeedCollector()
+    alerts = MemoryAlerts()
+    blocklist = MemoryBlocklist(clock)
+    detector = DosDetector(collector=feed, blocklist=blocklist, alerts=alerts, clock=clock,
+                           watch_config=False)
+    for _ in range(cycles):
+        clock.now += interval
+        feed.sample = samples(clock.now - 1000.0)
+        simulate_drops(blocklist, feed.sample)
+        syn_stats, conn_stats, new_stats = detector.get_network_stats()
+        detector.update_stats(syn_stats, conn_stats, new_stats)
+        detector.clean_old_records()
+        detector.expire_bans()
+        detector.poll_drops()
+        detector.detect()
+        detector.commit_blocks()
+    return [(alert['timestamp'] - 1000.0, alert['action'], alert['ip']) for alert in alerts.alerts]
+
+
+def actions(history, entry):
+    return [(t, action) for t, action, ip in history if ip == entry]
+
+
+def test_syn_only_attacker_is_extended_while_flooding(config):
+    attacker = parse_ip('203.0.113.9')
+    history = run(config, lambda t: ({attacker: 100} if t <= 300 else {}, {}), 50)
+
+    events = actions(history, '203.0.113.9')
+    assert [action for _, action in events].count('BLOCKED') == 1
+    assert any(action == 'EXTENDED' for _, action in events)
+    # Chỉ hết hạn sau khi lưu lượng dừng, không gỡ rồi chặn lại giữa chừng
+    unblocked = [t for t, action in events if action == 'UNBLOCKED']
+    assert len(unblocked) == 1 and unblocked[0] > 300
+
+
+def test_blocked_prefix_is_extended_from_member_traffic(config):
+    sources = {parse_ip(f'198.51.100.{host}'): 45 for host in range(1, 11)}
+    history = run(config, lambda t: (dict(sources) if t <= 300 else {}, {}), 50)
+
+    events = actions(history, '198.51.100.0/24')
+    assert [action for _, action in events].count('BLOCKED') == 1
+    assert any(action == 'EXTENDED' for _, action in events)
+    unblocked = [t for t, action in events if action == 'UNBLOCKED']
+    assert len(unblocked) == 1 and unblocked[0] > 300
+
+
+def test_simulate_drops_matches_host_then_containing_prefix():
+    blocklist = MemoryBlocklist(VirtualClock())
+    blocklist.entries = {'10.0.0.5': None, '10.0.0.0/24': None}
+    simulate_drops(blocklist, ({parse_ip('10.0.0.5'): 3, parse_ip('10.0.0.7'): 4},
+                               {parse_ip('10.0.0.7'): 2, parse_ip('10.0.1.1'): 9}))
+    assert blocklist.drops == {'10.0.0.5': [3, 0], '10.0.0.0/24': [4, 0]}
+
+
+def test_drop_monitor_rates_and_counter_reset():
+    drops = DropMonitor()
+    drops.update({'a': (100, 1000)}, 0)
+    assert drops.rate('a') == 0.0
+    drops.update({'a': (400, 4000)}, 10)
+    assert drops.rate('a') == 30.0
+    # Bộ đếm giảm: entry bị gỡ rồi chặn lại, đếm lại từ 0
+    drops.update({'a': (50, 500)}, 20)
+    assert drops.rate('a') == 5.0
+    assert drops.dropped_packets == 350
+
+
+def test_extend_never_shortens_ban():
+    bans = BanManager([60])
+    bans.ban('x', 0, 60)
+    assert not bans.extend('x', 30)
+    assert bans.extend('x', 120)
+    assert bans.expire(100) == []
+    assert bans.expire(120) == ['x']
+    assert not bans.extend('x', 500)
+
+
+class LockedIptables(MemoryBlocklist):
+    """Như IptablesBlocklist: không tự hết hạn, xoá lỗi khi khoá xtables đang bị giữ"""
+    timeouts = False
+
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.locked = True
+
+    def apply(self, adds, removes):
+        if not self.locked:
+            return super().apply(adds, removes)
+        results = super().apply(adds, [])
+        results.update({entry: (False, 'Another app is currently holding the xtables lock')
+                        for entry in removes})
+        return results
+
+
+def detector_with(config, blocklist, clock):
+    config.update(ban_durations=[60], ban_extend_min_pps=0)
+    return DosDetector(collector=FeedCollector(), blocklist=blocklist, alerts=MemoryAlerts(),
+                       clock=clock, watch_config=False)
+
+
+def test_failed_unblock_is_kept_and_retried(config):
+    clock = VirtualClock(1000.0)
+    blocklist = LockedIptables(clock)
+    detector = detector_with(config, blocklist, clock)
+    detector.block_ip('203.0.113.9', 'test')
+    assert detector.is_blocked(parse_ip('203.0.113.9'))
+
+    clock.now += 61
+    detector.expire_bans()
+    detector.commit_blocks()
+    # Rule vẫn còn trong firewall: vẫn theo dõi và vẫn có hạn chặn
+    assert '203.0.113.9' in blocklist.entries
+    assert detector.is_blocked(parse_ip('203.0.113.9'))
+    assert detector.bans.is_banned('203.0.113.9')
+    assert not any(alert['action'] == 'UNBLOCKED' for alert in detector.alerts.alerts)
+
+    blocklist.locked = False
+    clock.now += 1
+    detector.expire_bans()
+    detector.commit_blocks()
+    assert '203.0.113.9' not in blocklist.entries
+    assert not detector.is_blocked(parse_ip('203.0.113.9'))
+    assert not detector.bans.is_banned('203.0.113.9')
+    assert [alert['action'] for alert in detector.alerts.alerts] == ['BLOCKED', 'UNBLOCKED']
+
+
+def test_unblock_of_missing_entry_counts_as_done(config):
+    clock = VirtualClock(1000.0)
+    blocklist = LockedIptables(clock)
+    blocklist.locked = False
+    detector = detector_with(config, blocklist, clock)
+    detector.block_ip('203.0.113.9', 'test')
+    # Rule đã bị xoá tay ngoài daemon
+    del blocklist.entries['203.0.113.9']
+
+    clock.now += 61
+    detector.expire_bans()
+    detector.commit_blocks()
+    assert not detector.is_blocked(parse_ip('203.0.113.9'))
+    assert not detector.bans.is_banned('203.0.113.9')
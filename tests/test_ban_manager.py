@@ -0,0 +1,138 @@
+import json
+
+from ban_manager import BanManager, format_duration
+from timer_wheel import TimerWheel
+
+
+def test_timer_cascades_from_upper_level_and_expires_on_its_tick():
+    wheel = TimerWheel(slots=64, levels=4)
+    wheel.schedule('k', 100)
+    assert wheel._where['k'][0] == 1
+    assert wheel.advance(63) == []
+    # Ô tầng 1 được rải xuống khi kim tầng 0 quay hết vòng
+    assert wheel.advance(64) == []
+    assert wheel._where['k'][0] == 0
+    assert wheel.advance(99.9) == []
+    assert wheel.advance(100) == ['k']
+    assert len(wheel) == 0
+
+
+def test_timer_cascades_through_two_levels():
+    wheel = TimerWheel(slots=64, levels=4)
+    wheel.schedule('k', 5000)
+    assert wheel._where['k'][0] == 2
+    assert wheel.advance(4999) == []
+    assert wheel.advance(5000) == ['k']
+
+
+def test_timer_beyond_wheel_range_is_parked_and_replaced():
+    # Tầm của bánh xe: 4**2 = 16 tick
+    wheel = TimerWheel(slots=4, levels=2)
+    wheel.schedule('far', 40)
+    wheel.schedule('near', 3)
+    assert wheel.advance(3) == ['near']
+    assert wheel.advance(39) == []
+    assert wheel.advance(40) == ['far']
+
+
+def test_timer_rounds_deadline_up_to_a_tick_and_reschedules():
+    wheel = TimerWheel()
+    wheel.schedule('k', 10.2)
+    assert wheel.deadline('k') == 11
+    assert wheel.advance(10.9) == []
+    wheel.schedule('k', 20)
+    assert wheel.advance(11) == []
+    assert wheel.cancel('k') and not wheel.cancel('k')
+    assert wheel.advance(30) == []
+
+
+def test_timer_in_the_past_expires_on_next_advance():
+    wheel = TimerWheel(now=50)
+    wheel.schedule('k', 10)
+    assert 'k' in wheel
+    assert wheel.advance(50) == ['k']
+
+
+def test_rebans_escalate_through_durations_and_reset():
+    bans = BanManager([300, 3600, 86400], forget_after=7 * 86400)
+    expected = [(300, 1), (3600, 2), (86400, 3), (86400, 4)]
+    now = 0
+    for duration, offense in expected:
+        assert bans.next_duration('x', now) == duration
+        assert bans.ban('x', now, duration) == offense
+        now += duration
+        assert bans.expire(now) == ['x']
+    # Quá forget_after kể từ lần vi phạm cuối: quay về mức đầu
+    now += 7 * 86400 + 1
+    assert bans.next_duration('x', now) == 300
+    assert bans.ban('x', now, 300) == 1
+    assert bans.next_duration('other', now) == 300
+
+
+def test_empty_durations_mean_permanent_bans():
+    bans = BanManager([])
+    assert bans.next_duration('x', 0) == 0
+    assert bans.ban('x', 0, 0) == 1
+    assert not bans.is_banned('x')
+    assert bans.expire(10 ** 6) == []
+
+
+def test_ban_state_survives_restart(tmp_path):
+    path = str(tmp_path / 'bans.json')
+    bans = BanManager([300, 3600], forget_after=10000, state_path=path, now=-20000)
+    bans.ban('10.0.0.1', 0, 300)
+    bans.ban('10.0.0.1', 300, 3600)
+    bans.ban('10.0.0.0/24', 100, 300)
+    bans.ban('old', -20000, 300)
+    bans.expire(400)
+    bans.save(400)
+    assert not bans.dirty
+    assert json.load(open(path))['bans'].keys() == {'10.0.0.1'}
+
+    restarted = BanManager([300, 3600], forget_after=10000, state_path=path, now=2000)
+    restarted.load(2000)
+    assert restarted.bans == {'10.0.0.1': (3900.0, 2)}
+    # Vi phạm của 'old' đã quá forget_after nên bị quên
+    assert restarted.offense_count('old', 2000) == 0
+    assert restarted.offense_count('10.0.0.1', 2000) == 2
+    assert restarted.next_duration('10.0.0.1', 2000) == 3600
+    assert restarted.expire(3899) == []
+    assert restarted.expire(3900) == ['10.0.0.1']
+
+
+def test_ban_expired_while_stopped_is_returned_on_first_expire(tmp_path):
+    path = str(tmp_path / 'bans.json')
+    bans = BanManager([300], state_path=path)
+    bans.ban('x', 0, 300)
+    bans.save(0)
+    restarted = BanManager([300], state_path=path, now=1000)
+    restarted.load(1000)
+    assert restarted.expire(1000) == ['x']
+
+
+def test_unreadable_ban_state_is_ignored(tmp_path):
+    path = tmp_path / 'bans.json'
+    path.write_text('{not json')
+    bans = BanManager([300], state_path=str(path))
+    bans.load(0)
+    assert len(bans) == 0
+    bans.state_path = str(tmp_path / 'missing.json')
+    bans.load(0)
+    assert len(bans) == 0
+
+
+def test_format_duration():
+    assert format_duration(300) == '5 phút'
+    assert format_duration(86400) == '1 ngày'
+    assert format_duration(90) == '90 giây'
+
+
+def test_retry_returns_entry_again_with_same_offense():
+    bans = BanManager([300, 3600])
+    bans.ban('x', 0, 300)
+    bans.ban('x', 300, 3600)
+    assert bans.expire(3900) == ['x']
+    bans.retry('x', 3900)
+    assert bans.bans['x'] == (3900, 2)
+    assert bans.expire(3901) == ['x']
+    assert not bans.is_banned('x')
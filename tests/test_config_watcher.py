@@ -0,0 +1,98 @@
+import logging
+
+import pytest
+
+from auto_block import CONFIG
+from config_watcher import CONFIG_CHOICES, coerce_config, load_config_file, save_config_file
+
+
+def test_default_config_is_valid():
+    assert coerce_config(dict(CONFIG), CONFIG) == CONFIG
+
+
+@pytest.mark.parametrize('key, value, expected', [
+    ('syn_threshold', '50', 50),
+    ('near_threshold_ratio', '0.5', 0.5),
+    ('adaptive_interval', 'off', False),
+    ('adaptive_interval', 'Yes', True),
+    ('adaptive_interval', 1, True),
+    ('ban_durations', ['300', 3600], [300, 3600]),
+    ('whitelist', [' 10.0.0.1 ', '', '10.0.0.0/8'], ['10.0.0.1', '10.0.0.0/8']),
+    ('prefix_syn_thresholds', {'24': '200', '16': 1000}, {24: 200, 16: 1000}),
+    ('ban_state_file', None, None),
+    ('detection_mode', ' both ', 'both'),
+    ('runtime', 'sync', 'sync'),
+])
+def test_values_are_coerced(key, value, expected):
+    assert coerce_config({key: value}, CONFIG) == {key: expected}
+
+
+@pytest.mark.parametrize('key, value', [
+    ('syn_threshold', 'many'),
+    ('syn_threshold', -1),
+    ('ban_durations', 300),
+    ('ban_durations', [300, 0]),
+    ('whitelist', '10.0.0.1'),
+    ('whitelist', [1]),
+    ('prefix_syn_thresholds', [24]),
+    ('prefix_syn_thresholds', {'24': -5}),
+    ('ban_state_file', 5),
+    ('check_interval', 0),
+])
+def test_invalid_types_are_rejected(key, value):
+    with pytest.raises(ValueError):
+        coerce_config({key: value}, CONFIG)
+
+
+@pytest.mark.parametrize('key', sorted(CONFIG_CHOICES))
+def test_choice_keys_accept_only_known_values(key):
+    for value in CONFIG_CHOICES[key]:
+        assert coerce_config({key: value}, CONFIG) == {key: value}
+    for value in ('', CONFIG_CHOICES[key][0].upper(), CONFIG_CHOICES[key][0] + 'x', None, 1):
+        with pytest.raises(ValueError, match=key):
+            coerce_config({key: value}, CONFIG)
+
+
+def test_choice_defaults_are_listed():
+    for key, choices in CONFIG_CHOICES.items():
+        assert CONFIG[key] in choices
+
+
+def test_unknown_keys_are_ignored(caplog):
+    with caplog.at_level(logging.WARNING):
+        assert coerce_config({'no_such_key': 1, 'syn_threshold': 5}, CONFIG) == {'syn_threshold': 5}
+    assert 'no_such_key' in caplog.text
+
+
+def test_non_object_is_rejected():
+    with pytest.raises(ValueError):
+        coerce_config([1, 2], CONFIG)
+
+
+def test_invalid_file_is_logged_and_ignored(tmp_path, caplog):
+    path = str(tmp_path / 'auto_block.conf')
+    save_config_file(path, {'syn_threshold': 80, 'detection_mode': 'anomally'})
+    with caplog.at_level(logging.ERROR):
+        assert load_config_file(path, CONFIG) is None
+    assert 'detection_mode' in caplog.text and 'anomally' in caplog.text
+
+    save_config_file(path, {'syn_threshold': '80', 'detection_mode': 'anomaly'})
+    assert load_config_file(path, CONFIG) == {'syn_threshold': 80, 'detection_mode': 'anomaly'}
+    assert load_config_file(str(tmp_path / 'missing.conf'), CONFIG) is None
+
+
+def test_hot_reload_keeps_running_config_on_typo(config, tmp_path):
+    from auto_block import DosDetector
+    from firewall_backend import MemoryBlocklist
+    from replay import FeedCollector, MemoryAlerts
+
+    path = str(tmp_path / 'auto_block.conf')
+    config['config_file'] = path
+    detector = DosDetector(collector=FeedCollector(), blocklist=MemoryBlocklist(),
+                           alerts=MemoryAlerts(), watch_config=False)
+    save_config_file(path, {'detection_mode': 'anomaly ', 'syn_threshold': 10})
+    assert detector.reload_config()
+    assert config['detection_mode'] == 'anomaly' and config['syn_threshold'] == 10
+    save_config_file(path, {'detection_mode': 'treshold', 'syn_threshold': 20})
+    assert not detector.reload_config()
+    assert config['detection_mode'] == 'anomaly' and config['syn_threshold'] == 10
@@ -0,0 +1,112 @@
+import math
+import random
+
+from heavy_hitters import CountMinSketch, HeavyHitterCounter, make_window_counter
+from sliding_window import SlidingWindowCounter
+
+A, B = 0x0A000001, 0x0A000002
+
+
+def test_count_min_never_underestimates_and_stays_within_bound():
+    sketch = CountMinSketch(60, 6, width=1024, depth=4)
+    rng = random.Random(7)
+    truth = {}
+    for _ in range(20000):
+        key = rng.randrange(1 << 32)
+        count = rng.randint(1, 5)
+        truth[key] = truth.get(key, 0) + count
+        sketch.add(key, count, 10)
+    total = sum(truth.values())
+    # Count-Min: sai số <= e*N/width với xác suất >= 1 - e^-depth cho mỗi key
+    bound = math.e * total / sketch.width
+    errors = [sketch.estimate(key, 10) - count for key, count in truth.items()]
+    assert min(errors) >= 0
+    assert sum(error > bound for error in errors) <= len(errors) * math.exp(-sketch.depth)
+
+
+def test_count_min_decays_bucket_by_bucket():
+    sketch = CountMinSketch(60, 6, width=64)
+    sketch.add(A, 5, 0)
+    sketch.add(A, 3, 30)
+    assert sketch.estimate(A, 59) == 8
+    # Bucket của t=0 trượt ra ở t=60, bucket của t=30 ở t=90
+    assert sketch.estimate(A, 60) == 3
+    assert sketch.estimate(A, 90) == 0
+    sketch.add(A, 2, 95)
+    assert sketch.estimate(A, 10 ** 9) == 0
+
+
+def test_count_min_conservative_update_returns_window_estimate():
+    sketch = CountMinSketch(60, 6, width=64)
+    assert sketch.add(A, 4, 0) == 4
+    assert sketch.add(A, 4, 15) == 8
+    assert sketch.add(B, 1, 15) >= 1
+
+
+def test_count_min_fits_memory_budget():
+    sketch = CountMinSketch.for_memory(60, 6, 64 * 1024, depth=4)
+    assert sketch.memory_bytes() <= 64 * 1024
+    assert sketch.width == 64 * 1024 // (4 * 4 * 7)
+
+
+def flood(counter, cycles, heavy, heavy_rate, spoofed, rng, start=0, interval=5):
+    """Mỗi chu kỳ: heavy gửi heavy_rate, spoofed nguồn giả mạo ngẫu nhiên mỗi nguồn 1"""
+    for cycle in range(cycles):
+        now = start + cycle * interval
+        counts = {rng.randrange(1 << 32): 1 for _ in range(spoofed)}
+        counts[heavy] = heavy_rate
+        counter.update(counts, now)
+    return now
+
+
+def test_planted_heavy_hitter_survives_spoofed_flood():
+    rng = random.Random(42)
+    heavy = (1 << 32) + 12345  # ngoài không gian khoá IPv4 giả mạo
+    counter = HeavyHitterCounter(60, 6, 64 * 1024, capacity=100, promote_at=20)
+    now = flood(counter, 12, heavy, 50, 5000, rng)
+    assert heavy in counter
+    # Số đếm chính xác từ lúc được nhận: đủ 12 chu kỳ trong cửa sổ 60s
+    assert counter.get(heavy, now) == 12 * 50
+    assert len(counter) <= 100
+    key, total, error = counter.top(1, now)[0]
+    assert key == heavy and total == 600 and error >= 0
+    assert counter.memory_bytes() <= 64 * 1024 + 100 * (6 * 4 + 64) + 100 * 64
+
+
+def test_space_saving_evicts_smallest_for_stronger_source():
+    rng = random.Random(3)
+    heavy = (1 << 32) + 1
+    # promote_at=1: mọi nguồn đều được nhận cho đến khi đầy
+    counter = HeavyHitterCounter(60, 6, 64 * 1024, capacity=50, promote_at=1)
+    counter.update({key: 1 for key in range(50)}, 0)
+    assert len(counter) == 50 and counter.evicted == 0
+    now = flood(counter, 4, heavy, 40, 200, rng, start=5)
+    assert heavy in counter
+    assert counter.evicted >= 1
+    assert counter.rejected > 0
+    assert len(counter) == 50
+    # Nguồn yếu không đẩy được nguồn mạnh ra
+    assert counter.get(heavy, now) == 4 * 40
+
+
+def test_expire_forgets_sources_and_their_error():
+    counter = HeavyHitterCounter(60, 6, 16 * 1024, capacity=10, promote_at=5)
+    counter.update({A: 10, B: 2}, 0)
+    assert A in counter and B not in counter
+    assert counter.errors == {A: 0}
+    counter.update({B: 4}, 10)
+    assert B in counter and counter.get(B, 10) == 4 and counter.errors[B] == 2
+    assert counter.expire(60) == 1
+    assert list(counter) == [B] and counter.errors == {B: 2}
+    counter.remove(B)
+    assert len(counter) == 0 and counter.errors == {}
+
+
+def test_make_window_counter_follows_counting_mode():
+    options = {'counting_mode': 'exact', 'time_window': 60, 'window_buckets': 6,
+               'hh_memory_bytes': 16 * 1024, 'hh_depth': 4, 'hh_capacity': 10,
+               'hh_promote_ratio': 0.5}
+    assert isinstance(make_window_counter(options, 100), SlidingWindowCounter)
+    counter = make_window_counter(dict(options, counting_mode='heavy_hitter'), 100)
+    assert isinstance(counter, HeavyHitterCounter)
+    assert counter.promote_at == 50 and counter.capacity == 10
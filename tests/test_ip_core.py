@@ -0,0 +1,86 @@
+import pytest
+
+from ip_core import (V4_MAX, V6_FLAG, AddressParser, address_bits, format_cidr, format_ip,
+                     from_packed, from_proc_hex, network_key, network_last, parse_ip, to_packed)
+
+
+@pytest.mark.parametrize('text, key', [
+    ('0.0.0.0', 0),
+    ('10.0.0.1', 0x0A000001),
+    ('255.255.255.255', V4_MAX),
+    (b'10.0.0.1', 0x0A000001),
+    ('::', V6_FLAG),
+    ('::1', V6_FLAG | 1),
+    ('2001:db8::1', V6_FLAG | 0x20010db8000000000000000000000001),
+    ('[2001:db8::1]', V6_FLAG | 0x20010db8000000000000000000000001),
+    ('fe80::1%eth0', V6_FLAG | 0xfe800000000000000000000000000001),
+    # IPv4 ánh xạ sang IPv6 quy về khoá IPv4
+    ('::ffff:10.0.0.1', 0x0A000001),
+    ('::ffff:a00:1', 0x0A000001),
+    # ::ffff:0:a.b.c.d (SIIT) không phải dạng ánh xạ
+    ('::ffff:0:10.0.0.1', V6_FLAG | 0xffff00000a000001),
+])
+def test_parse_ip(text, key):
+    assert parse_ip(text) == key
+
+
+@pytest.mark.parametrize('text', [
+    '', '1.2.3', '1.2.3.4.5', '256.1.1.1', '01.2.3.4', '1.2.3.4 ', '1.2.3.4/32',
+    'example.com', '2001:db8::g', ':::',
+])
+def test_parse_ip_rejects_invalid_input(text):
+    assert parse_ip(text) is None
+
+
+def test_ipv4_and_ipv6_keys_never_collide():
+    v4 = parse_ip('0.0.0.1')
+    v6 = parse_ip('::1')
+    assert v4 != v6
+    assert address_bits(v4) == 32 and address_bits(v6) == 128
+    assert v4 <= V4_MAX < v6
+
+
+@pytest.mark.parametrize('text', ['10.0.0.1', '255.255.255.255', '::1', '2001:db8::8:800:200c:417a'])
+def test_format_round_trip(text):
+    key = parse_ip(text)
+    assert format_ip(key) == text
+    assert from_packed(to_packed(key)) == key
+
+
+@pytest.mark.parametrize('hex_addr, text', [
+    ('0100007F', '127.0.0.1'),
+    (b'0100007F', '127.0.0.1'),
+    ('00000000000000000000000001000000', '::1'),
+    ('B80D0120000000000000000001000000', '2001:db8::1'),
+    ('0000000000000000FFFF00000100007F', '127.0.0.1'),
+])
+def test_from_proc_hex(hex_addr, text):
+    assert from_proc_hex(hex_addr) == parse_ip(text)
+
+
+@pytest.mark.parametrize('ip, prefix_len, network, last', [
+    ('10.1.2.3', 24, '10.1.2.0/24', '10.1.2.255'),
+    ('10.1.2.3', 8, '10.0.0.0/8', '10.255.255.255'),
+    ('10.1.2.3', 32, '10.1.2.3/32', '10.1.2.3'),
+    ('10.1.2.3', 0, '0.0.0.0/0', '255.255.255.255'),
+    ('2001:db8:1:2::5', 64, '2001:db8:1:2::/64', '2001:db8:1:2:ffff:ffff:ffff:ffff'),
+    ('2001:db8:1:2::5', 48, '2001:db8:1::/48', '2001:db8:1:ffff:ffff:ffff:ffff:ffff'),
+])
+def test_network_key_and_format_cidr(ip, prefix_len, network, last):
+    net = network_key(parse_ip(ip), prefix_len)
+    assert format_cidr(net, prefix_len) == network
+    assert format_ip(network_last(net, prefix_len)) == last
+    # Dải IPv6 vẫn giữ cờ IPv6
+    assert address_bits(net) == address_bits(parse_ip(ip))
+
+
+def test_address_parser_columns():
+    parser = AddressParser(max_size=2)
+    lines = ['tcp 0 0 10.0.0.1:80 10.0.0.9:5000',
+             'tcp6 0 0 [2001:db8::1]:443 [2001:db8::9]:6000',
+             'tcp6 0 0 ::ffff:10.0.0.1:80 ::ffff:10.0.0.9:5001',
+             'tcp 0 0 10.0.0.1:80 bogus:1',
+             'short']
+    assert parser.parse_column(lines, 4) == [parse_ip('10.0.0.9'), parse_ip('2001:db8::9'),
+                                            parse_ip('10.0.0.9')]
+    assert len(parser._cache) <= 2
@@ -0,0 +1,112 @@
+import pytest
+
+from ip_core import network_key, network_last, parse_ip
+from ip_index import PrefixIndex, entry_to_cidrs, is_valid_entry, parse_entry
+
+
+def ip(text):
+    return parse_ip(text)
+
+
+@pytest.mark.parametrize('entry, first, last', [
+    ('10.0.0.5', '10.0.0.5', '10.0.0.5'),
+    ('10.0.0.5/32', '10.0.0.5', '10.0.0.5'),
+    ('10.0.0.0/8', '10.0.0.0', '10.255.255.255'),
+    # Bit host bị bỏ qua (strict=False)
+    ('10.1.2.3/24', '10.1.2.0', '10.1.2.255'),
+    ('10.0.0.5-10.0.0.20', '10.0.0.5', '10.0.0.20'),
+    (' 10.0.0.5 - 10.0.0.20 ', '10.0.0.5', '10.0.0.20'),
+    ('2001:db8::/32', '2001:db8::', '2001:db8:ffff:ffff:ffff:ffff:ffff:ffff'),
+    ('2001:db8::1-2001:db8::9', '2001:db8::1', '2001:db8::9'),
+    ('::ffff:10.0.0.0/120', '10.0.0.0', '10.0.0.255'),
+])
+def test_parse_entry(entry, first, last):
+    assert parse_entry(entry) == (ip(first), ip(last))
+
+
+@pytest.mark.parametrize('entry', [
+    '', '   ', 'bogus', '10.0.0.0/33', '10.0.0.256', '10.0.0.9-10.0.0.1',
+    '10.0.0.1-2001:db8::1', '2001:db8::/129',
+])
+def test_parse_entry_rejects_invalid_input(entry):
+    with pytest.raises(ValueError):
+        parse_entry(entry)
+    assert not is_valid_entry(entry)
+
+
+@pytest.mark.parametrize('entry, cidrs', [
+    ('10.0.0.5', ['10.0.0.5']),
+    ('10.0.0.0/24', ['10.0.0.0/24']),
+    ('10.0.0.0-10.0.0.4', ['10.0.0.0/30', '10.0.0.4']),
+    ('2001:db8::-2001:db8::3', ['2001:db8::/126']),
+])
+def test_entry_to_cidrs(entry, cidrs):
+    assert entry_to_cidrs(entry) == cidrs
+
+
+@pytest.mark.parametrize('entries, intervals', [
+    # Chồng nhau, lồng nhau và kề nhau được gộp
+    (['10.0.0.0/24', '10.0.0.128/25'], 1),
+    (['10.0.0.0/25', '10.0.0.128/25'], 1),
+    (['10.0.0.0-10.0.0.10', '10.0.0.5-10.0.0.20', '10.0.0.21'], 1),
+    (['10.0.0.0/24', '10.0.2.0/24'], 2),
+    (['10.0.0.0/24', '10.0.0.0/24'], 1),
+    # Không gộp qua ranh giới IPv4 / IPv6
+    (['255.255.255.255', '::/128'], 2),
+    (['10.0.0.0/8', '2001:db8::/32', 'bogus'], 2),
+    ([], 0),
+])
+def test_index_merges_intervals(entries, intervals):
+    index = PrefixIndex(entries)
+    assert len(index) == intervals
+    assert bool(index) == (intervals > 0)
+
+
+INDEX = PrefixIndex(['10.0.0.0/24', '10.0.1.0/24', '192.168.1.5', '172.16.0.10-172.16.0.20',
+                     '2001:db8::/48', '::ffff:203.0.113.0/120', 'not-an-ip'])
+
+
+@pytest.mark.parametrize('address, expected', [
+    ('10.0.0.0', True),
+    ('10.0.1.255', True),
+    ('10.0.2.0', False),
+    ('9.255.255.255', False),
+    ('192.168.1.5', True),
+    ('192.168.1.4', False),
+    ('172.16.0.10', True),
+    ('172.16.0.21', False),
+    ('2001:db8:0:ffff::1', True),
+    ('2001:db8:1::1', False),
+    # Địa chỉ ánh xạ IPv4 khớp entry IPv4 và ngược lại
+    ('::ffff:10.0.0.7', True),
+    ('203.0.113.9', True),
+    # Khoá IPv6 không khớp dải IPv4 có cùng giá trị số
+    ('::a00:1', False),
+    ('::', False),
+    ('0.0.0.0', False),
+])
+def test_index_contains(address, expected):
+    assert INDEX.contains(ip(address)) is expected
+    assert INDEX.contains_ip(address) is expected
+
+
+def test_index_keeps_valid_entries_and_rejects_invalid_lookups():
+    assert INDEX.entries == ['10.0.0.0/24', '10.0.1.0/24', '192.168.1.5', '172.16.0.10-172.16.0.20',
+                             '2001:db8::/48', '::ffff:203.0.113.0/120']
+    assert not INDEX.contains_ip('bogus')
+    assert not PrefixIndex().contains(ip('10.0.0.1'))
+    assert not PrefixIndex().contains(ip('::1'))
+
+
+@pytest.mark.parametrize('network, prefix_len, expected', [
+    ('10.0.0.0', 16, True),      # chứa các entry
+    ('10.0.1.128', 25, True),    # nằm trong entry
+    ('10.0.2.0', 24, False),
+    ('172.16.0.0', 28, True),    # giao một phần với dải
+    ('172.16.0.0', 29, False),
+    ('2001:db8::', 32, True),
+    ('2001:db9::', 32, False),
+])
+def test_index_overlaps(network, prefix_len, expected):
+    net = network_key(ip(network), prefix_len)
+    assert INDEX.overlaps(net, network_last(net, prefix_len)) is expected
@@ -0,0 +1,30 @@
+import re
+
+import pytest
+
+from metrics import DEFAULT_BUCKETS, Histogram, Registry
+
+
+@pytest.mark.parametrize('openmetrics', [False, True])
+def test_histogram_bucket_labels_are_canonical_floats(openmetrics):
+    registry = Registry()
+    histogram = Histogram('t_seconds', 'test', ['stage'], buckets=(0.005, 1, 2.5, 30),
+                          registry=registry)
+    histogram.labels('detect').observe(0.7)
+    histogram.labels('detect').observe(100)
+    text = registry.render(openmetrics)
+    assert re.findall(r'le="([^"]*)"', text) == ['0.005', '1.0', '2.5', '30.0', '+Inf']
+    assert 't_seconds_bucket{stage="detect",le="1.0"} 1' in text
+    assert 't_seconds_bucket{stage="detect",le="30.0"} 1' in text
+    assert 't_seconds_bucket{stage="detect",le="+Inf"} 2' in text
+    assert 't_seconds_count{stage="detect"} 2' in text
+    assert text.endswith('# EOF\n') == openmetrics
+
+
+def test_default_buckets_round_trip_through_float():
+    registry = Registry()
+    Histogram('d_seconds', 'test', registry=registry).observe(1)
+    labels = re.findall(r'le="([^"]*)"', registry.render())
+    assert labels[-1] == '+Inf'
+    assert [float(label) for label in labels[:-1]] == list(DEFAULT_BUCKETS)
+    assert all('.' in label or 'e' in label for label in labels[:-1])
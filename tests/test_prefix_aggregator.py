@@ -0,0 +1,45 @@
+from ip_core import parse_ip
+from prefix_aggregator import PrefixAggregator
+
+
+def counts(base, hosts, each):
+    prefix = parse_ip(base)
+    return {prefix + host: each for host in hosts}
+
+
+def test_fired_child_not_subtracted_twice_from_grandparent():
+    agg = PrefixAggregator(60, 12, {24: 100, 20: 150, 16: 250}, min_sources=1)
+    tick = {}
+    # /24 10.0.0.0 vượt ngưỡng: 120
+    tick.update(counts('10.0.0.0', range(6), 20))
+    # Phần còn lại của /20 10.0.0.0 ngoài /24 trên: 180 > 150
+    for third in (1, 2, 3):
+        tick.update(counts(f'10.0.{third}.0', range(6), 10))
+    # Ngoài /20 trên: 288 rải qua bốn /20 khác, không dải con nào vượt ngưỡng
+    for third in (16, 32, 48, 64):
+        tick.update(counts(f'10.0.{third}.0', range(6), 12))
+    agg.update(tick, 0)
+
+    result = agg.offenders(0)
+    assert ('10.0.0.0/24', 120, 6) in result
+    assert ('10.0.0.0/20', 180, 24) in result
+    # Trừ 120 + 180, không trừ thêm lần nữa phần /24 nằm trong /20
+    assert ('10.0.0.0/16', 288, 48) in result
+
+
+def test_parent_below_threshold_after_claiming_children():
+    agg = PrefixAggregator(60, 12, {24: 100, 16: 250}, min_sources=1)
+    tick = counts('10.0.0.0', range(10), 30)
+    tick.update(counts('10.0.5.0', range(10), 10))
+    agg.update(tick, 0)
+
+    assert agg.offenders(0) == [('10.0.0.0/24', 300, 10)]
+
+
+def test_min_sources_and_skip():
+    agg = PrefixAggregator(60, 12, {24: 100}, min_sources=5)
+    agg.update(counts('10.0.0.0', range(2), 100), 0)
+    agg.update(counts('10.0.9.0', range(5), 50), 0)
+
+    assert agg.offenders(0) == [('10.0.9.0/24', 250, 5)]
+    assert agg.offenders(0, skip=lambda net, plen: True) == []
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+import pytest
+
+import auto_block
+from async_runtime import AsyncRuntime
+from auto_block import DosDetector
+from firewall_backend import MemoryBlocklist
+from ip_core import parse_ip
+from replay import FeedCollector, MemoryAlerts
+
+ATTACKER = '203.0.113.9'
+
+
+class Stop(BaseException):
+    """Thoát vòng lặp run() (vòng lặp chỉ bắt Exception)"""
+
+
+def make_detector(config):
+    config.update(check_interval=0.05, syn_threshold=50, conn_threshold=100, ban_durations=[],
+                  drop_poll_interval=0)
+    feed = FeedCollector()
+    feed.sample = ({parse_ip(ATTACKER): 1000}, {})
+    return DosDetector(collector=feed, blocklist=MemoryBlocklist(), alerts=MemoryAlerts(),
+                       watch_config=False)
+
+
+def blocked(detector):
+    return [alert['ip'] for alert in detector.alerts.alerts if alert['action'] == 'BLOCKED']
+
+
+def test_sync_cycle_without_config_watcher(config, monkeypatch, caplog):
+    detector = make_detector(config)
+    assert detector.config_watcher is None
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        raise Stop
+
+    monkeypatch.setattr(auto_block.time, 'sleep', sleep)
+    with caplog.at_level(logging.ERROR), pytest.raises(Stop):
+        detector.run()
+    assert not caplog.records
+    assert sleeps == [detector.next_interval()]
+    assert blocked(detector) == [ATTACKER]
+
+
+def test_async_cycle_without_config_watcher(config, caplog):
+    detector = make_detector(config)
+
+    async def scenario():
+        runtime = asyncio.create_task(AsyncRuntime(detector).run())
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if blocked(detector) or runtime.done():
+                break
+        runtime.cancel()
+        await asyncio.gather(runtime, return_exceptions=True)
+        return runtime
+
+    with caplog.at_level(logging.ERROR):
+        runtime = asyncio.run(scenario())
+    assert runtime.cancelled()
+    assert not caplog.records
+    assert blocked(detector) == [ATTACKER]
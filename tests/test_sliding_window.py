@@ -0,0 +1,82 @@
+import pytest
+
+from sliding_window import SlidingWindowCounter
+
+
+@pytest.fixture
+def counter():
+    # 6 bucket, mỗi bucket 10 giây
+    return SlidingWindowCounter(60, 6)
+
+
+def test_buckets_rotate_out_at_window_boundaries(counter):
+    counter.add('a', 5, 0)
+    counter.add('a', 3, 15)
+    counter.add('a', 2, 59.9)
+    assert counter.get('a', 59.9) == 10
+    # t=60 mở lại bucket của t=0
+    assert counter.get('a', 60) == 5
+    assert counter.get('a', 69.9) == 5
+    assert counter.get('a', 70) == 2
+    assert counter.get('a', 109.9) == 2
+    assert counter.get('a', 110) == 0
+
+
+@pytest.mark.parametrize('added_at, now, expected', [
+    (0, 9.9, 4),    # cùng bucket
+    (0, 59.9, 4),   # bucket cuối còn trong cửa sổ
+    (0, 60, 0),     # trượt ra đúng ranh giới
+    (25, 79.9, 4),
+    (25, 80, 0),
+])
+def test_count_expires_after_time_window(counter, added_at, now, expected):
+    counter.add('a', 4, added_at)
+    assert counter.get('a', now) == expected
+
+
+def test_get_and_items_report_window_totals(counter):
+    counter.update({'a': 1, 'b': 2}, 0)
+    counter.update({'a': 10, 'c': 7}, 30)
+    assert counter.get('a', 30) == 11
+    assert counter.get('missing', 30) == 0
+    assert dict(counter.items(30)) == {'a': 11, 'b': 2, 'c': 7}
+    # 'b' đã hết số đếm nên không còn trong items(), nhưng vẫn được giữ tới expire()
+    assert dict(counter.items(60)) == {'a': 10, 'c': 7}
+    assert 'b' in counter and len(counter) == 3
+
+
+def test_expire_drops_only_keys_idle_for_a_full_window(counter):
+    counter.add('old', 1, 0)
+    counter.add('new', 1, 30)
+    # get() trượt cửa sổ nhưng không làm key 'old' mới lại
+    counter.get('old', 50)
+    assert counter.expire(59.9) == 0
+    assert counter.expire(60) == 1
+    assert list(counter) == ['new']
+    assert counter.expire(90) == 1
+    assert len(counter) == 0
+
+
+def test_large_clock_jump_clears_every_bucket(counter):
+    counter.add('a', 7, 0)
+    counter.add('a', 3, 40)
+    assert counter.get('a', 1e9) == 0
+    counter.add('a', 2, 1e9)
+    assert counter.get('a', 1e9) == 2
+    assert dict(counter.items(1e9 + 5)) == {'a': 2}
+
+
+def test_jump_just_inside_window_keeps_recent_buckets(counter):
+    counter.add('a', 1, 0)
+    counter.add('a', 2, 10)
+    counter.add('a', 4, 50)
+    # 5 bucket sau: chỉ bucket t=0 bị xoá
+    assert counter.get('a', 65) == 6
+
+
+def test_remove_and_memory(counter):
+    counter.update({'a': 1, 'b': 1}, 0)
+    assert counter.memory_bytes() == 2 * (6 * 4 + 64)
+    counter.remove('a')
+    counter.remove('missing')
+    assert list(counter) == ['b']
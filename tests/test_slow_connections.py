@@ -0,0 +1,62 @@
+from slow_connections import SlowConnectionMonitor
+
+MIN_AGE, MAX_RATE, MIN_WINDOW = 30, 50, 1024
+POLL = 5
+CLIENT = 0x0A000005
+
+
+def poll_all(connection, duration=120):
+    """Đọc mỗi POLL giây; connection(t) trả về (nhận, ack, còn chờ?, cửa sổ, giây rảnh)"""
+    monitor = SlowConnectionMonitor()
+    flagged = []
+    for t in range(0, duration + 1, POLL):
+        stalled = monitor.update({1: (CLIENT,) + connection(t)}, float(t),
+                                 MIN_AGE, MAX_RATE, MIN_WINDOW)
+        if stalled.get(CLIENT):
+            flagged.append(t)
+    return flagged
+
+
+def test_idle_keepalive_connection_is_not_flagged():
+    # Một request / response đầu rồi rảnh, giữ kết nối keep-alive
+    def keepalive(t):
+        return (400, 3000, False, 65535, max(t - 2, 0))
+    assert poll_all(keepalive, 600) == []
+
+
+def test_small_idle_exchange_is_not_flagged():
+    # Lần trao đổi đầu quá nhỏ để tính là nhanh, sau đó rảnh
+    def tiny(t):
+        return (80, 120, False, 65535, max(t - 6, 0)) if t >= 5 else (0, 0, False, 65535, 0)
+    assert poll_all(tiny) == []
+
+
+def test_trickling_slowloris_is_flagged():
+    # Gửi một dòng header 20 byte mỗi 10 giây, không bao giờ xong request
+    def slowloris(t):
+        return (20 * (t // 10), 0, False, 65535, t % 10)
+    flagged = poll_all(slowloris)
+    assert flagged and flagged[0] >= MIN_AGE
+    assert flagged == list(range(flagged[0], 121, POLL))
+
+
+def test_small_window_slow_read_is_flagged():
+    # Response còn chờ, peer quảng bá cửa sổ 64 byte và ack nhỏ giọt
+    def slow_read(t):
+        return (300, 64 * t, True, 64, 50)
+    flagged = poll_all(slow_read)
+    assert flagged and flagged[0] >= MIN_AGE
+
+
+def test_fast_transfer_is_not_flagged():
+    def download(t):
+        return (300, 100000 * t, True, 65535, 40)
+    assert poll_all(download) == []
+
+
+def test_closed_connections_are_forgotten():
+    monitor = SlowConnectionMonitor()
+    monitor.update({1: (CLIENT, 0, 0, True, 64, 0)}, 0.0, MIN_AGE, MAX_RATE, MIN_WINDOW)
+    assert len(monitor) == 1
+    monitor.update({}, 5.0, MIN_AGE, MAX_RATE, MIN_WINDOW)
+    assert len(monitor) == 0 and monitor.total_stalled() == 0
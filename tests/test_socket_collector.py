@@ -0,0 +1,270 @@
+import errno
+import socket
+import struct
+from collections import defaultdict
+
+import pytest
+
+from ip_core import parse_ip
+from socket_collector import (_BC_OP, _NLATTR, _NLMSG_HDR, _TCPI, _TCPI_WND, INET_DIAG_BC_JMP,
+                              INET_DIAG_BC_S_GE, INET_DIAG_BC_S_LE, INET_DIAG_INFO, NLMSG_DONE,
+                              NLMSG_ERROR, SOCK_DIAG_BY_FAMILY, TCP_ESTABLISHED, TCP_SYN_RECV,
+                              ConnectionTracker, NetlinkCollector, ProcNetCollector,
+                              TcpInfoCollector, port_filter)
+
+# inet_diag_msg: family, state, timer, retrans, sport, dport, src, dst, if, cookie,
+# expires, rqueue, wqueue, uid, inode
+_DIAG_MSG = struct.Struct('=BBBB2s2s16s16sI8x5I')
+INET_DIAG_SHUTDOWN = 8
+
+PROC_HEADER = (b'  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt'
+               b'   uid  timeout inode\n')
+
+
+def proc_line(n, local, remote, state):
+    return (f"{n:4d}: {local} {remote} {state} 00000000:00000000 00:00000000 00000000"
+            f"     0        0 {1000 + n} 1 0000000000000000 100 0 0 10 0\n").encode()
+
+
+PROC_TCP = PROC_HEADER + b''.join([
+    proc_line(0, '00000000:0050', '00000000:0000', '0A'),           # LISTEN, bỏ qua
+    proc_line(1, '0100000A:0050', '0900000A:C350', '01'),           # 10.0.0.9 ESTABLISHED
+    proc_line(2, '0100000A:0050', '0900000A:C351', '03'),           # 10.0.0.9 SYN_RECV
+    proc_line(3, '0100000A:0050', '0700000A:C352', '03'),           # 10.0.0.7 SYN_RECV
+    proc_line(4, '0100000A:0050', '0700000A:C353', '06'),           # TIME_WAIT, bỏ qua
+])
+
+PROC_TCP6 = PROC_HEADER + b''.join([
+    # 2001:db8::9 ESTABLISHED (mỗi từ 32 bit in little-endian)
+    proc_line(0, '00000000000000000000000001000000:01BB',
+              'B80D0120000000000000000009000000:D431', '01'),
+    # ::ffff:10.0.0.9 SYN_RECV, quy về khoá IPv4
+    proc_line(1, '0000000000000000FFFF00000100000A:01BB',
+              '0000000000000000FFFF00000900000A:D432', '03'),
+])
+
+
+def test_proc_parse_counts_syn_and_established():
+    collector = ProcNetCollector()
+    syn, conn, tuples = defaultdict(int), defaultdict(int), {}
+    assert collector.parse(PROC_TCP, syn, conn, tuples) == 3
+    assert collector.parse(PROC_TCP6, syn, conn, tuples) == 2
+    v4_9, v4_7, v6_9 = parse_ip('10.0.0.9'), parse_ip('10.0.0.7'), parse_ip('2001:db8::9')
+    assert dict(syn) == {v4_9: 2, v4_7: 1}
+    assert dict(conn) == {v4_9: 3, v4_7: 1, v6_9: 1}
+    # Mỗi socket một 4-tuple riêng
+    assert len(tuples) == 5
+    assert sorted(tuples.values()) == sorted([v4_9, v4_9, v4_7, v6_9, v4_9])
+
+
+@pytest.mark.parametrize('data', [b'', PROC_HEADER, PROC_HEADER + b'garbage\n'])
+def test_proc_parse_ignores_empty_or_malformed_files(data):
+    assert ProcNetCollector().parse(data, {}, {}) == 0
+
+
+def test_proc_collect_tracks_new_connections(tmp_path):
+    path = tmp_path / 'tcp'
+    path.write_bytes(PROC_TCP)
+    collector = ProcNetCollector(paths=(str(path), str(tmp_path / 'missing')),
+                                 track_connections=True)
+    syn, conn = collector.collect()
+    assert collector.last_socket_count == 3
+    # Lần đầu chỉ làm mốc
+    assert collector.last_new_connections == {}
+
+    path.write_bytes(PROC_HEADER + b''.join([
+        proc_line(1, '0100000A:0050', '0900000A:C350', '01'),       # giữ nguyên
+        proc_line(2, '0100000A:0050', '0900000A:C354', '01'),       # mới
+        proc_line(3, '0100000A:0050', '0800000A:C355', '03'),       # mới
+    ]))
+    collector.collect()
+    assert collector.last_new_connections == {parse_ip('10.0.0.9'): 1, parse_ip('10.0.0.8'): 1}
+    assert collector.tracker.opened == 2 and collector.tracker.closed == 2
+
+
+def test_connection_tracker_counts_only_new_tuples():
+    tracker = ConnectionTracker()
+    assert tracker.diff({1: 'a', 2: 'a', 3: 'b'}) == {}
+    assert tracker.diff({1: 'a', 2: 'a', 3: 'b'}) == {}
+    assert (tracker.opened, tracker.closed) == (0, 0)
+    assert dict(tracker.diff({1: 'a', 4: 'a', 5: 'a', 6: 'c'})) == {'a': 2, 'c': 1}
+    assert (tracker.opened, tracker.closed) == (3, 2)
+    assert tracker.diff({}) == {}
+    assert (tracker.opened, tracker.closed) == (0, 4)
+    tracker.reset()
+    assert tracker.diff({7: 'a'}) == {}
+
+
+# ---------- netlink ----------
+def nlmsg(msg_type, body):
+    length = _NLMSG_HDR.size + len(body)
+    return _NLMSG_HDR.pack(length, msg_type, 2, 1, 0) + body + bytes(-length % 4)
+
+
+def nlattr(attr_type, payload):
+    length = _NLATTR.size + len(payload)
+    return _NLATTR.pack(length, attr_type) + payload + bytes(-length % 4)
+
+
+def diag_msg(remote, state=TCP_ESTABLISHED, sport=80, dport=50000, attrs=b''):
+    if ':' in remote:
+        family, local = socket.AF_INET6, socket.inet_pton(socket.AF_INET6, '2001:db8::1')
+        raw = socket.inet_pton(socket.AF_INET6, remote)
+    else:
+        family, local = socket.AF_INET, socket.inet_aton('10.0.0.1') + bytes(12)
+        raw = socket.inet_aton(remote) + bytes(12)
+    body = _DIAG_MSG.pack(family, state, 0, 0, struct.pack('!H', sport), struct.pack('!H', dport),
+                          local, raw, 0, 0, 0, 0, 0, 0)
+    return nlmsg(SOCK_DIAG_BY_FAMILY, body + attrs)
+
+
+def done():
+    return nlmsg(NLMSG_DONE, bytes(4))
+
+
+def error(code):
+    # nlmsgerr: error âm + header của yêu cầu gốc
+    return nlmsg(NLMSG_ERROR, struct.pack('=i', -code) + bytes(_NLMSG_HDR.size))
+
+
+def parse_netlink(datagram):
+    syn, conn, tuples = defaultdict(int), defaultdict(int), {}
+    counted = NetlinkCollector().parse(datagram, syn, conn, tuples)
+    return counted, dict(syn), dict(conn), tuples
+
+
+def test_netlink_parse_counts_sockets_until_done():
+    datagram = (diag_msg('10.0.0.9', TCP_SYN_RECV, dport=50000)
+                + diag_msg('10.0.0.9', TCP_ESTABLISHED, dport=50001)
+                + diag_msg('2001:db8::9', TCP_ESTABLISHED)
+                + diag_msg('::ffff:10.0.0.7', TCP_SYN_RECV)
+                + done()
+                # Sau NLMSG_DONE không còn gì được đếm
+                + diag_msg('10.0.0.99'))
+    counted, syn, conn, tuples = parse_netlink(datagram)
+    v4_9, v4_7, v6_9 = parse_ip('10.0.0.9'), parse_ip('10.0.0.7'), parse_ip('2001:db8::9')
+    assert counted == 4
+    assert syn == {v4_9: 1, v4_7: 1}
+    assert conn == {v4_9: 2, v4_7: 1, v6_9: 1}
+    assert len(tuples) == 4
+    assert NetlinkCollector._is_last(datagram)
+    assert not NetlinkCollector._is_last(diag_msg('10.0.0.9'))
+
+
+def test_netlink_error_raises_with_errno():
+    with pytest.raises(OSError) as raised:
+        parse_netlink(diag_msg('10.0.0.9') + error(errno.EPERM))
+    assert raised.value.errno == errno.EPERM
+    assert NetlinkCollector._is_last(error(errno.EPERM))
+
+
+def test_netlink_ack_ends_parsing():
+    counted, _, conn, _ = parse_netlink(diag_msg('10.0.0.9') + error(0) + diag_msg('10.0.0.8'))
+    assert counted == 1 and conn == {parse_ip('10.0.0.9'): 1}
+
+
+def test_netlink_truncated_header_stops_parsing():
+    datagram = diag_msg('10.0.0.9') + _NLMSG_HDR.pack(4, SOCK_DIAG_BY_FAMILY, 0, 0, 0)
+    assert parse_netlink(datagram)[0] == 1
+
+
+def test_netlink_fixture_round_trip(tmp_path):
+    path = str(tmp_path / 'dump.bin')
+    datagrams = [diag_msg('10.0.0.9', TCP_SYN_RECV) + diag_msg('10.0.0.9'),
+                 diag_msg('2001:db8::9') + done()]
+    NetlinkCollector(record_path=path).save_fixture(datagrams)
+    collector = NetlinkCollector(fixture_path=path, track_connections=True)
+    syn, conn = collector.collect()
+    assert dict(syn) == {parse_ip('10.0.0.9'): 1}
+    assert dict(conn) == {parse_ip('10.0.0.9'): 2, parse_ip('2001:db8::9'): 1}
+    assert collector.last_socket_count == 3
+    assert collector.last_new_connections == {}
+
+
+# ---------- tcp_info ----------
+def tcp_info(unacked=0, last_recv=0, acked=0, received=0, notsent=0, window=None):
+    if window is None:
+        return _TCPI.pack(unacked, last_recv, acked, received, notsent)
+    return _TCPI_WND.pack(unacked, last_recv, acked, received, notsent, window)
+
+
+def info_msg(remote, info, sport=80, dport=50000):
+    attrs = nlattr(INET_DIAG_SHUTDOWN, b'\x00') + nlattr(INET_DIAG_INFO, info)
+    return diag_msg(remote, sport=sport, dport=dport, attrs=attrs)
+
+
+def test_tcp_info_parse_reads_fields():
+    collector = TcpInfoCollector([80, 443])
+    datagram = (info_msg('10.0.0.9', tcp_info(2, 1500, 4000, 300, 0, 512))
+                + info_msg('2001:db8::9', tcp_info(0, 250, 10, 20, 7), sport=443)
+                # Cổng khác (kernel không lọc): bỏ qua
+                + info_msg('10.0.0.8', tcp_info(), sport=22)
+                # Không có tcp_info đủ dài: bỏ qua
+                + info_msg('10.0.0.7', bytes(40))
+                + done())
+    sockets = {}
+    assert collector.parse(datagram, sockets) == 2
+    assert sorted(sockets.values()) == sorted([
+        (parse_ip('10.0.0.9'), 300, 4000, True, 512, 1.5),
+        (parse_ip('2001:db8::9'), 20, 10, True, None, 0.25),
+    ])
+
+
+def test_tcp_info_parse_idle_connection_has_nothing_waiting():
+    sockets = {}
+    TcpInfoCollector([80]).parse(info_msg('10.0.0.9', tcp_info(0, 60000, 900, 400, 0, 65535)),
+                                 sockets)
+    assert list(sockets.values()) == [(parse_ip('10.0.0.9'), 400, 900, False, 65535, 60.0)]
+
+
+def test_tcp_info_parse_raises_on_netlink_error():
+    with pytest.raises(OSError) as raised:
+        TcpInfoCollector([80]).parse(error(errno.EINVAL), {})
+    assert raised.value.errno == errno.EINVAL
+
+
+def test_tcp_info_falls_back_to_userspace_port_filter():
+    collector = TcpInfoCollector([80])
+    requests = []
+
+    def dump():
+        requests.append(collector.kernel_filter)
+        if collector.kernel_filter:
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        return [info_msg('10.0.0.9', tcp_info(received=5))
+                + info_msg('10.0.0.8', tcp_info(), sport=8080) + done()]
+
+    collector.dump = dump
+    sockets = collector.collect()
+    assert requests == [True, False]
+    assert [value[0] for value in sockets.values()] == [parse_ip('10.0.0.9')]
+    assert collector.last_socket_count == 1
+
+
+def run_bytecode(bytecode, sport):
+    """Chạy bytecode như inet_diag_bc_run của kernel với cổng local sport"""
+    offset, remaining = 0, len(bytecode)
+    while remaining > 0:
+        code, yes, no = _BC_OP.unpack_from(bytecode, offset)
+        if code == INET_DIAG_BC_JMP:
+            matched = False
+        elif code == INET_DIAG_BC_S_GE:
+            matched = sport >= _BC_OP.unpack_from(bytecode, offset + 4)[2]
+        elif code == INET_DIAG_BC_S_LE:
+            matched = sport <= _BC_OP.unpack_from(bytecode, offset + 4)[2]
+        else:
+            raise AssertionError(f"mã lệnh lạ {code}")
+        step = yes if matched else no
+        offset += step
+        remaining -= step
+    return remaining == 0
+
+
+@pytest.mark.parametrize('ports', [[80], [80, 443], [22, 80, 443, 8080]])
+def test_port_filter_accepts_only_listed_ports(ports):
+    bytecode = port_filter(ports)
+    assert len(bytecode) == 20 * len(ports)
+    for port in ports:
+        assert run_bytecode(bytecode, port)
+    for port in {0, 79, 81, 442, 444, 8081, 65535} - set(ports):
+        assert not run_bytecode(bytecode, port)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Bánh xe hẹn giờ phân cấp (hierarchical timer wheel)
+
+Thời gian được chia thành tick (mặc định 1 giây). Tầng 0 có `slots` ô, mỗi ô
+một tick; mỗi ô của tầng L trải `slots**L` tick. Một hẹn giờ được đặt vào
+tầng thấp nhất đủ chứa khoảng cách tới hạn của nó; khi kim tầng thấp quay
+hết một vòng, ô tương ứng của tầng trên được rải xuống tầng dưới.
+
+Đặt, huỷ hẹn giờ là O(1); mỗi tick chỉ xử lý một ô tầng 0 (cộng phần rải
+xuống, trung bình O(1) cho mỗi hẹn giờ ở mỗi tầng), không phụ thuộc tổng số
+hẹn giờ đang chờ. Hạn xa hơn tầm của bánh xe được giữ ở ô xa nhất tầng trên
+cùng và đặt lại mỗi vòng.
+"""
+
+import math
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=64, levels=4, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int(now // tick)
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self._deadlines = {}  # key -> tick hết hạn
+        self._where = {}      # key -> (tầng, ô)
+        self._due = set()     # đã tới hạn từ lúc đặt, trả về ở lần advance kế tiếp
+        self._spans = [slots ** level for level in range(levels + 1)]
+
+    def _tick_of(self, when):
+        return int(math.ceil(when / self.tick))
+
+    def _place(self, key, when):
+        delta = when - self.current
+        if delta <= 0:
+            self._due.add(key)
+            self._where[key] = (-1, None)
+            return
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        if delta >= self._spans[self.levels]:
+            # Ngoài tầm: chờ ở ô xa nhất rồi đặt lại khi ô đó được rải xuống
+            when = self.current + self._spans[self.levels] - 1
+        slot = (when // self._spans[level]) % self.slots
+        self._wheels[level][slot].add(key)
+        self._where[key] = (level, slot)
+
+    def schedule(self, key, when):
+        """Hẹn giờ cho key hết hạn vào thời điểm when (thay hẹn giờ cũ nếu có)"""
+        self.cancel(key)
+        deadline = self._tick_of(when)
+        self._deadlines[key] = deadline
+        self._place(key, deadline)
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, slot = where
+        if level < 0:
+            self._due.discard(key)
+        else:
+            self._wheels[level][slot].discard(key)
+        del self._deadlines[key]
+        return True
+
+    def deadline(self, key):
+        when = self._deadlines.get(key)
+        return None if when is None else when * self.tick
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def advance(self, now):
+        """Quay bánh xe tới thời điểm now, trả về danh sách key đã hết hạn"""
+        target = int(now // self.tick)
+        expired = []
+        self._expire_due(expired)
+        if not self._deadlines:
+            self.current = max(self.current, target)
+            return expired
+        while self.current < target:
+            self.current += 1
+            tick = self.current
+            # Rải các ô tầng trên bắt đầu đúng tick này xuống tầng dưới
+            for level in range(self.levels - 1, 0, -1):
+                span = self._spans[level]
+                if tick % span:
+                    continue
+                bucket = self._wheels[level][(tick // span) % self.slots]
+                if not bucket:
+                    continue
+                keys = list(bucket)
+                bucket.clear()
+                for key in keys:
+                    self._place(key, self._deadlines[key])
+            # Key rải xuống đúng hạn tick này nằm trong _due
+            self._expire_due(expired)
+            bucket = self._wheels[0][tick % self.slots]
+            if bucket:
+                for key in list(bucket):
+                    if self._deadlines[key] <= tick:
+                        bucket.discard(key)
+                        del self._deadlines[key]
+                        del self._where[key]
+                        expired.append(key)
+            if not self._deadlines:
+                self.current = target
+        return expired
+
+    def _expire_due(self, expired):
+        for key in self._due:
+            del self._deadlines[key]
+            del self._where[key]
+            expired.append(key)
+        self._due.clear()
@@ -3,18 +3,39 @@
 Web Dashboard để quản trị firewall
 """
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 import subprocess
-import json
-import os
 from datetime import datetime
+from http.client import HTTPException
+
+from firewall_backend import get_blocklist, FirewallBatcher
+from ip_index import is_valid_entry, entry_to_cidrs
+from alert_store import AlertReader
+from metrics import scrape
+from drop_counters import read_drop_stats
 
 app = Flask(__name__)
 
-# File lưu trữ alerts
+# File lưu trữ alerts (NDJSON, phải trùng với CONFIG['alert_file'] của auto_block.py)
 ALERT_FILE = '/var/log/firewall_alerts.json'
+alert_reader = AlertReader(ALERT_FILE)
+
+# Cách chặn, phải trùng với CONFIG['block_backend'] của auto_block.py
+BLOCK_BACKEND = 'ipset'
+
+# Endpoint metrics của daemon, phải trùng với CONFIG['metrics_*'] của auto_block.py
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+METRICS_SOCKET = None
+
+# Số gói bị drop của từng entry do daemon ghi, phải trùng với CONFIG['drop_stats_file']
+DROP_STATS_FILE = '/var/lib/firewall_auto_block/drops.json'
 
 class FirewallManager:
+    blocklist = get_blocklist(BLOCK_BACKEND)
+    # Các request block/unblock đồng thời được gom vào một giao dịch firewall
+    batcher = FirewallBatcher(blocklist)
+
     @staticmethod
     def get_iptables_rules():
         """Lấy danh sách rules iptables"""
@@ -30,66 +51,42 @@ class FirewallManager:
     @staticmethod
     def get_blocked_ips():
         """Lấy danh sách IP đang bị chặn"""
-        blocked = []
         try:
-            result = subprocess.run(
-                ['iptables', '-L', 'INPUT', '-n', '--line-numbers'],
-                capture_output=True, text=True
-            )
-            for line in result.stdout.split('\n'):
-                if 'DROP' in line:
-                    parts = line.split()
-                    for part in parts:
-                        if FirewallManager.is_valid_ip(part):
-                            blocked.append(part)
-            return list(set(blocked))
+            return list(set(FirewallManager.blocklist.list()))
         except Exception as e:
             return []
     
     @staticmethod
-    def is_valid_ip(ip):
-        """Kiểm tra IP hợp lệ"""
-        parts = ip.split('.')
-        if len(parts) != 4:
-            return False
-        try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError:
-            return False
+    def apply_batch(block=(), unblock=()):
+        """Đưa các IP vào batcher rồi commit, trả về {ip: (thành công, thông báo)}"""
+        tickets = [FirewallManager.batcher.block(ip) for ip in block]
+        tickets += [FirewallManager.batcher.unblock(ip) for ip in unblock]
+        FirewallManager.batcher.commit()
+        return {ticket.entry: ticket.wait(timeout=30) for ticket in tickets}
     
     @staticmethod
     def block_ip(ip):
-        """Chặn IP thủ công"""
-        try:
-            subprocess.run([
-                'iptables', '-I', 'INPUT', '1', '-s', ip, '-j', 'DROP'
-            ], check=True)
+        """Chặn IP thủ công (nhận cả CIDR và dải IP)"""
+        results = FirewallManager.apply_batch(block=entry_to_cidrs(ip))
+        errors = [f"{entry}: {error}" for entry, (ok, error) in results.items() if not ok]
+        if not errors:
             return True, f"Đã chặn IP {ip}"
-        except subprocess.CalledProcessError as e:
-            return False, f"Lỗi khi chặn IP: {e}"
+        return False, f"Lỗi khi chặn IP: {'; '.join(errors)}"
     
     @staticmethod
     def unblock_ip(ip):
-        """Gỡ chặn IP"""
-        try:
-            subprocess.run([
-                'iptables', '-D', 'INPUT', '-s', ip, '-j', 'DROP'
-            ], check=True)
+        """Gỡ chặn IP (nhận cả CIDR và dải IP)"""
+        results = FirewallManager.apply_batch(unblock=entry_to_cidrs(ip))
+        errors = [f"{entry}: {error}" for entry, (ok, error) in results.items() if not ok]
+        if not errors:
             return True, f"Đã gỡ chặn IP {ip}"
-        except subprocess.CalledProcessError as e:
-            return False, f"Lỗi khi gỡ chặn IP: {e}"
+        return False, f"Lỗi khi gỡ chặn IP: {'; '.join(errors)}"
     
     @staticmethod
-    def get_alerts():
-        """Lấy danh sách alerts"""
+    def get_alerts(limit=100):
+        """Lấy danh sách alerts, mới nhất trước"""
         try:
-            if os.path.exists(ALERT_FILE):
-                with open(ALERT_FILE, 'r') as f:
-                    alerts = json.load(f)
-                # Sắp xếp theo thời gian mới nhất
-                alerts.sort(key=lambda x: x['timestamp'], reverse=True)
-                return alerts
-            return []
+            return alert_reader.recent(limit)
         except Exception as e:
             return []
 
@@ -101,10 +98,15 @@ def index():
 @app.route('/api/status')
 def api_status():
     """API trạng thái hệ thống"""
+    blocked_ips = FirewallManager.get_blocked_ips()
+    drops = read_drop_stats(DROP_STATS_FILE)
     status = {
-        'blocked_ips': FirewallManager.get_blocked_ips(),
-        'total_blocked': len(FirewallManager.get_blocked_ips()),
-        'alerts': FirewallManager.get_alerts()[:10],  # 10 alerts mới nhất
+        'blocked_ips': blocked_ips,
+        'total_blocked': len(blocked_ips),
+        # {entry: gói / byte đã drop, gói/s, byte/s, lần drop cuối, hạn chặn}
+        'drops': drops.get('entries', {}),
+        'drops_updated': drops.get('time'),
+        'alerts': FirewallManager.get_alerts(10),  # 10 alerts mới nhất
         'timestamp': datetime.now().isoformat()
     }
     return jsonify(status)
@@ -115,8 +117,8 @@ def api_block_ip():
     data = request.json
     ip = data.get('ip', '').strip()
     
-    if not FirewallManager.is_valid_ip(ip):
-        return jsonify({'success': False, 'message': 'IP không hợp lệ'})
+    if not is_valid_entry(ip):
+        return jsonify({'success': False, 'message': 'IP/CIDR/dải IP không hợp lệ'})
     
     success, message = FirewallManager.block_ip(ip)
     return jsonify({'success': success, 'message': message})
@@ -127,8 +129,8 @@ def api_unblock_ip():
     data = request.json
     ip = data.get('ip', '').strip()
     
-    if not FirewallManager.is_valid_ip(ip):
-        return jsonify({'success': False, 'message': 'IP không hợp lệ'})
+    if not is_valid_entry(ip):
+        return jsonify({'success': False, 'message': 'IP/CIDR/dải IP không hợp lệ'})
     
     success, message = FirewallManager.unblock_ip(ip)
     return jsonify({'success': success, 'message': message})
@@ -139,5 +141,16 @@ def api_rules():
     rules = FirewallManager.get_iptables_rules()
     return jsonify({'rules': rules})
 
+@app.route('/metrics')
+def metrics():
+    """Xuất lại số liệu Prometheus / OpenMetrics của daemon auto_block"""
+    try:
+        content_type, body = scrape(METRICS_HOST, METRICS_PORT, METRICS_SOCKET,
+                                    request.headers.get('Accept'))
+    except (OSError, HTTPException) as e:
+        return Response(f"Không đọc được metrics của daemon: {e}\n", status=503,
+                        mimetype='text/plain')
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)